@@ -29,6 +29,70 @@ class Config:
     LATEST_PER_PAGE = 4
     RECENT_PER_PAGE = 20
 
+    # number of rendered markdown fragments kept in the in-process LRU cache
+    MYRECBLOG_RENDER_CACHE_SIZE = 1024
+
+    # uploaded pictures are saved raw and processed by a bounded pool of worker processes,
+    # 0 workers processes them within the request
+    MYRECBLOG_UPLOADS_DIR = os.path.join(basedir, 'recblog', 'static', 'uploads')
+    MYRECBLOG_RAW_UPLOADS_DIR = os.path.join(basedir, 'tmp', 'uploads')
+    MYRECBLOG_IMAGE_WORKERS = 2
+    MYRECBLOG_IMAGE_QUEUE_SIZE = 32
+    # uploads above the byte limit are rejected, requests carrying them already while the body is streamed;
+    # pictures above the pixel limit are rejected from their header, before they are decoded
+    MYRECBLOG_MAX_UPLOAD_BYTES = 10 * 1024 * 1024
+    MYRECBLOG_MAX_IMAGE_PIXELS = 40 * 1000 * 1000
+    MAX_CONTENT_LENGTH = MYRECBLOG_MAX_UPLOAD_BYTES + 1024 * 1024
+    # widths of the WebP and JPEG derivatives of recipe pictures served through srcset
+    MYRECBLOG_IMAGE_WIDTHS = (320, 640, 1024, 1560)
+
+    # seconds the in-memory ingredient index is served before it is reloaded from the database
+    MYRECBLOG_INGREDIENT_INDEX_TTL = 300
+
+    # home page sections shared by all visitors are cached for at most this many seconds,
+    # the newest posts section only for its first pages
+    MYRECBLOG_SECTION_CACHE_TTL = 60
+    MYRECBLOG_HOME_CACHED_PAGES = 5
+
+    # JSON backend of the responses: 'orjson', 'stdlib' or 'auto' for orjson when it is installed;
+    # datetimes are written as ISO 8601 UTC either way
+    MYRECBLOG_JSON_BACKEND = os.environ.get('MYRECBLOG_JSON_BACKEND') or 'auto'
+
+    # last seen times are kept with this resolution in seconds and written in batches,
+    # after the interval in seconds or once the number of waiting users is reached
+    MYRECBLOG_LAST_SEEN_RESOLUTION = 60
+    MYRECBLOG_LAST_SEEN_FLUSH_INTERVAL = 30
+    MYRECBLOG_LAST_SEEN_FLUSH_SIZE = 500
+
+    # seconds a worker may go without reading the tokens revoked by the other workers
+    MYRECBLOG_BLOCKLIST_SYNC_INTERVAL = 1
+
+    # the users of the login sessions and the roles are kept in memory for at most this many seconds,
+    # for up to this many users
+    MYRECBLOG_IDENTITY_CACHE_TTL = 30
+    MYRECBLOG_IDENTITY_CACHE_SIZE = 1024
+
+    # longest date range of the likes analytics, in days
+    MYRECBLOG_ANALYTICS_MAX_DAYS = 3660
+
+    # authors with this many followers are not copied into the timelines of their followers
+    # but merged in when a timeline is read
+    MYRECBLOG_TIMELINE_FANOUT_LIMIT = 5000
+
+    # the in-memory follow graph of the suggestions is rebuilt after this many seconds,
+    # a suggestion walks at most this many neighbours of every user
+    MYRECBLOG_FOLLOW_GRAPH_TTL = 600
+    MYRECBLOG_SUGGESTIONS_FANOUT = 200
+
+    # hashed tf-idf vectors of the recipes for the similar recipes, written by 'flask build-content-index';
+    # features in more than the share of posts are left out of the lookups, workers look for a new build
+    # after this many seconds
+    MYRECBLOG_CONTENT_INDEX_DIR = os.environ.get('MYRECBLOG_CONTENT_INDEX_DIR') or \
+        os.path.join(basedir, 'tmp', 'content_index')
+    MYRECBLOG_CONTENT_FEATURES = 2 ** 18
+    MYRECBLOG_CONTENT_MAX_DF = 0.05
+    MYRECBLOG_CONTENT_INDEX_CHECK_INTERVAL = 10
+
     # set bootswatch theme for Flask Admin 
     FLASK_ADMIN_SWATCH = 'journal'
     MYRECBLOG_ADMIN = os.environ.get('MYRECBLOG_ADMIN')
@@ -53,6 +117,12 @@ class TestingConfig(Config):
     WTF_CSRF_ENABLED = False
     PRESERVE_CONTEXT_ON_EXCEPTION = False
     LIVESERVER_PORT = 0
+    MYRECBLOG_IMAGE_WORKERS = 0
+    # every request sees the revoked tokens, keeps the query counts of the tests stable
+    MYRECBLOG_BLOCKLIST_SYNC_INTERVAL = 0
+    # tests build their own content index in a temporary directory
+    MYRECBLOG_CONTENT_INDEX_DIR = None
+    MYRECBLOG_CONTENT_INDEX_CHECK_INTERVAL = 0
 
 
 config = {
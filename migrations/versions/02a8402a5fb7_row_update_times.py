@@ -0,0 +1,34 @@
+"""Update times of posts and comments
+
+Revision ID: 02a8402a5fb7
+Revises: 76949d0a5ab0
+Create Date: 2026-10-18 22:41:09.530174
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '02a8402a5fb7'
+down_revision = '76949d0a5ab0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # SQLite can only add a NOT NULL column with a constant default without recreating the table, which would
+    # drop the full-text search triggers of posts; the columns are nullable and start at the creation dates
+    with op.batch_alter_table('posts', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+    with op.batch_alter_table('comments', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+    op.execute('UPDATE posts SET updated_at = date_posted')
+    op.execute('UPDATE comments SET updated_at = comment_date')
+
+
+def downgrade():
+    with op.batch_alter_table('comments', schema=None) as batch_op:
+        batch_op.drop_column('updated_at')
+    with op.batch_alter_table('posts', schema=None) as batch_op:
+        batch_op.drop_column('updated_at')
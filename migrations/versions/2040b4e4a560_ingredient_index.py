@@ -0,0 +1,45 @@
+"""Ingredient vocabulary and post ingredients
+
+Revision ID: 2040b4e4a560
+Revises: 2092415cd0d2
+Create Date: 2026-10-18 21:14:37.662019
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2040b4e4a560'
+down_revision = '2092415cd0d2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('ingredients',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=64), nullable=False),
+    sa.PrimaryKeyConstraint('id', name=op.f('pk_ingredients')),
+    sa.UniqueConstraint('name', name=op.f('uq_ingredients_name'))
+    )
+    op.create_table('post_ingredients',
+    sa.Column('post_id', sa.Integer(), nullable=False),
+    sa.Column('ingredient_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['ingredient_id'], ['ingredients.id'],
+                            name=op.f('fk_post_ingredients_ingredient_id_ingredients')),
+    sa.ForeignKeyConstraint(['post_id'], ['posts.id'], name=op.f('fk_post_ingredients_post_id_posts')),
+    sa.PrimaryKeyConstraint('post_id', 'ingredient_id', name=op.f('pk_post_ingredients'))
+    )
+    with op.batch_alter_table('post_ingredients', schema=None) as batch_op:
+        batch_op.create_index('ix_post_ingredients_ingredient_id_post_id', ['ingredient_id', 'post_id'],
+                              unique=False)
+    # the existing posts are parsed by 'flask index-ingredients'
+
+
+def downgrade():
+    with op.batch_alter_table('post_ingredients', schema=None) as batch_op:
+        batch_op.drop_index('ix_post_ingredients_ingredient_id_post_id')
+
+    op.drop_table('post_ingredients')
+    op.drop_table('ingredients')
@@ -0,0 +1,46 @@
+"""Posts full-text search index
+
+Revision ID: 2092415cd0d2
+Revises: d5cf60e64518
+Create Date: 2026-10-18 20:32:05.104228
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '2092415cd0d2'
+down_revision = 'd5cf60e64518'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # FTS5 external content table over posts, SQLite only
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    op.execute("CREATE VIRTUAL TABLE posts_fts USING fts5(title, description, ingredients, preparation, "
+               "content='posts', content_rowid='id', tokenize='porter unicode61 remove_diacritics 2')")
+    op.execute("INSERT INTO posts_fts(posts_fts, rank) VALUES('rank', 'bm25(10.0, 5.0, 2.0, 1.0)')")
+    op.execute("CREATE TRIGGER posts_fts_after_insert AFTER INSERT ON posts BEGIN "
+               "INSERT INTO posts_fts(rowid, title, description, ingredients, preparation) "
+               "VALUES (new.id, new.title, new.description, new.ingredients, new.preparation); END")
+    op.execute("CREATE TRIGGER posts_fts_after_delete AFTER DELETE ON posts BEGIN "
+               "INSERT INTO posts_fts(posts_fts, rowid, title, description, ingredients, preparation) "
+               "VALUES ('delete', old.id, old.title, old.description, old.ingredients, old.preparation); END")
+    op.execute("CREATE TRIGGER posts_fts_after_update AFTER UPDATE OF title, description, ingredients, "
+               "preparation ON posts BEGIN "
+               "INSERT INTO posts_fts(posts_fts, rowid, title, description, ingredients, preparation) "
+               "VALUES ('delete', old.id, old.title, old.description, old.ingredients, old.preparation); "
+               "INSERT INTO posts_fts(rowid, title, description, ingredients, preparation) "
+               "VALUES (new.id, new.title, new.description, new.ingredients, new.preparation); END")
+    op.execute("INSERT INTO posts_fts(posts_fts) VALUES('rebuild')")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    op.execute('DROP TRIGGER IF EXISTS posts_fts_after_update')
+    op.execute('DROP TRIGGER IF EXISTS posts_fts_after_delete')
+    op.execute('DROP TRIGGER IF EXISTS posts_fts_after_insert')
+    op.execute('DROP TABLE IF EXISTS posts_fts')
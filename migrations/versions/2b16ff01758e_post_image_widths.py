@@ -0,0 +1,27 @@
+"""Widths of the derivatives of the post pictures
+
+Revision ID: 2b16ff01758e
+Revises: 52682bccb2ce
+Create Date: 2026-10-19 02:14:36.582907
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2b16ff01758e'
+down_revision = '52682bccb2ce'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # filled by 'flask backfill-images', pictures are rendered without srcset until then
+    with op.batch_alter_table('posts', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('post_image_widths', sa.String(length=64), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('posts', schema=None) as batch_op:
+        batch_op.drop_column('post_image_widths')
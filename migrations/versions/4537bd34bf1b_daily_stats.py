@@ -0,0 +1,43 @@
+"""Daily activity rollups
+
+Revision ID: 4537bd34bf1b
+Revises: 89058bb6d3d8
+Create Date: 2026-10-18 23:58:12.417305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4537bd34bf1b'
+down_revision = '89058bb6d3d8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('daily_stats',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('metric', sa.String(length=16), nullable=False),
+    sa.Column('dimension', sa.String(length=16), nullable=False),
+    sa.Column('value', sa.String(length=64), nullable=False),
+    sa.Column('total', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('day', 'metric', 'dimension', 'value', name=op.f('pk_daily_stats'))
+    )
+    with op.batch_alter_table('daily_stats', schema=None) as batch_op:
+        batch_op.create_index('ix_daily_stats_metric_dimension_day', ['metric', 'dimension', 'day'], unique=False)
+
+    op.create_table('rollup_watermarks',
+    sa.Column('name', sa.String(length=64), nullable=False),
+    sa.Column('rolled_up_to', sa.Date(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('name', name=op.f('pk_rollup_watermarks'))
+    )
+
+
+def downgrade():
+    op.drop_table('rollup_watermarks')
+    with op.batch_alter_table('daily_stats', schema=None) as batch_op:
+        batch_op.drop_index('ix_daily_stats_metric_dimension_day')
+    op.drop_table('daily_stats')
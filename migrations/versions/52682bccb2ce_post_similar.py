@@ -0,0 +1,35 @@
+"""Posts liked by the same people
+
+Revision ID: 52682bccb2ce
+Revises: a2923e191cd1
+Create Date: 2026-10-19 01:27:44.903516
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '52682bccb2ce'
+down_revision = 'a2923e191cd1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('post_similar',
+    sa.Column('post_id', sa.Integer(), nullable=False),
+    sa.Column('similar_post_id', sa.Integer(), nullable=False),
+    sa.Column('score', sa.Float(), nullable=False),
+    sa.ForeignKeyConstraint(['post_id'], ['posts.id'], name=op.f('fk_post_similar_post_id_posts')),
+    sa.ForeignKeyConstraint(['similar_post_id'], ['posts.id'], name=op.f('fk_post_similar_similar_post_id_posts')),
+    sa.PrimaryKeyConstraint('post_id', 'similar_post_id', name=op.f('pk_post_similar'))
+    )
+    with op.batch_alter_table('post_similar', schema=None) as batch_op:
+        batch_op.create_index('ix_post_similar_similar_post_id', ['similar_post_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('post_similar', schema=None) as batch_op:
+        batch_op.drop_index('ix_post_similar_similar_post_id')
+    op.drop_table('post_similar')
@@ -0,0 +1,41 @@
+"""Parsed post durations and portions
+
+Revision ID: 76949d0a5ab0
+Revises: 2040b4e4a560
+Create Date: 2026-10-18 22:03:51.418230
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '76949d0a5ab0'
+down_revision = '2040b4e4a560'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the columns are filled by `flask backfill-quantities`
+    with op.batch_alter_table('posts', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('cook_minutes', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('prep_minutes', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('ready_minutes', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('total_minutes', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('portions_count', sa.Integer(), nullable=True))
+        batch_op.create_index('ix_posts_total_minutes_id', ['total_minutes', 'id'], unique=False)
+        batch_op.create_index('ix_posts_cook_minutes', ['cook_minutes'], unique=False)
+        batch_op.create_index('ix_posts_portions_count', ['portions_count'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('posts', schema=None) as batch_op:
+        batch_op.drop_index('ix_posts_portions_count')
+        batch_op.drop_index('ix_posts_cook_minutes')
+        batch_op.drop_index('ix_posts_total_minutes_id')
+        batch_op.drop_column('portions_count')
+        batch_op.drop_column('total_minutes')
+        batch_op.drop_column('ready_minutes')
+        batch_op.drop_column('prep_minutes')
+        batch_op.drop_column('cook_minutes')
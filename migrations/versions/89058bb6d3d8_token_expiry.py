@@ -0,0 +1,37 @@
+"""Expiry of revoked tokens
+
+Revision ID: 89058bb6d3d8
+Revises: 02a8402a5fb7
+Create Date: 2026-10-18 23:27:44.102958
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '89058bb6d3d8'
+down_revision = '02a8402a5fb7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # blacklist_tokens exists on the model but no earlier migration creates it
+    if 'blacklist_tokens' not in sa.inspect(op.get_bind()).get_table_names():
+        op.create_table('blacklist_tokens',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('token', sa.String(length=500), nullable=False),
+        sa.Column('blacklisted_on', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id', name=op.f('pk_blacklist_tokens')),
+        sa.UniqueConstraint('token', name=op.f('uq_blacklist_tokens_token'))
+        )
+    with op.batch_alter_table('blacklist_tokens', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('expires_at', sa.DateTime(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_blacklist_tokens_expires_at'), ['expires_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('blacklist_tokens', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_blacklist_tokens_expires_at'))
+        batch_op.drop_column('expires_at')
@@ -0,0 +1,55 @@
+"""Followed posts timeline
+
+Revision ID: a2923e191cd1
+Revises: 4537bd34bf1b
+Create Date: 2026-10-19 00:41:05.268114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a2923e191cd1'
+down_revision = '4537bd34bf1b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('timeline_pull', sa.Boolean(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_users_timeline_pull'), ['timeline_pull'], unique=False)
+
+    op.create_table('timeline',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('post_id', sa.Integer(), nullable=False),
+    sa.Column('author_id', sa.Integer(), nullable=False),
+    sa.Column('date_posted', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['author_id'], ['users.id'], name=op.f('fk_timeline_author_id_users')),
+    sa.ForeignKeyConstraint(['post_id'], ['posts.id'], name=op.f('fk_timeline_post_id_posts')),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], name=op.f('fk_timeline_user_id_users')),
+    sa.PrimaryKeyConstraint('user_id', 'post_id', name=op.f('pk_timeline'))
+    )
+    with op.batch_alter_table('timeline', schema=None) as batch_op:
+        batch_op.create_index('ix_timeline_user_id_date_posted_post_id', ['user_id', 'date_posted', 'post_id'],
+                              unique=False)
+        batch_op.create_index('ix_timeline_post_id', ['post_id'], unique=False)
+        batch_op.create_index('ix_timeline_author_id', ['author_id'], unique=False)
+
+    # every author is fanned out to start with, 'flask rebuild-timelines' pulls the most followed ones
+    op.execute('INSERT INTO timeline (user_id, post_id, author_id, date_posted) '
+               'SELECT follows.follower_id, posts.id, posts.user_id, posts.date_posted '
+               'FROM follows JOIN posts ON posts.user_id = follows.followed_id')
+
+
+def downgrade():
+    with op.batch_alter_table('timeline', schema=None) as batch_op:
+        batch_op.drop_index('ix_timeline_author_id')
+        batch_op.drop_index('ix_timeline_post_id')
+        batch_op.drop_index('ix_timeline_user_id_date_posted_post_id')
+    op.drop_table('timeline')
+
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_users_timeline_pull'))
+        batch_op.drop_column('timeline_pull')
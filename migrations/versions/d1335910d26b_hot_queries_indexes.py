@@ -0,0 +1,67 @@
+"""Indexes for the hot queries
+
+Revision ID: d1335910d26b
+Revises: f20faef90612
+Create Date: 2026-10-18 11:05:47.881203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd1335910d26b'
+down_revision = 'f20faef90612'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # favorites.date_liked exists on the model but the initial migration does not create it
+    favorites_columns = [column['name'] for column in sa.inspect(op.get_bind()).get_columns('favorites')]
+    if 'date_liked' not in favorites_columns:
+        with op.batch_alter_table('favorites', schema=None, recreate='always') as batch_op:
+            batch_op.add_column(sa.Column('date_liked', sa.DateTime(), server_default=sa.func.current_timestamp(),
+                                          nullable=False))
+
+    # drop duplicated likes before the unique index is created, the earliest like is kept
+    op.execute('DELETE FROM favorites WHERE id NOT IN '
+               '(SELECT MIN(id) FROM favorites GROUP BY post_id, liker_id)')
+    op.execute('UPDATE posts SET favored_count = '
+               '(SELECT COUNT(*) FROM favorites WHERE favorites.post_id = posts.id)')
+
+    with op.batch_alter_table('posts', schema=None) as batch_op:
+        batch_op.create_index('ix_posts_date_posted_id', ['date_posted', 'id'], unique=False)
+        batch_op.create_index('ix_posts_type_category_date_posted', ['type_category', 'date_posted'], unique=False)
+        batch_op.create_index('ix_posts_user_id_date_posted', ['user_id', 'date_posted'], unique=False)
+
+    with op.batch_alter_table('follows', schema=None) as batch_op:
+        batch_op.create_index('ix_follows_followed_id_follower_id', ['followed_id', 'follower_id'], unique=False)
+
+    with op.batch_alter_table('comments', schema=None) as batch_op:
+        batch_op.create_index('ix_comments_post_id_comment_date', ['post_id', 'comment_date'], unique=False)
+        batch_op.create_index('ix_comments_author_id', ['author_id'], unique=False)
+
+    with op.batch_alter_table('favorites', schema=None) as batch_op:
+        batch_op.create_index('uq_favorites_post_id_liker_id', ['post_id', 'liker_id'], unique=True)
+        batch_op.create_index('ix_favorites_liker_id', ['liker_id'], unique=False)
+        batch_op.create_index('ix_favorites_date_liked', ['date_liked'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('favorites', schema=None) as batch_op:
+        batch_op.drop_index('ix_favorites_date_liked')
+        batch_op.drop_index('ix_favorites_liker_id')
+        batch_op.drop_index('uq_favorites_post_id_liker_id')
+
+    with op.batch_alter_table('comments', schema=None) as batch_op:
+        batch_op.drop_index('ix_comments_author_id')
+        batch_op.drop_index('ix_comments_post_id_comment_date')
+
+    with op.batch_alter_table('follows', schema=None) as batch_op:
+        batch_op.drop_index('ix_follows_followed_id_follower_id')
+
+    with op.batch_alter_table('posts', schema=None) as batch_op:
+        batch_op.drop_index('ix_posts_user_id_date_posted')
+        batch_op.drop_index('ix_posts_type_category_date_posted')
+        batch_op.drop_index('ix_posts_date_posted_id')
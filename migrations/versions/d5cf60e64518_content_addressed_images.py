@@ -0,0 +1,39 @@
+"""Reference counted content addressed images
+
+Revision ID: d5cf60e64518
+Revises: d1335910d26b
+Create Date: 2026-10-18 19:40:12.518470
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5cf60e64518'
+down_revision = 'd1335910d26b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('images',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('path', sa.String(length=120), nullable=False),
+    sa.Column('refcount', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id', name=op.f('pk_images')),
+    sa.UniqueConstraint('path', name=op.f('uq_images_path'))
+    )
+    # content addressed names are longer than the old <username>.<ext> ones
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.alter_column('image_file', existing_type=sa.String(length=20), type_=sa.String(length=100),
+                              existing_nullable=False)
+
+
+def downgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.alter_column('image_file', existing_type=sa.String(length=100), type_=sa.String(length=20),
+                              existing_nullable=False)
+
+    op.drop_table('images')
@@ -0,0 +1,42 @@
+"""Post comments and favorites counters
+
+Revision ID: f20faef90612
+Revises: 6dc986c817d6
+Create Date: 2026-10-18 10:12:31.402118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f20faef90612'
+down_revision = '6dc986c817d6'
+branch_labels = None
+depends_on = None
+
+# number of posts backfilled per UPDATE statement, keeps the write transactions short on big tables
+BACKFILL_CHUNK_SIZE = 1000
+
+
+def upgrade():
+    with op.batch_alter_table('posts', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('comments_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('favored_count', sa.Integer(), server_default='0', nullable=False))
+
+    # backfill the counters in chunks of posts ids
+    connection = op.get_bind()
+    max_id = connection.execute(sa.text('SELECT MAX(id) FROM posts')).scalar() or 0
+    for first_id in range(1, max_id + 1, BACKFILL_CHUNK_SIZE):
+        connection.execute(sa.text(
+            'UPDATE posts SET '
+            'comments_count = (SELECT COUNT(*) FROM comments WHERE comments.post_id = posts.id), '
+            'favored_count = (SELECT COUNT(*) FROM favorites WHERE favorites.post_id = posts.id) '
+            'WHERE id >= :first_id AND id < :last_id'),
+            {'first_id': first_id, 'last_id': first_id + BACKFILL_CHUNK_SIZE})
+
+
+def downgrade():
+    with op.batch_alter_table('posts', schema=None) as batch_op:
+        batch_op.drop_column('favored_count')
+        batch_op.drop_column('comments_count')
@@ -9,6 +9,14 @@ from flask_login import LoginManager
 from config import config
 from flask_moment import Moment
 from flask_jwt_extended import JWTManager
+from .rendering import MarkdownRenderer
+from .images import ImageProcessor
+from .ingredients import IngredientIndex
+from .caching import SectionCache, TokenBlocklist, IdentityCache
+from .serialization import init_json
+from .activity import LastSeenBuffer
+from .graph import FollowGraph
+from .similarity import ContentIndex
 
 
 naming_convention = {
@@ -46,6 +54,24 @@ login_manager.login_message_category = 'info'
 
 pagedown = PageDown()
 
+md_renderer = MarkdownRenderer()
+
+image_processor = ImageProcessor()
+
+ingredient_index = IngredientIndex()
+
+home_cache = SectionCache()
+
+last_seen_buffer = LastSeenBuffer()
+
+token_blocklist = TokenBlocklist()
+
+identity_cache = IdentityCache()
+
+follow_graph = FollowGraph()
+
+content_index = ContentIndex()
+
 def create_app(config_name):
     app = Flask( __name__)
     app.config.from_object(config[config_name])
@@ -66,6 +92,26 @@ def create_app(config_name):
 
     jwt.init_app(app)
 
+    md_renderer.init_app(app)
+
+    image_processor.init_app(app)
+
+    ingredient_index.init_app(app)
+
+    home_cache.init_app(app)
+
+    init_json(app)
+
+    last_seen_buffer.init_app(app)
+
+    token_blocklist.init_app(app)
+
+    identity_cache.init_app(app)
+
+    follow_graph.init_app(app)
+
+    content_index.init_app(app)
+
     from .main import main as main_blueprint
     app.register_blueprint(main_blueprint)
 
@@ -0,0 +1,92 @@
+import atexit
+import time
+import threading
+from datetime import timedelta
+from flask import current_app
+
+
+class LastSeenBuffer:
+    """Write-behind buffer of the last seen times of the users. Pings keep the newest time per user in memory,
+    a ping whose user was already seen less than MYRECBLOG_LAST_SEEN_RESOLUTION seconds ago is dropped.
+    The buffer is written with one batched UPDATE by the first ping after MYRECBLOG_LAST_SEEN_FLUSH_INTERVAL
+    seconds or once MYRECBLOG_LAST_SEEN_FLUSH_SIZE users are waiting, and when the process exits."""
+
+    def __init__(self, app=None):
+        self.resolution = timedelta(seconds=60)
+        self.flush_interval = 30
+        self.flush_size = 500
+        self.app = None
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._flushed_at = time.monotonic()
+        self._exit_registered = False
+        self.pings = 0
+        self.skipped = 0
+        self.flushes = 0
+        self.written = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.resolution = timedelta(seconds=app.config['MYRECBLOG_LAST_SEEN_RESOLUTION'])
+        self.flush_interval = app.config['MYRECBLOG_LAST_SEEN_FLUSH_INTERVAL']
+        self.flush_size = app.config['MYRECBLOG_LAST_SEEN_FLUSH_SIZE']
+        with self._lock:
+            self._pending = {}
+            self._flushed_at = time.monotonic()
+            self.pings = self.skipped = self.flushes = self.written = 0
+        self.app = app
+        if not self._exit_registered:
+            atexit.register(self.flush_on_exit)
+            self._exit_registered = True
+
+    # stored is the last seen time the caller already has, nothing is buffered while it is recent enough
+    def touch(self, user_id, seen, stored=None):
+        with self._lock:
+            self.pings += 1
+            if user_id is None or stored is not None and seen - stored < self.resolution:
+                self.skipped += 1
+                return False
+            if self._pending.get(user_id) is None or self._pending[user_id] < seen:
+                self._pending[user_id] = seen
+            due = len(self._pending) >= self.flush_size \
+                or time.monotonic() - self._flushed_at >= self.flush_interval
+        if due:
+            self.flush()
+        return True
+
+    # writes the buffered times on a connection of its own, outside of the transaction of the request;
+    # a time never replaces a newer one written by another process
+    def flush(self):
+        from . import db
+        from .models import User
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._flushed_at = time.monotonic()
+        if not pending:
+            return 0
+        users = User.__table__
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(users.update()
+                                   .where(users.c.id == db.bindparam('user_id'))
+                                   .where(db.or_(users.c.last_seen.is_(None), users.c.last_seen < db.bindparam('seen')))
+                                   .values(last_seen=db.bindparam('seen')),
+                                   [{'user_id': user_id, 'seen': seen} for user_id, seen in pending.items()])
+        except Exception:
+            current_app.logger.exception(f'Writing the last seen times of {len(pending)} users failed')
+            return 0
+        with self._lock:
+            self.flushes += 1
+            self.written += len(pending)
+        return len(pending)
+
+    def flush_on_exit(self):
+        if self._pending and self.app is not None:
+            with self.app.app_context():
+                self.flush()
+
+    def stats(self):
+        with self._lock:
+            return {'pending': len(self._pending), 'pings': self.pings, 'skipped': self.skipped,
+                    'flushes': self.flushes, 'written': self.written}
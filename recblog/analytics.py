@@ -0,0 +1,175 @@
+from datetime import date, datetime, time, timedelta
+from . import db
+from .models import FavoritePosts, Post, Comment, DailyStat, RollupWatermark
+
+ANALYTICS_INTERVALS = ('day', 'week', 'month')
+ANALYTICS_GROUPS = ('post', 'category')
+ROLLUP_METRICS = ('likes', 'comments', 'posts')
+ROLLUP_DIMENSIONS = ('all', 'category', 'author')
+DAILY_STATS = 'daily_stats'
+
+
+# first day of the week (ISO, starting on Monday) or month the day belongs to
+def bucket_start(day, interval='day'):
+    if interval == 'week':
+        return day - timedelta(days=day.weekday())
+    if interval == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def bucket_starts(date_from, date_to, interval='day'):
+    starts = []
+    start = bucket_start(date_from, interval)
+    while start <= date_to:
+        starts.append(start)
+        if interval == 'month':
+            start = (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+        else:
+            start += timedelta(days=7 if interval == 'week' else 1)
+    return starts
+
+
+# the DATE() of SQLite is a string, other databases return a date
+def as_date(value):
+    if isinstance(value, str):
+        return date.fromisoformat(value[:10])
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+
+# turns rows of (group, day, number) into one list of numbers per group with a value for every bucket of the
+# range, buckets without rows are 0
+def dense_series(rows, date_from, date_to, interval='day'):
+    starts = bucket_starts(date_from, date_to, interval)
+    positions = {start: position for position, start in enumerate(starts)}
+    series = {}
+    for group, day, number in rows:
+        values = series.setdefault(group, [0] * len(starts))
+        values[positions[bucket_start(as_date(day), interval)]] += number
+    return starts, series
+
+
+# likes per day between date_from and date_to included, with one query grouped by day and by post or category;
+# the range is a scan of the date_liked index. Only the limit groups with the most likes are kept.
+def likes_series(date_from, date_to, interval='day', group_by=None, limit=10):
+    day = db.func.date(FavoritePosts.date_liked)
+    group = {'post': FavoritePosts.post_id, 'category': Post.type_category}.get(group_by)
+    columns = [day, db.func.count()] if group is None else [group, day, db.func.count()]
+    query = db.session.query(*columns)\
+        .filter(FavoritePosts.date_liked >= datetime.combine(date_from, time.min),
+                FavoritePosts.date_liked < datetime.combine(date_to + timedelta(days=1), time.min))
+    if group_by == 'category':
+        query = query.join(Post, Post.id == FavoritePosts.post_id)
+    rows = query.group_by(*columns[:-1]).all()
+    if group is None:
+        rows = [('total', liked_on, number) for liked_on, number in rows]
+    starts, series = dense_series(rows, date_from, date_to, interval)
+    if group is not None:
+        kept = sorted(series, key=lambda key: (-sum(series[key]), str(key)))[:limit]
+        series = {str(key): series[key] for key in kept}
+    elif not series:
+        series = {'total': [0] * len(starts)}
+    return starts, series
+
+
+# the time of every metric and the post it is about
+def _metric_columns(metric):
+    if metric == 'likes':
+        return FavoritePosts.date_liked, FavoritePosts.post_id
+    if metric == 'comments':
+        return Comment.comment_date, Comment.post_id
+    return Post.date_posted, None
+
+
+# counts of the days from date_from to date_to included, with one query per metric grouped by day, category and
+# author of the post; totals and the category and author dimensions are summed up from these rows
+def _daily_rows(date_from, date_to):
+    rows = {}
+    for metric in ROLLUP_METRICS:
+        date_column, post_id = _metric_columns(metric)
+        day = db.func.date(date_column)
+        query = db.session.query(day, Post.type_category, Post.user_id, db.func.count())\
+            .filter(date_column >= datetime.combine(date_from, time.min),
+                    date_column < datetime.combine(date_to + timedelta(days=1), time.min))
+        if post_id is not None:
+            query = query.join(Post, Post.id == post_id)
+        for active_on, category, author_id, number in query.group_by(day, Post.type_category, Post.user_id):
+            active_on = as_date(active_on)
+            for dimension, value in (('all', 'all'), ('category', category or 'none'), ('author', str(author_id))):
+                key = (active_on, metric, dimension, value)
+                rows[key] = rows.get(key, 0) + number
+    return rows
+
+
+def _first_activity_day():
+    days = [db.session.query(db.func.min(_metric_columns(metric)[0])).scalar() for metric in ROLLUP_METRICS]
+    days = [as_date(day) for day in days if day is not None]
+    return min(days) if days else None
+
+
+# rolls the raw activity up into daily_stats, a chunk of days per transaction. Only the days after the watermark
+# are rolled up unless since is given, e.g. to take deleted likes or comments into account; days are only rolled up
+# once they are over, until defaults to yesterday. The watermark only moves when the rolled up days follow it, a
+# since after it leaves a gap the next run still fills. Returns the number of days rolled up.
+def rollup_daily_stats(since=None, until=None, chunk_days=31):
+    yesterday = datetime.utcnow().date() - timedelta(days=1)
+    until = min(until or yesterday, yesterday)
+    watermark = RollupWatermark.query.get(DAILY_STATS)
+    next_day = watermark.rolled_up_to + timedelta(days=1) if watermark is not None else _first_activity_day()
+    if since is None:
+        since = next_day
+    if since is None or since > until:
+        return 0
+    stats = DailyStat.__table__
+    start = since
+    while start <= until:
+        end = min(start + timedelta(days=chunk_days - 1), until)
+        rows = _daily_rows(start, end)
+        db.session.execute(stats.delete().where(stats.c.day.between(start, end)))
+        if rows:
+            db.session.execute(stats.insert(), [{'day': day, 'metric': metric, 'dimension': dimension, 'value': value,
+                                                 'total': number}
+                                                for (day, metric, dimension, value), number in rows.items()])
+        if next_day is None or start <= next_day:
+            if watermark is None:
+                watermark = RollupWatermark(name=DAILY_STATS, rolled_up_to=end)
+                db.session.add(watermark)
+            else:
+                watermark.rolled_up_to = max(watermark.rolled_up_to, end)
+            next_day = watermark.rolled_up_to + timedelta(days=1)
+        db.session.commit()
+        start = end + timedelta(days=1)
+    return (until - since).days + 1
+
+
+def rolled_up_to():
+    watermark = RollupWatermark.query.get(DAILY_STATS)
+    return watermark.rolled_up_to if watermark is not None else None
+
+
+def _rollup_filter(query, metric, dimension, date_from, date_to):
+    return query.filter(DailyStat.metric == metric, DailyStat.dimension == dimension,
+                        DailyStat.day.between(date_from, date_to))
+
+
+# series of a metric from the rollups, dense like likes_series; for the category and author dimensions only the
+# limit values with the highest totals are kept
+def rollup_series(metric, dimension, date_from, date_to, interval='day', limit=10):
+    rows = _rollup_filter(db.session.query(DailyStat.value, DailyStat.day, DailyStat.total), metric, dimension,
+                          date_from, date_to).all()
+    starts, series = dense_series(rows, date_from, date_to, interval)
+    kept = sorted(series, key=lambda key: (-sum(series[key]), key))[:limit]
+    series = {key: series[key] for key in kept}
+    if dimension == 'all' and not series:
+        series = {'all': [0] * len(starts)}
+    return starts, series
+
+
+# values of a dimension with the highest totals of a metric over the range
+def rollup_top(metric, dimension, date_from, date_to, limit=10):
+    total = db.func.sum(DailyStat.total)
+    query = _rollup_filter(db.session.query(DailyStat.value, total), metric, dimension, date_from, date_to)
+    return [(value, int(number)) for value, number in query.group_by(DailyStat.value)
+            .order_by(total.desc(), DailyStat.value).limit(limit)]
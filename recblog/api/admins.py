@@ -1,28 +1,95 @@
 from flask import jsonify, request, url_for, g, current_app, flash
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from datetime import datetime, timedelta
-from sqlalchemy import extract
-from .. import db
-from ..models import User, Permission, FavoritePosts
+from datetime import date, datetime, timedelta
+from .. import md_renderer, image_processor, home_cache, last_seen_buffer, token_blocklist, identity_cache, \
+    follow_graph, content_index
+from ..models import Permission
 from . import api
 from .utils import permission_required
+from ..exceptions import ValidationError
+from ..analytics import likes_series, rollup_series, rollup_top, rolled_up_to, ANALYTICS_INTERVALS, \
+    ANALYTICS_GROUPS, ROLLUP_METRICS, ROLLUP_DIMENSIONS
 
 
-# analytics on number of likes per date range
+# date range, interval and limit shared by the analytics endpoints
+def analytics_args(args):
+    try:
+        date_from = datetime.strptime(args['date_from'], '%Y-%m-%d').date()
+        date_to = datetime.strptime(args['date_to'], '%Y-%m-%d').date()
+        limit = int(args.get('limit', 10))
+    except (KeyError, TypeError, ValueError):
+        raise ValidationError('date_from and date_to are required as YYYY-MM-DD, limit has to be a number.')
+    interval = args.get('interval', 'day')
+    if interval not in ANALYTICS_INTERVALS:
+        raise ValidationError(f"interval has to be one of {', '.join(ANALYTICS_INTERVALS)}.")
+    # the series step a day or a month past date_to
+    if date_to >= date.max - timedelta(days=31):
+        raise ValidationError('date_to is out of range.')
+    max_days = current_app.config['MYRECBLOG_ANALYTICS_MAX_DAYS']
+    if not 1 <= (date_to - date_from).days + 1 <= max_days:
+        raise ValidationError(f'The range has to span 1 to {max_days} days.')
+    return date_from, date_to, interval, max(1, min(limit, 100))
+
+
+def choice_arg(args, name, choices, default=None):
+    value = args.get(name) or default
+    if value is not None and value not in choices:
+        raise ValidationError(f"{name} has to be one of {', '.join(choices)}.")
+    return value
+
+
+# likes per day, week or month of a date range, as a dense series filled with zeros; the likes can be split by post
+# or category, only the groups with the most likes are returned
 @api.route('/analytics/')
 @jwt_required()
 @permission_required(Permission.ADMIN)
 def posts_likes_analytics():
-    date_from = request.json.get("date_from", None)
-    date_to = request.json.get("date_to", None)
-    date_from = datetime.strptime(date_from, "%Y-%m-%d")
-    date_to = datetime.strptime(date_to, "%Y-%m-%d")
-    print(date_from, date_to)
-    likes_analytics = {}
-    while date_from <= date_to:
-        likes_per_day = FavoritePosts.query.filter(extract('day', FavoritePosts.date_liked) == date_from.day).count()
-        likes_analytics[date_from.strftime("%m/%d/%Y")] = f"recieved {likes_per_day} likes"
-        print(date_from)
-        date_from += timedelta(days=1)
-    print(likes_analytics)
-    return jsonify(likes_analytics), 200
+    # the range is read from the query string, older clients send it as a JSON body
+    args = request.args if request.args else request.get_json(silent=True) or {}
+    date_from, date_to, interval, limit = analytics_args(args)
+    group_by = choice_arg(args, 'group_by', ANALYTICS_GROUPS)
+    starts, series = likes_series(date_from, date_to, interval, group_by, limit)
+    return jsonify({'date_from': date_from.isoformat(), 'date_to': date_to.isoformat(), 'interval': interval,
+                    'group_by': group_by, 'buckets': [start.isoformat() for start in starts], 'series': series,
+                    'total': sum(sum(values) for values in series.values())}), 200
+
+
+# likes, comments or new posts per day, week or month from the daily rollups, in total or for the categories or
+# authors with the highest totals; days after rolled_up_to are not rolled up yet
+@api.route('/stats/daily/')
+@jwt_required()
+@permission_required(Permission.ADMIN)
+def daily_stats():
+    date_from, date_to, interval, limit = analytics_args(request.args)
+    metric = choice_arg(request.args, 'metric', ROLLUP_METRICS, 'likes')
+    dimension = choice_arg(request.args, 'dimension', ROLLUP_DIMENSIONS, 'all')
+    starts, series = rollup_series(metric, dimension, date_from, date_to, interval, limit)
+    return jsonify({'metric': metric, 'dimension': dimension, 'date_from': date_from.isoformat(),
+                    'date_to': date_to.isoformat(), 'interval': interval, 'rolled_up_to': rolled_up_to(),
+                    'buckets': [start.isoformat() for start in starts], 'series': series}), 200
+
+
+# categories or authors with the highest totals of a metric over the range, from the daily rollups
+@api.route('/stats/top/')
+@jwt_required()
+@permission_required(Permission.ADMIN)
+def top_stats():
+    date_from, date_to, _, limit = analytics_args(request.args)
+    metric = choice_arg(request.args, 'metric', ROLLUP_METRICS, 'likes')
+    dimension = choice_arg(request.args, 'dimension', ROLLUP_DIMENSIONS[1:], 'category')
+    top = rollup_top(metric, dimension, date_from, date_to, limit)
+    return jsonify({'metric': metric, 'dimension': dimension, 'date_from': date_from.isoformat(),
+                    'date_to': date_to.isoformat(), 'rolled_up_to': rolled_up_to(),
+                    'top': [{'value': value, 'total': total} for value, total in top]}), 200
+
+
+# in-process metrics of the background image processing, the markdown and home page caches
+# the last seen buffer, the token blocklist, the identity cache and the follow graph
+@api.route('/metrics/')
+@jwt_required()
+@permission_required(Permission.ADMIN)
+def metrics():
+    return jsonify({'images': image_processor.stats(), 'markdown': md_renderer.stats(),
+                    'home': home_cache.stats(), 'last_seen': last_seen_buffer.stats(),
+                    'token_blocklist': token_blocklist.stats(), 'identity': identity_cache.stats(),
+                    'follow_graph': follow_graph.stats(), 'content_index': content_index.stats()}), 200
@@ -4,57 +4,113 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 from .. import db
 from . import api
 from ..models import Permission, Post, Comment, User
-from .utils import permission_required
+from .utils import permission_required, current_api_user, keyset_paginate, version_etag, not_modified, \
+    with_validators, load_in_order
 from .errors import forbidden, bad_request
 
 
+# comment pages are found over the validator columns only, unchanged pages are answered with 304 from them
+def comment_versions(query):
+    return query.with_entities(Comment.id, Comment.comment_date, Comment.updated_at)
+
+
 @api.route('/comments/')
 @jwt_required()
 def get_all_comments():
+    per_page = current_app.config['MYRECBLOG_COMMENTS_PER_PAGE']
+    # keyset pagination, pass an empty cursor to get the first page
+    cursor = request.args.get('cursor')
+    if cursor is not None:
+        rows, next_cursor, prev_cursor = keyset_paginate(comment_versions(Comment.query), Comment.comment_date,
+                                                         Comment.id, cursor, per_page)
+        etag = version_etag([tuple(row) for row in rows], next_cursor, prev_cursor)
+        response = not_modified(etag)
+        if response:
+            return response
+        all_comments = load_in_order(Comment, [row.id for row in rows])
+        return with_validators(jsonify({
+            'comment': [comment.convert_comment_to_json() for comment in all_comments],
+            'prev': url_for('api.get_all_comments', cursor=prev_cursor) if prev_cursor else None,
+            'next': url_for('api.get_all_comments', cursor=next_cursor) if next_cursor else None,
+            'prev_cursor': prev_cursor,
+            'next_cursor': next_cursor
+        }), etag)
     page = request.args.get('page', 1, type=int)
-    pagination = Comment.query.order_by(Comment.comment_date.desc())\
-        .paginate(page, per_page=current_app.config['MYRECBLOG_COMMENTS_PER_PAGE'], error_out=False)
-    all_comments = pagination.items
+    pagination = comment_versions(Comment.query).order_by(Comment.comment_date.desc(), Comment.id.desc())\
+        .paginate(page, per_page=per_page, error_out=False)
+    etag = version_etag([tuple(row) for row in pagination.items], pagination.total)
+    response = not_modified(etag)
+    if response:
+        return response
+    all_comments = load_in_order(Comment, [row.id for row in pagination.items])
     prev = None
     if pagination.has_prev:
         prev = url_for('api.get_all_comments', page=page-1)
     next = None
     if pagination.has_next:
         next = url_for('api.get_all_comments', page=page+1)
-    return jsonify({
+    return with_validators(jsonify({
         'comment': [comment.convert_comment_to_json() for comment in all_comments],
         'prev': prev,
         'next': next,
         'count': pagination.total
-    })
+    }), etag)
 
 
 @api.route('/comment/<int:comment_id>')
 @jwt_required()
 def get_comment(comment_id):
-    comment = Comment.query.get_or_404(comment_id)
-    return jsonify(comment.convert_comment_to_json())
+    updated_at = Comment.query.with_entities(Comment.updated_at).filter_by(id=comment_id).first_or_404().updated_at
+    etag = version_etag('comment', comment_id, updated_at)
+    response = not_modified(etag, updated_at)
+    if response:
+        return response
+    comment = Comment.query.get(comment_id)
+    return with_validators(jsonify(comment.convert_comment_to_json()), etag, updated_at)
 
 
 @api.route('/post/<int:post_id>/comments/')
 @jwt_required()
 def get_post_comment(post_id):
+    per_page = current_app.config['MYRECBLOG_COMMENTS_PER_PAGE']
+    query = comment_versions(Comment.query.filter_by(post_id=post_id))
+    # keyset pagination, pass an empty cursor to get the first page
+    cursor = request.args.get('cursor')
+    if cursor is not None:
+        rows, next_cursor, prev_cursor = keyset_paginate(query, Comment.comment_date, Comment.id, cursor, per_page,
+                                                         descending=False)
+        etag = version_etag([tuple(row) for row in rows], next_cursor, prev_cursor)
+        response = not_modified(etag)
+        if response:
+            return response
+        all_comments = load_in_order(Comment, [row.id for row in rows])
+        return with_validators(jsonify({
+            'comment': [comment.convert_comment_to_json() for comment in all_comments],
+            'prev': url_for('api.get_post_comment', post_id=post_id, cursor=prev_cursor) if prev_cursor else None,
+            'next': url_for('api.get_post_comment', post_id=post_id, cursor=next_cursor) if next_cursor else None,
+            'prev_cursor': prev_cursor,
+            'next_cursor': next_cursor
+        }), etag)
     page = request.args.get('page', 1, type=int)
-    pagination = Comment.query.filter_by(post_id=post_id).order_by(Comment.comment_date.asc()).\
-        paginate(page, per_page=current_app.config['MYRECBLOG_COMMENTS_PER_PAGE'], error_out=False )
-    all_comments = pagination.items
+    pagination = query.order_by(Comment.comment_date.asc(), Comment.id.asc()).\
+        paginate(page, per_page=per_page, error_out=False )
+    etag = version_etag([tuple(row) for row in pagination.items], pagination.total)
+    response = not_modified(etag)
+    if response:
+        return response
+    all_comments = load_in_order(Comment, [row.id for row in pagination.items])
     prev = None
     if pagination.has_prev:
-        prev = url_for('api.get_post_comment', page=page - 1 )
+        prev = url_for('api.get_post_comment', post_id=post_id, page=page - 1 )
     next = None
     if pagination.has_next:
-        next = url_for('api.get_post_comment', page=page + 1 )
-    return jsonify({
+        next = url_for('api.get_post_comment', post_id=post_id, page=page + 1 )
+    return with_validators(jsonify({
         'comment': [comment.convert_comment_to_json() for comment in all_comments],
         'prev': prev,
         'next': next,
         'count': pagination.total
-    })
+    }), etag)
 
 
 @api.route('/post/<int:post_id>/comments/', methods=["POST"])
@@ -64,7 +120,7 @@ def get_post_comment(post_id):
 def new_comment_to_post(post_id):
     new_comment = request.get_data() or {}
     new_comment = ast.literal_eval(new_comment.decode("UTF-8"))
-    new_comment['author_id'] = User.query.filter_by(email=get_jwt_identity()).first().id
+    new_comment['author_id'] = current_api_user().id
     new_comment['post_id'] = post_id
     new_comment['disabled'] = False
     comment = Comment()
@@ -86,7 +142,7 @@ def update_comment(comment_id):
     updated_comment = ast.literal_eval(updated_comment.decode("UTF-8"))
     # updated_comment = ast.literal_eval(updated_comment.decode("UTF-8"))
     comment = Comment.query.filter_by(id=comment_id).first()
-    current_user = User.query.filter_by(email=get_jwt_identity()).first()
+    current_user = current_api_user()
     if current_user != comment.author and not current_user.can(Permission.MODERATE)\
             or current_user != comment.author and not current_user.can(Permission.ADMIN):
         return forbidden("You have no permission to change this comment!")
@@ -101,7 +157,7 @@ def update_comment(comment_id):
 @permission_required(Permission.COMMENT)
 def delete_comment(comment_id):
     comment = Comment.query.filter_by(id=comment_id).first()
-    current_user = User.query.filter_by(email=get_jwt_identity()).first()
+    current_user = current_api_user()
     if current_user != comment.author and not current_user.can(Permission.MODERATE)\
             or current_user != comment.author and not current_user.can(Permission.ADMIN):
         return forbidden('You have no permission to delete the comment!')
@@ -1,30 +1,132 @@
 from flask import jsonify, request, url_for, g, current_app, flash
 from flask_jwt_extended import jwt_required, get_jwt_identity
 import ast
-from .. import db
-from ..models import User, Post, Permission, FavoritePosts
+from operator import ge, le
+from .. import db, search, ingredient_index
+from ..models import User, Post, Permission, FavoritePosts, Ingredient, PostSimilar, post_ingredients
+from ..similarity import similar_recipes
 from . import api
-from .utils import permission_required
+from .utils import permission_required, current_api_user, keyset_paginate, version_etag, not_modified, \
+    with_validators, load_in_order
 from .errors import bad_request, forbidden
 
 
+# range filters on the parsed durations (minutes) and portions of the posts, e.g. ?max_total=30&min_portions=4
+QUANTITY_FILTERS = {'min_total': (Post.total_minutes, ge), 'max_total': (Post.total_minutes, le),
+                    'min_cook': (Post.cook_minutes, ge), 'max_cook': (Post.cook_minutes, le),
+                    'min_portions': (Post.portions_count, ge), 'max_portions': (Post.portions_count, le)}
+# sort orders of the post listing: newest first or quickest first by the total time
+POSTS_SORTS = ('date', 'total_time')
+
+
 @api.route('/posts/')
 @jwt_required()
 def get_posts():
+    per_page = current_app.config['MYRECBLOG_POSTS_PER_PAGE']
+    sort = request.args.get('sort', 'date')
+    if sort not in POSTS_SORTS:
+        return bad_request(f"Unknown sort order, use one of: {', '.join(POSTS_SORTS)}.")
+    query = Post.query
+    args = {}
+    for name, (column, compare) in QUANTITY_FILTERS.items():
+        if request.args.get(name) is None:
+            continue
+        value = request.args.get(name, type=int)
+        if value is None:
+            return bad_request(f'{name} has to be a whole number.')
+        query = query.filter(compare(column, value))
+        args[name] = value
+    if sort != 'date':
+        args['sort'] = sort
+        # posts without a parsed total time can not be placed in the order
+        query = query.filter(Post.total_minutes.isnot(None))
+    # the page is found over the validator columns only, unchanged pages are answered with 304 from them
+    query = query.with_entities(Post.id, Post.date_posted, Post.total_minutes, Post.updated_at)
+    # keyset pagination, pass an empty cursor to get the first page
+    cursor = request.args.get('cursor')
+    if cursor is not None:
+        if sort == 'date':
+            rows, next_cursor, prev_cursor = keyset_paginate(query, Post.date_posted, Post.id, cursor, per_page)
+        else:
+            rows, next_cursor, prev_cursor = keyset_paginate(query, Post.total_minutes, Post.id, cursor, per_page,
+                                                             descending=False)
+        etag = version_etag([tuple(row) for row in rows], next_cursor, prev_cursor)
+        response = not_modified(etag)
+        if response:
+            return response
+        posts = load_in_order(Post, [row.id for row in rows])
+        return with_validators(jsonify({
+            'posts': [post.convert_post_json() for post in posts],
+            'prev_url': url_for('api.get_posts', cursor=prev_cursor, **args) if prev_cursor else None,
+            'next_url': url_for('api.get_posts', cursor=next_cursor, **args) if next_cursor else None,
+            'prev_cursor': prev_cursor,
+            'next_cursor': next_cursor
+        }), etag)
     page = request.args.get('page', 1, type=int)
-    pagination = Post.query.order_by(Post.date_posted.desc()).\
-        paginate(page, per_page=current_app.config['MYRECBLOG_POSTS_PER_PAGE'], error_out=False)
-    posts = pagination.items
+    if sort == 'date':
+        query = query.order_by(Post.date_posted.desc(), Post.id.desc())
+    else:
+        query = query.order_by(Post.total_minutes.asc(), Post.id.asc())
+    pagination = query.paginate(page, per_page=per_page, error_out=False)
+    etag = version_etag([tuple(row) for row in pagination.items], pagination.total)
+    response = not_modified(etag)
+    if response:
+        return response
+    posts = load_in_order(Post, [row.id for row in pagination.items])
     prev = None
     if pagination.has_prev:
-        prev = url_for('api.get_posts', id=id, page=page-1)
+        prev = url_for('api.get_posts', page=page-1, **args)
     next = None
     if pagination.has_next:
-        next = url_for('api.get_posts', id=id, page=page+1)
-    return jsonify({'posts': [post.convert_post_json() for post in posts],
-                    'prev_url': prev,
-                    'next_url': next,
-                    'count': pagination.total
+        next = url_for('api.get_posts', page=page+1, **args)
+    return with_validators(jsonify({'posts': [post.convert_post_json() for post in posts],
+                                    'prev_url': prev,
+                                    'next_url': next,
+                                    'count': pagination.total
+                                    }), etag)
+
+
+# BM25 ranked full-text search with keyset pagination, pass the returned next_cursor to get the next page
+@api.route('/search/')
+@jwt_required()
+def search_posts():
+    query = request.args.get('q', '')
+    results, next_cursor = search.search_posts(query, request.args.get('cursor'),
+                                               current_app.config['MYRECBLOG_POSTS_PER_PAGE'])
+    return jsonify({'posts': [dict(post.convert_post_json(), snippet=str(snippet)) for post, snippet in results],
+                    'next_url': url_for('api.search_posts', q=query, cursor=next_cursor) if next_cursor else None,
+                    'next_cursor': next_cursor
+                    })
+
+
+# recipes ranked by the share of their ingredients covered by the given ones, e.g. ?have=flour,eggs,milk
+@api.route('/recipes/by-ingredients/')
+@jwt_required()
+def get_posts_by_ingredients():
+    have = [name for name in request.args.get('have', '').split(',') if name.strip()]
+    if not have:
+        return bad_request('Pass the ingredients you have as a comma separated have parameter.')
+    page = request.args.get('page', 1, type=int)
+    per_page = current_app.config['MYRECBLOG_POSTS_PER_PAGE']
+    ranked, total = ingredient_index.rank(have, limit=per_page, offset=(page - 1) * per_page)
+    post_ids = [post_id for post_id, _, _, _ in ranked]
+    posts = {post.id: post for post in Post.query.filter(Post.id.in_(post_ids))}
+    # ingredients of the page posts that are not covered by the given ones
+    covering = ingredient_index.covering_ids(have)
+    missing = {post_id: [] for post_id in post_ids}
+    for post_id, ingredient_id, name in db.session.query(post_ingredients.c.post_id, Ingredient.id, Ingredient.name)\
+            .join(Ingredient, Ingredient.id == post_ingredients.c.ingredient_id)\
+            .filter(post_ingredients.c.post_id.in_(post_ids)).order_by(Ingredient.name):
+        if ingredient_id not in covering:
+            missing[post_id].append(name)
+    return jsonify({'posts': [dict(posts[post_id].convert_post_json(), coverage=round(coverage, 4), covered=covered,
+                                   ingredients_total=total_ingredients, missing=missing[post_id])
+                              for post_id, coverage, covered, total_ingredients in ranked if post_id in posts],
+                    'prev_url': url_for('api.get_posts_by_ingredients', have=','.join(have), page=page-1)
+                    if page > 1 else None,
+                    'next_url': url_for('api.get_posts_by_ingredients', have=','.join(have), page=page+1)
+                    if page * per_page < total else None,
+                    'count': total
                     })
 
 
@@ -32,9 +134,29 @@ def get_posts():
 @jwt_required()
 @permission_required(Permission.WRITE)
 def get_post(post_id):
-    user = User.query.filter_by(email=get_jwt_identity()).first()
+    updated_at = Post.query.with_entities(Post.updated_at).filter_by(id=post_id).first_or_404().updated_at
+    etag = version_etag('post', post_id, updated_at)
+    response = not_modified(etag, updated_at)
+    if response:
+        return response
+    post = Post.query.get(post_id)
+    return with_validators(jsonify(post.convert_post_json()), etag, updated_at)
+
+
+# posts liked by the people who liked this one, computed by 'flask build-similar-posts', completed with the
+# posts closest by their title and ingredients from the content index
+@api.route('/post/<int:post_id>/similar')
+@jwt_required()
+@permission_required(Permission.WRITE)
+def get_similar_posts(post_id):
     post = Post.query.get_or_404(post_id)
-    return jsonify(post.convert_post_json()), 200
+    limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+    also_liked = PostSimilar.similar_posts(post_id, limit)
+    similar = similar_recipes(post, limit - len(also_liked), exclude={item.id for item, _ in also_liked}) \
+        if len(also_liked) < limit else []
+    return jsonify({'posts': [dict(item.convert_post_json(), score=score, source=source)
+                              for source, items in (('likes', also_liked), ('content', similar))
+                              for item, score in items]}), 200
 
 
 @api.route('/post_new/', methods=['POST'])
@@ -57,7 +179,7 @@ def get_new_post():
     # check compleated, all is fine save the post
     post = Post()
     post = Post.convert_post_from_json(new_post)
-    current_user = User.query.filter_by(email=get_jwt_identity()).first()
+    current_user = current_api_user()
     post.author = current_user
     db.session.add(post)
     db.session.commit()
@@ -74,7 +196,7 @@ def update_post(post_id):
     post = Post.query.filter_by(id=post_id).first()
     new_post_data = request.get_data()
     new_post_data = ast.literal_eval(new_post_data.decode("UTF-8"))
-    current_user = User.query.filter_by(email=get_jwt_identity()).first()
+    current_user = current_api_user()
     if current_user != post.author or not current_user.can(Permission.ADMIN):
         return forbidden('Insufficient permission rights. You cannot edit this post.')
     # obtain new values of the posts fields
@@ -90,7 +212,7 @@ def update_post(post_id):
     post.ready = new_post_data['ready'] if new_post_data['ready'] else post.ready
     post.type_category = new_post_data['recipeCategory'] if new_post_data['recipeCategory'] else post.type_category
     post.main_ingredient = new_post_data['main_ingredient'] if new_post_data['main_ingredient'] else post.main_ingredient
-    post.ingredients = new_post_data['recipeIngredient'] if new_post_data['recipeIngredient'] else post.main_ingredient
+    post.ingredients = new_post_data['recipeIngredient'] if new_post_data['recipeIngredient'] else post.ingredients
     post.preparation = new_post_data['recipeInstructions'] if new_post_data['recipeInstructions'] else post.preparation
     # save updated values of the post fields to the database
     db.session.commit()
@@ -106,7 +228,7 @@ def update_post(post_id):
 @permission_required(Permission.WRITE)
 def delete_post(post_id):
     post = Post.query.get_or_404(post_id)
-    current_user = User.query.filter_by(email=get_jwt_identity()).first()
+    current_user = current_api_user()
     if current_user != post.author or not current_user.can(Permission.ADMIN):
         return forbidden('Insufficient permission rights. You cannot edit this post.')
     db.session.delete(post)
@@ -119,10 +241,10 @@ def delete_post(post_id):
 @jwt_required()
 def add_post_to_favorite(post_id):
     post = Post.query.filter_by(id=post_id).first()
-    current_user = User.query.filter_by(email=get_jwt_identity()).first()
+    current_user = current_api_user()
     if not post:
         return bad_request("Sorry, no such post!")
-    if FavoritePosts.query.filter_by(post_id=post.id, liker_id=current_user.id):
+    if FavoritePosts.query.filter_by(post_id=post.id, liker_id=current_user.id).first():
         return bad_request("You already liked this post!")
     favorite = FavoritePosts(current_user.id, post.id)
     db.session.add(favorite)
@@ -138,11 +260,11 @@ def add_post_to_favorite(post_id):
 @jwt_required()
 def unlike_post(post_id):
     post = Post.query.filter_by(id=post_id).first()
-    current_user = User.query.filter_by(email=get_jwt_identity()).first()
+    current_user = current_api_user()
     if not post:
         return bad_request("Sorry, no such post!")
-    favorite = FavoritePosts.query.filter_by(post_id=post.id, liker_id=current_user.id)
-    if favorite:
+    favorite = FavoritePosts.query.filter_by(post_id=post.id, liker_id=current_user.id).first()
+    if not favorite:
         return bad_request("You have not liked this post before to unlike!")
     post.delete_post_from_favorites(current_user.id)
     db.session.commit()
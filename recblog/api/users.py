@@ -2,25 +2,32 @@ from datetime import datetime, timezone
 from flask import jsonify, request, url_for, g, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity,\
      get_jwt, unset_jwt_cookies
-from .. import db, bcrypt, jwt
+from .. import db, bcrypt, jwt, token_blocklist
 from ..models import User, Post, Permission, BlacklistToken
 from . import api
 from .errors import bad_request, forbidden
+from ..graph import suggested_users
+from .utils import current_api_user, keyset_paginate, keyset_window, version_etag, not_modified, with_validators
 
-# Callback function to check if a JWT exists in the database blocklist
+# Callback function to check if a JWT is revoked, answered by the in-process copy of the blocklist
 @jwt.token_in_blocklist_loader
 def check_if_token_revoked(jwt_header, jwt_payload):
-    jti = jwt_payload["jti"]
-    token = db.session.query(BlacklistToken.id).filter_by(token=jti).scalar()
-    return token is not None
+    return token_blocklist.is_revoked(jwt_payload["jti"])
 
 
 @api.route('/user_account/<int:user_id>', methods=["GET"])
 @jwt_required()
 def get_user(user_id):
-    current_user = get_jwt_identity()
     user = User.query.get_or_404(user_id)
-    return jsonify(user.convert_user_json()), 200
+    # users have no update time and their counters come from other tables, so the tag is taken from
+    # the shown columns and the counters; it still spares serializing unchanged accounts
+    counts = User.load_counts([user.id])[user.id]
+    etag = version_etag('user', user.id, user.username, user.image_file, user.location, user.role_id,
+                        user.about_me, user.last_seen, sorted(counts.items()))
+    response = not_modified(etag)
+    if response:
+        return response
+    return with_validators(jsonify(user.convert_user_json(counts=counts)), etag)
 
 
 @api.route('/users/', methods=["GET", "POST"])
@@ -60,7 +67,8 @@ def add_new_user():
 @jwt_required()
 def modify_user(id):
     user = User.query.get_or_404(id)
-    if g.current_user != user and not g.current_user.can(Permission.ADMIN):
+    current_user = current_api_user()
+    if current_user != user and not current_user.can(Permission.ADMIN):
         return forbidden('You have no right to amend user info!!!')
     new_data = request.get_json() or {}
     if 'username' in new_data and new_data['username'] != user.username and\
@@ -125,18 +133,29 @@ def get_followed_users(id):
 @api.route('/user_posts/<int:id>', methods=['GET'])
 @jwt_required()
 def get_user_posts(id):
-    page = request.args.get('page', 1, type=int)
+    per_page = current_app.config['MYRECBLOG_POSTS_PER_PAGE']
     user = User.query.get_or_404(id)
+    # keyset pagination, pass an empty cursor to get the first page
+    cursor = request.args.get('cursor')
+    if cursor is not None:
+        posts, next_cursor, prev_cursor = keyset_paginate(Post.query.filter_by(author=user), Post.date_posted,
+                                                          Post.id, cursor, per_page)
+        return jsonify({'posts': [post.convert_post_json() for post in posts],
+                        'prev_url': url_for('api.get_user_posts', id=id, cursor=prev_cursor) if prev_cursor else None,
+                        'next_url': url_for('api.get_user_posts', id=id, cursor=next_cursor) if next_cursor else None,
+                        'prev_cursor': prev_cursor,
+                        'next_cursor': next_cursor
+                        }), 200
+    page = request.args.get('page', 1, type=int)
     pagination = Post.query.filter_by(author=user).order_by(Post.date_posted.desc()).\
-        paginate(page, per_page=current_app.config['MYRECBLOG_POSTS_PER_PAGE'],
-                 error_out=False )
+        paginate(page, per_page=per_page, error_out=False )
     posts = pagination.items
     prev = None
     if pagination.has_prev:
-        prev = url_for('api.get_posts', id=id, page=page - 1)
+        prev = url_for('api.get_user_posts', id=id, page=page - 1)
     next = None
     if pagination.has_next:
-        next = url_for('api.get_posts', id=id, page=page + 1)
+        next = url_for('api.get_user_posts', id=id, page=page + 1)
     return jsonify({'posts': [post.convert_post_json() for post in posts],
                      'prev_url': prev,
                      'next_url': next,
@@ -147,30 +166,57 @@ def get_user_posts(id):
 @api.route('/user_account/<int:id>/followed_posts')
 @jwt_required()
 def get_followed_posts(id):
-    page = request.args.get('page', 1, type=int)
+    per_page = current_app.config['MYRECBLOG_POSTS_PER_PAGE']
     user = User.query.get_or_404(id)
-    pagination = user.followed_posts.order_by(Post.date_posted.desc()). \
-        paginate(page, per_page=current_app.config['MYRECBLOG_POSTS_PER_PAGE'],
-                  error_out=False )
+    # keyset pagination, pass an empty cursor to get the first page
+    cursor = request.args.get('cursor')
+    if cursor is not None:
+        posts, next_cursor, prev_cursor = keyset_window(
+            lambda bound, ascending, limit: user.timeline(limit, bound=bound, ascending=ascending),
+            'date_posted', 'id', cursor, per_page)
+        return jsonify({'posts': [post.convert_post_json() for post in posts],
+                        'prev_url': url_for('api.get_followed_posts', id=id, cursor=prev_cursor)
+                        if prev_cursor else None,
+                        'next_url': url_for('api.get_followed_posts', id=id, cursor=next_cursor)
+                        if next_cursor else None,
+                        'prev_cursor': prev_cursor,
+                        'next_cursor': next_cursor
+                        }), 200
+    page = request.args.get('page', 1, type=int)
+    pagination = user.timeline_page(page, per_page)
     posts = pagination.items
     prev = None
     if pagination.has_prev:
-        prev = url_for('api.get_posts', id=id, page=page - 1)
+        prev = url_for('api.get_followed_posts', id=id, page=page - 1)
     next = None
     if pagination.has_next:
-        next = url_for('api.get_posts', id=id, page=page + 1)
+        next = url_for('api.get_followed_posts', id=id, page=page + 1)
     return jsonify({'posts': [post.convert_post_json() for post in posts],
                      'prev_url': prev,
                      'next_url': next,
                      'count': pagination.total
                      }), 200
 
+# "cooks you may know": users followed by the followed users of the caller and authors liked by those who
+# like the same authors, from the in-memory follow graph
+@api.route('/suggestions/')
+@jwt_required()
+def get_suggestions():
+    limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+    suggestions = suggested_users(current_api_user().id, limit)
+    return jsonify({'suggestions': [{'url': url_for('api.get_user', user_id=user.id), 'username': user.username,
+                                     'image_file': user.image_file, 'score': score, 'mutual_follows': mutual,
+                                     'co_likers': co_likers}
+                                    for user, (_, score, mutual, co_likers) in suggestions]}), 200
+
+
 # logout user and expire token
 @api.route('/logout', methods=['DELETE'])
 @jwt_required()
 def logout():
-    token = get_jwt()["jti"]
-    db.session.add(BlacklistToken(token=token))
+    token = get_jwt()
+    expires_at = datetime.utcfromtimestamp(token["exp"]) if "exp" in token else None
+    db.session.add(BlacklistToken(token=token["jti"], expires_at=expires_at))
     db.session.commit()
     response = jsonify({"msg": "logout successful"})
     unset_jwt_cookies(response)
@@ -1,17 +1,139 @@
+import json
+import hashlib
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from datetime import datetime, timezone
 from functools import wraps
-from flask import g
+from flask import g, request, current_app
 from flask_jwt_extended import get_jwt_identity
+from sqlalchemy import tuple_
+from sqlalchemy.orm import joinedload
+from . import api
 from .errors import forbidden
-from ..models import User, Permission
+from ..exceptions import ValidationError
+from ..models import User
+
+
+# the application context, and so g, outlives a request when one was pushed beforehand
+@api.before_request
+def forget_current_user():
+    g.pop('current_user', None)
+
+
+# the user of the JWT of the request with its role, queried once per request and kept on g
+# for the decorators and the views
+def current_api_user():
+    if 'current_user' not in g:
+        g.current_user = User.query.options(joinedload(User.role)).filter_by(email=get_jwt_identity()).first()
+    return g.current_user
 
 
 def permission_required(permission):
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            user = User.query.filter_by(email=get_jwt_identity()).first()
-            if not user.can(permission):
+            user = current_api_user()
+            if user is None or not user.can(permission):
                 return forbidden('Insufficient permission rights.')
             return f(*args, **kwargs)
         return decorated_function
     return decorator
+
+
+# opaque cursor of the keyset pagination: the sort value and the id of the boundary item of a page
+# together with the direction to move from it ('next' or 'prev')
+def encode_cursor(value, item_id, direction):
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([value, item_id, direction]).encode('utf-8')
+    return urlsafe_b64encode(raw).decode('utf-8').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        value, item_id, direction = json.loads(urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if isinstance(value, str):
+            value = datetime.fromisoformat(value)
+        if direction not in ('next', 'prev'):
+            raise ValueError(direction)
+        return value, int(item_id), direction
+    except (ValueError, TypeError):
+        raise ValidationError('Invalid cursor.')
+
+
+# keyset pagination over (order_column, id_column): every page is an index range scan starting right after
+# the cursor, so deep pages cost the same as the first one and no COUNT(*) is needed.
+# An empty cursor returns the first page. Returns the page items, next_cursor and prev_cursor.
+def keyset_paginate(query, order_column, id_column, cursor, per_page, descending=True):
+    def fetch(bound, ascending, limit):
+        page = query
+        if bound is not None:
+            key = tuple_(order_column, id_column)
+            page = page.filter(key > tuple_(*bound) if ascending else key < tuple_(*bound))
+        if ascending:
+            page = page.order_by(order_column.asc(), id_column.asc())
+        else:
+            page = page.order_by(order_column.desc(), id_column.desc())
+        return page.limit(limit).all()
+    return keyset_window(fetch, order_column.key, id_column.key, cursor, per_page, descending)
+
+
+# keyset pagination over any source: fetch(bound, ascending, limit) returns up to limit items after the
+# (order value, id) bound, or from the start when bound is None
+def keyset_window(fetch, order_key, id_key, cursor, per_page, descending=True):
+    backwards = False
+    bound = None
+    if cursor:
+        value, item_id, direction = decode_cursor(cursor)
+        backwards = direction == 'prev'
+        bound = (value, item_id)
+    items = fetch(bound, descending == backwards, per_page + 1)
+    has_more = len(items) > per_page
+    items = items[:per_page]
+    if backwards:
+        items.reverse()
+    if not items:
+        return items, None, None
+    next_cursor = prev_cursor = None
+    if has_more or backwards:
+        next_cursor = encode_cursor(getattr(items[-1], order_key), getattr(items[-1], id_key), 'next')
+    if cursor and (has_more or not backwards):
+        prev_cursor = encode_cursor(getattr(items[0], order_key), getattr(items[0], id_key), 'prev')
+    return items, next_cursor, prev_cursor
+
+
+# strong entity tag of a response, computed from the ids and update times of the rows it is built from
+# instead of from the serialized body
+def version_etag(*versions):
+    return hashlib.blake2b(repr(versions).encode('utf-8'), digest_size=16).hexdigest()
+
+
+def with_validators(response, etag, last_modified=None):
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # responses depend on the token, clients may keep them but have to revalidate them
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+# conditional GET: returns a 304 response when the copy of the client is current, None when the full response
+# has to be built. If-None-Match takes precedence over If-Modified-Since, which has a one second resolution.
+def not_modified(etag, last_modified=None):
+    if request.if_none_match:
+        current = request.if_none_match.contains_weak(etag)
+    elif last_modified is not None and request.if_modified_since is not None:
+        since = request.if_modified_since
+        if since.tzinfo is not None:
+            since = since.astimezone(timezone.utc).replace(tzinfo=None)
+        current = last_modified.replace(microsecond=0) <= since
+    else:
+        current = False
+    if not current:
+        return None
+    return with_validators(current_app.response_class(status=304), etag, last_modified)
+
+
+# loads the full rows of a page found with a query over the validator columns only, in the order of the page
+def load_in_order(model, ids):
+    items = {item.id: item for item in model.query.filter(model.id.in_(ids))} if ids else {}
+    return [items[item_id] for item_id in ids if item_id in items]
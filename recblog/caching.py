@@ -0,0 +1,289 @@
+import time
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from flask import current_app
+
+
+class SectionCache:
+    """Precomputed page sections shared by all visitors. Every entry is stamped with the generation it was built
+    in; invalidate() starts a new generation once a change is committed. An outdated entry is still served while
+    a single background thread per key rebuilds it, only keys without any entry are built within the request.
+    Entries also expire after MYRECBLOG_SECTION_CACHE_TTL seconds, which picks up changes made by other processes."""
+
+    def __init__(self, app=None):
+        self.ttl = 60
+        self._lock = threading.Lock()
+        self._generation = 0
+        # key -> (generation, built at, value)
+        self._entries = {}
+        self._refreshing = {}
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refresh_errors = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.ttl = app.config['MYRECBLOG_SECTION_CACHE_TTL']
+        self.clear()
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+
+    def clear(self):
+        self.wait()
+        with self._lock:
+            self._generation += 1
+            self._entries = {}
+            self.hits = self.stale_hits = self.misses = self.refresh_errors = 0
+
+    def _store(self, key, generation, built_at, value):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (entry[0], entry[1]) <= (generation, built_at):
+                self._entries[key] = (generation, built_at, value)
+
+    def _refresh(self, app, key, builder, generation):
+        built_at = time.monotonic()
+        try:
+            with app.app_context():
+                value = builder()
+            self._store(key, generation, built_at, value)
+        except Exception:
+            app.logger.exception(f'Rebuilding the cached section {key} failed')
+            with self._lock:
+                self.refresh_errors += 1
+        finally:
+            with self._lock:
+                self._refreshing.pop(key, None)
+
+    # returns the cached value of key, builder() is called within an application context to (re)build it
+    def get(self, key, builder):
+        now = time.monotonic()
+        with self._lock:
+            generation = self._generation
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] == generation and now - entry[1] < self.ttl:
+                    self.hits += 1
+                    return entry[2]
+                self.stale_hits += 1
+                if key not in self._refreshing:
+                    thread = threading.Thread(target=self._refresh, daemon=True,
+                                              args=(current_app._get_current_object(), key, builder, generation))
+                    self._refreshing[key] = thread
+                    thread.start()
+                return entry[2]
+            self.misses += 1
+        value = builder()
+        self._store(key, generation, now, value)
+        return value
+
+    # waits for the running background rebuilds
+    def wait(self, timeout=None):
+        with self._lock:
+            threads = list(self._refreshing.values())
+        for thread in threads:
+            thread.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'generation': self._generation, 'hits': self.hits,
+                    'stale_hits': self.stale_hits, 'misses': self.misses, 'refreshing': len(self._refreshing),
+                    'refresh_errors': self.refresh_errors}
+
+
+class TokenBlocklist:
+    """In-process copy of the revoked JWT ids with their expiry times, answering the revocation check of every
+    API request from memory. Tokens revoked by this process are added once the revocation is committed; rows
+    written by other processes are picked up by an indexed scan of the ids above the last one seen, run at most
+    every MYRECBLOG_BLOCKLIST_SYNC_INTERVAL seconds (0 checks on every request). Expired tokens are dropped,
+    JWT itself already rejects them."""
+
+    def __init__(self, app=None):
+        self.sync_interval = 1
+        self._lock = threading.Lock()
+        self._revoked = {}
+        self._last_id = 0
+        self._synced_at = None
+        self.checks = 0
+        self.syncs = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.sync_interval = app.config['MYRECBLOG_BLOCKLIST_SYNC_INTERVAL']
+        self.clear()
+
+    def clear(self):
+        self.reload()
+        with self._lock:
+            self.checks = self.syncs = 0
+
+    # drops the copy, the next check loads the blocklist again
+    def reload(self):
+        with self._lock:
+            self._revoked = {}
+            self._last_id = 0
+            self._synced_at = None
+
+    def add(self, jti, expires_at=None):
+        with self._lock:
+            self._revoked[jti] = expires_at
+
+    def _drop_expired(self, now):
+        self._revoked = {jti: expires_at for jti, expires_at in self._revoked.items()
+                         if expires_at is None or expires_at > now}
+
+    # ids are taken from a sequence before the rows are committed, so a row can become visible after one with
+    # a higher id; the scan starts a few ids below the last one seen to pick such rows up
+    SYNC_LOOKBACK = 64
+
+    def sync(self):
+        from . import db
+        from .models import BlacklistToken
+        with self._lock:
+            last_id = max(self._last_id - self.SYNC_LOOKBACK, 0)
+        tokens = BlacklistToken.__table__
+        now = datetime.utcnow()
+        rows = db.session.execute(db.select([tokens.c.id, tokens.c.token, tokens.c.expires_at])
+                                  .where(tokens.c.id > last_id).order_by(tokens.c.id)).fetchall()
+        with self._lock:
+            for token_id, jti, expires_at in rows:
+                if expires_at is None or expires_at > now:
+                    self._revoked[jti] = expires_at
+                self._last_id = max(self._last_id, token_id)
+            self._drop_expired(now)
+            self._synced_at = time.monotonic()
+            self.syncs += 1
+
+    def is_revoked(self, jti):
+        with self._lock:
+            self.checks += 1
+            due = self._synced_at is None or time.monotonic() - self._synced_at >= self.sync_interval
+        if due:
+            self.sync()
+        with self._lock:
+            return jti in self._revoked
+
+    def stats(self):
+        with self._lock:
+            return {'revoked': len(self._revoked), 'last_id': self._last_id, 'checks': self.checks,
+                    'syncs': self.syncs}
+
+
+class IdentityCache:
+    """Process memory copies of what the permission checks of a page need: snapshots of the column values of the
+    users loaded for the login session, keyed by id, and the roles table. At most MYRECBLOG_IDENTITY_CACHE_SIZE
+    snapshots are kept, the least recently used are dropped first. Snapshots and roles expire after
+    MYRECBLOG_IDENTITY_CACHE_TTL seconds, which picks up changes made by other processes; changes committed by
+    this process drop them at once."""
+
+    def __init__(self, app=None):
+        self.ttl = 30
+        self.size = 1024
+        self._lock = threading.Lock()
+        # user id -> (stored at, column values)
+        self._users = OrderedDict()
+        # role id -> (name, permissions, default)
+        self._roles = None
+        self._roles_loaded_at = None
+        self.hits = 0
+        self.misses = 0
+        self.role_loads = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.ttl = app.config['MYRECBLOG_IDENTITY_CACHE_TTL']
+        self.size = app.config['MYRECBLOG_IDENTITY_CACHE_SIZE']
+        self.clear()
+
+    def clear(self):
+        self.reload_roles()
+        with self._lock:
+            self._users = OrderedDict()
+            self.hits = self.misses = self.role_loads = 0
+
+    def get_user(self, user_id):
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is not None and time.monotonic() - entry[0] < self.ttl:
+                self._users.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            self._users.pop(user_id, None)
+            self.misses += 1
+        return None
+
+    def store_user(self, user_id, values):
+        with self._lock:
+            self._users[user_id] = (time.monotonic(), values)
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.size:
+                self._users.popitem(last=False)
+
+    # changes a few values of a snapshot, for writes that bypass the session like the last seen time
+    def update_user(self, user_id, **values):
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is not None:
+                self._users[user_id] = (entry[0], dict(entry[1], **values))
+
+    def forget_user(self, user_id):
+        with self._lock:
+            self._users.pop(user_id, None)
+
+    # drops the roles, the next check loads the table again
+    def reload_roles(self):
+        with self._lock:
+            self._roles = None
+            self._roles_loaded_at = None
+
+    def _load_roles(self):
+        from . import db
+        from .models import Role
+        roles = Role.__table__
+        rows = db.session.execute(db.select([roles.c.id, roles.c.name, roles.c.permissions, roles.c.default]))
+        loaded = {role_id: (name, permissions or 0, bool(default)) for role_id, name, permissions, default in rows}
+        with self._lock:
+            self._roles = loaded
+            self._roles_loaded_at = time.monotonic()
+            self.role_loads += 1
+        return loaded
+
+    def roles(self):
+        with self._lock:
+            roles = self._roles
+            if roles is not None and time.monotonic() - self._roles_loaded_at < self.ttl:
+                return roles
+        return self._load_roles()
+
+    def role_permissions(self, role_id):
+        if role_id is None:
+            return None
+        role = self.roles().get(role_id)
+        return None if role is None else role[1]
+
+    @staticmethod
+    def _find_role(roles, name):
+        for role_id, (role_name, _, default) in roles.items():
+            if role_name == name if name is not None else default:
+                return role_id
+        return None
+
+    # id of the role with the given name, or of the default role; a role missing from the copy may have been
+    # created since it was loaded, the table is read again before giving up
+    def role_id(self, name=None):
+        role_id = self._find_role(self.roles(), name)
+        if role_id is None:
+            role_id = self._find_role(self._load_roles(), name)
+        return role_id
+
+    def stats(self):
+        with self._lock:
+            return {'users': len(self._users), 'roles': len(self._roles or ()), 'hits': self.hits,
+                    'misses': self.misses, 'role_loads': self.role_loads}
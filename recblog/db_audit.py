@@ -0,0 +1,66 @@
+from datetime import datetime, timedelta
+from sqlalchemy import tuple_
+from . import db
+from .models import User, Post, Follow, Comment, FavoritePosts, TimelineEntry, PostSimilar
+
+
+# hot queries of the application as (name, query) pairs, every one of them must be served by an index
+def hot_queries(user_id=1, post_id=1):
+    now = datetime.utcnow()
+    user = User.query.get(user_id) or User(id=user_id)
+    return [
+        ('user by email', User.query.filter_by(email='sue@example.com')),
+        ('latest posts', Post.query.order_by(Post.date_posted.desc(), Post.id.desc()).limit(12)),
+        ('posts keyset page', Post.query.filter(tuple_(Post.date_posted, Post.id) < tuple_(now, post_id))
+            .order_by(Post.date_posted.desc(), Post.id.desc()).limit(12)),
+        ('posts by category', Post.query.filter_by(type_category='pie').order_by(Post.date_posted.desc()).limit(12)),
+        ('posts by author', Post.query.filter_by(user_id=user_id).order_by(Post.date_posted.desc()).limit(12)),
+        ('quickest posts', Post.query.filter(Post.total_minutes <= 30).order_by(Post.total_minutes, Post.id).limit(12)),
+        ('followed posts', user.followed_posts.order_by(Post.date_posted.desc()).limit(12)),
+        ('timeline page', TimelineEntry.query.filter_by(user_id=user_id)
+            .order_by(TimelineEntry.date_posted.desc(), TimelineEntry.post_id.desc()).limit(12)),
+        ('pulled timeline authors', Post.query.join(Follow, Follow.followed_id == Post.user_id)
+            .join(User, User.id == Post.user_id).filter(Follow.follower_id == user_id, User.timeline_pull == True)
+            .order_by(Post.date_posted.desc(), Post.id.desc()).limit(12)),
+        ('followers of user', Follow.query.filter_by(followed_id=user_id)),
+        ('followed by user', Follow.query.filter_by(follower_id=user_id)),
+        ('similar posts', PostSimilar.query.filter_by(post_id=post_id)
+            .order_by(PostSimilar.score.desc(), PostSimilar.similar_post_id).limit(4)),
+        ('post comments', Comment.query.filter_by(post_id=post_id).order_by(Comment.comment_date.asc())),
+        ('comments by author', db.session.query(Comment.author_id, db.func.count())
+            .filter(Comment.author_id.in_([user_id])).group_by(Comment.author_id)),
+        ('like of user', FavoritePosts.query.filter_by(post_id=post_id, liker_id=user_id)),
+        ('likes of user', db.session.query(FavoritePosts.liker_id, db.func.count())
+            .filter(FavoritePosts.liker_id.in_([user_id])).group_by(FavoritePosts.liker_id)),
+        ('likes in date range', FavoritePosts.query.filter(FavoritePosts.date_liked >= now - timedelta(days=30),
+                                                           FavoritePosts.date_liked < now)),
+    ]
+
+
+def explain_query_plan(query):
+    sql = str(query.statement.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True}))
+    return [row[-1] for row in db.session.execute(db.text('EXPLAIN QUERY PLAN ' + sql))]
+
+
+# SQLite reports a full table scan as 'SCAN <table>' ('SCAN TABLE <table>' before 3.36),
+# scans walking an index in order are reported with 'USING ... INDEX' and are fine
+def full_scans(plan):
+    tables = set(db.metadata.tables)
+    scans = []
+    for detail in plan:
+        words = detail.split()
+        if words[:1] != ['SCAN'] or 'USING' in words:
+            continue
+        table = words[2] if words[1] == 'TABLE' else words[1]
+        if table in tables:
+            scans.append(table)
+    return scans
+
+
+# returns (name, plan, full scanned tables) for every hot query
+def audit_hot_queries(**kwargs):
+    results = []
+    for name, query in hot_queries(**kwargs):
+        plan = explain_query_plan(query)
+        results.append((name, plan, full_scans(plan)))
+    return results
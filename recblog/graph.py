@@ -0,0 +1,152 @@
+import time
+import threading
+import numpy as np
+
+# weight of a followed user who follows the candidate, and of another liker of the authors a user likes
+# who also likes the candidate
+MUTUAL_WEIGHT = 1.0
+CO_LIKER_WEIGHT = 0.5
+
+
+def _csr(sources, targets, size):
+    order = np.lexsort((targets, sources))
+    indptr = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=size), out=indptr[1:])
+    return indptr, targets[order].astype(np.int32)
+
+
+# rows of a CSR adjacency gathered at once: the (source, target) pairs of the given rows, at most cap per row
+def _gather(indptr, indices, rows, cap):
+    rows = rows[rows < len(indptr) - 1]
+    starts = indptr[rows]
+    lengths = np.minimum(indptr[rows + 1] - starts, cap)
+    total = int(lengths.sum())
+    if not total:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    offsets = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths) + np.arange(total)
+    return np.repeat(rows, lengths), indices[offsets].astype(np.int64)
+
+
+class FollowGraph:
+    """Compact in-memory copy of the follow graph and of the authors every user liked, as CSR arrays indexed by
+    user id, for the "cooks you may know" suggestions. Follows committed by this process since the arrays were
+    built are kept in an overlay; the arrays are rebuilt from the database every MYRECBLOG_FOLLOW_GRAPH_TTL
+    seconds, which also picks up the follows and likes of other processes. Every hop of a suggestion walks at
+    most MYRECBLOG_SUGGESTIONS_FANOUT neighbours per user."""
+
+    def __init__(self, app=None):
+        self.ttl = 600
+        self.fanout = 200
+        self.max_overlay = 10000
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        empty = (np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int32))
+        self._follows = self._liked = self._likers = empty
+        # (follower_id, followed_id) -> (sequence, followed or not)
+        self._overlay = {}
+        self._sequence = 0
+        self.rebuilds = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.ttl = app.config['MYRECBLOG_FOLLOW_GRAPH_TTL']
+        self.fanout = app.config['MYRECBLOG_SUGGESTIONS_FANOUT']
+        self.clear()
+
+    # loads the follows in primary key order and the liked authors with a join of favorites and posts
+    def rebuild(self):
+        from . import db
+        from .models import Follow, FavoritePosts, Post
+        with self._lock:
+            sequence = self._sequence
+        follows = np.array(db.session.query(Follow.follower_id, Follow.followed_id).all(), dtype=np.int64)\
+            .reshape(-1, 2)
+        likes = np.array(db.session.query(FavoritePosts.liker_id, Post.user_id)
+                         .join(Post, Post.id == FavoritePosts.post_id).distinct().all(), dtype=np.int64).reshape(-1, 2)
+        size = int(max(follows.max(initial=0), likes.max(initial=0))) + 1
+        graph = (_csr(follows[:, 0], follows[:, 1], size), _csr(likes[:, 0], likes[:, 1], size),
+                 _csr(likes[:, 1], likes[:, 0], size))
+        with self._lock:
+            self._follows, self._liked, self._likers = graph
+            # follows committed while the arrays were loaded stay in the overlay
+            self._overlay = {pair: change for pair, change in self._overlay.items() if change[0] > sequence}
+            self._loaded_at = time.monotonic()
+            self.rebuilds += 1
+
+    def _ensure_loaded(self):
+        with self._lock:
+            stale = self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl \
+                or len(self._overlay) > self.max_overlay
+        if stale:
+            self.rebuild()
+
+    # records a committed follow or unfollow
+    def apply(self, follower_id, followed_id, following):
+        with self._lock:
+            self._sequence += 1
+            self._overlay[(follower_id, followed_id)] = (self._sequence, following)
+
+    def clear(self):
+        with self._lock:
+            self._loaded_at = None
+            self._overlay = {}
+            self.rebuilds = 0
+
+    def _followed(self, indptr, indices, user_id, overlay):
+        followed = set(_gather(indptr, indices, np.array([user_id], dtype=np.int64), len(indices))[1].tolist())
+        for (follower_id, followed_id), (_, following) in overlay.items():
+            if follower_id == user_id:
+                (followed.add if following else followed.discard)(followed_id)
+        return followed
+
+    # top suggestions for user_id as [(user_id, score, mutual follows, co-likers)]; candidates are the users
+    # followed by the followed users and the authors liked by those who like the same authors
+    def suggest(self, user_id, limit=10):
+        self._ensure_loaded()
+        with self._lock:
+            (indptr, indices), liked, likers = self._follows, self._liked, self._likers
+            overlay = dict(self._overlay)
+        followed = self._followed(indptr, indices, user_id, overlay)
+        followed_rows = np.fromiter(followed, dtype=np.int64, count=len(followed))
+
+        sources, mutual = _gather(indptr, indices, followed_rows, self.fanout)
+        if overlay:
+            # follows changed since the arrays were built are taken from the overlay only
+            changed = np.array([(a << 32) + b for a, b in overlay], dtype=np.int64)
+            mutual = mutual[~np.isin((sources << 32) + mutual, changed)]
+            added = [b for (a, b), (_, following) in overlay.items() if following and a in followed]
+            mutual = np.concatenate((mutual, np.array(added, dtype=np.int64)))
+
+        # distinct (co-liker, author) pairs, an author counts once per co-liker
+        authors = np.unique(_gather(*liked, np.array([user_id], dtype=np.int64), self.fanout)[1])
+        co_likers = np.unique(_gather(*likers, authors, self.fanout)[1])
+        co_likers, co_liked = _gather(*liked, co_likers[co_likers != user_id], self.fanout)
+        co_liked = np.unique((co_likers << 32) + co_liked) & 0xFFFFFFFF
+
+        candidates = np.concatenate((mutual, co_liked))
+        if not len(candidates):
+            return []
+        kinds = np.concatenate((np.zeros(len(mutual), dtype=np.int64), np.ones(len(co_liked), dtype=np.int64)))
+        keep = ~np.isin(candidates, np.append(followed_rows, user_id))
+        candidates, kinds = candidates[keep], kinds[keep]
+        user_ids, inverse = np.unique(candidates, return_inverse=True)
+        mutual_counts = np.bincount(inverse, weights=(kinds == 0).astype(np.float64), minlength=len(user_ids))
+        co_liker_counts = np.bincount(inverse, weights=(kinds == 1).astype(np.float64), minlength=len(user_ids))
+        scores = MUTUAL_WEIGHT * mutual_counts + CO_LIKER_WEIGHT * co_liker_counts
+        order = np.lexsort((user_ids, -scores))[:limit]
+        return [(int(user_ids[i]), float(scores[i]), int(mutual_counts[i]), int(co_liker_counts[i])) for i in order]
+
+    def stats(self):
+        with self._lock:
+            return {'users': len(self._follows[0]) - 1, 'follows': len(self._follows[1]),
+                    'liked_authors': len(self._liked[1]), 'overlay': len(self._overlay), 'rebuilds': self.rebuilds}
+
+
+# suggested users for user_id with their suggestion, loaded with one query
+def suggested_users(user_id, limit=10):
+    from . import follow_graph
+    from .models import User
+    suggestions = follow_graph.suggest(user_id, limit)
+    users = {user.id: user for user in User.query.filter(User.id.in_([item[0] for item in suggestions]))}
+    return [(users[item[0]], item) for item in suggestions if item[0] in users]
@@ -0,0 +1,374 @@
+import os
+import re
+import glob
+import time
+import hashlib
+import secrets
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+from flask import current_app, url_for
+from PIL import Image
+from wtforms.validators import StopValidation
+from .exceptions import ValidationError
+
+
+# derivatives are named after the stored picture, e.g. 1a2b.png -> 1a2b.640w.webp and 1a2b.640w.jpg
+DERIVATIVE_FORMATS = ('webp', 'jpg')
+DERIVATIVE_RE = re.compile(r'\.\d+w\.(webp|jpg)$')
+PICTURE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp')
+
+# formats accepted for uploads, checked from the file header rather than from the file name
+UPLOAD_FORMATS = ('JPEG', 'PNG', 'GIF', 'WEBP')
+
+# pictures are stored under the sha256 of the upload, fanned out into two levels of subdirectories,
+# e.g. 1a/2b/1a2b...9f.jpg, so identical uploads share one file and no directory grows too large
+CONTENT_RE = re.compile(r'^([0-9a-f]{2})/([0-9a-f]{2})/\1\2[0-9a-f]{60}\.[a-z0-9]+$')
+
+
+def content_path(digest, ext):
+    return f'{digest[:2]}/{digest[2:4]}/{digest}{ext.lower()}'
+
+
+def is_content_addressed(filename):
+    return CONTENT_RE.match(filename) is not None
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as stored:
+        for chunk in iter(lambda: stored.read(64 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def derivative_name(filename, width, fmt):
+    stem, _ = os.path.splitext(filename)
+    return f'{stem}.{width}w.{fmt}'
+
+
+# writes WebP and progressive JPEG copies of the picture at every width, never upscaled;
+# the copies are built from bare pixel data so EXIF, ICC and comments of the upload are dropped
+def save_derivatives(image, dest_path, widths):
+    stripped = Image.new('RGB', image.size)
+    stripped.paste(image.convert('RGB'))
+    for width in widths:
+        derivative = stripped
+        if stripped.width > width:
+            derivative = stripped.resize((width, max(1, round(stripped.height * width / stripped.width))),
+                                         Image.LANCZOS)
+        derivative.save(derivative_name(dest_path, width, 'webp'), 'WEBP', quality=80, method=4)
+        derivative.save(derivative_name(dest_path, width, 'jpg'), 'JPEG', quality=82, optimize=True,
+                        progressive=True)
+
+
+# checks the byte size of an upload and, from its header only, its format and dimensions,
+# so oversized pictures are rejected before anything is decoded
+def check_upload(stream, max_bytes, max_pixels):
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    if size > max_bytes:
+        raise ValidationError(f'The picture is larger than {max_bytes / 1024 / 1024:g} MB.')
+    try:
+        with Image.open(stream) as image:
+            image_format, (width, height) = image.format, image.size
+    except Image.DecompressionBombError:
+        image_format, width, height = None, max_pixels, max_pixels
+    except (OSError, ValueError):
+        raise ValidationError('The file is not a picture.')
+    finally:
+        stream.seek(0)
+    if width * height > max_pixels:
+        raise ValidationError(f'The picture has more than {max_pixels / 1000 / 1000:g} megapixels.')
+    if image_format not in UPLOAD_FORMATS:
+        raise ValidationError('Only JPEG, PNG, GIF and WebP pictures are accepted.')
+
+
+class PictureLimits:
+    """Form validator rejecting uploads above MYRECBLOG_MAX_UPLOAD_BYTES or MYRECBLOG_MAX_IMAGE_PIXELS."""
+
+    def __call__(self, form, field):
+        if not field.data:
+            return
+        try:
+            check_upload(field.data.stream, current_app.config['MYRECBLOG_MAX_UPLOAD_BYTES'],
+                         current_app.config['MYRECBLOG_MAX_IMAGE_PIXELS'])
+        except ValidationError as e:
+            raise StopValidation(str(e))
+
+
+# decodes a raw upload, thumbnails it into dest_path together with its derivatives and removes the raw file;
+# runs in the worker processes, returns the processing time in seconds
+def process_image(raw_path, dest_path, output_size, widths=()):
+    started = time.perf_counter()
+    try:
+        with Image.open(raw_path) as image:
+            # JPEGs are decoded directly at the smallest 1/2, 1/4 or 1/8 scale still covering output_size
+            image.draft('RGB', output_size)
+            image.thumbnail(output_size)
+            if widths:
+                save_derivatives(image, dest_path, widths)
+            # written last and renamed into place, an existing dest_path is always a complete picture
+            part_path = f'{dest_path}.{secrets.token_hex(4)}.part'
+            image.save(part_path, format=Image.registered_extensions().get(os.path.splitext(dest_path)[1].lower()))
+            os.replace(part_path, dest_path)
+    finally:
+        os.remove(raw_path)
+    return time.perf_counter() - started
+
+
+# creates the missing derivatives of a stored picture, returns 'created', 'skipped' or 'failed'
+def make_derivatives(path, widths, force=False):
+    if not force and all(os.path.exists(derivative_name(path, width, fmt))
+                         for width in widths for fmt in DERIVATIVE_FORMATS):
+        return 'skipped'
+    try:
+        with Image.open(path) as image:
+            save_derivatives(image, path, widths)
+    except (OSError, ValueError):
+        return 'failed'
+    return 'created'
+
+
+# stored pictures below upload_dir, derivatives excluded
+def stored_pictures(upload_dir):
+    for root, _, files in os.walk(upload_dir):
+        for name in sorted(files):
+            if name.lower().endswith(PICTURE_EXTENSIONS) and not DERIVATIVE_RE.search(name):
+                yield os.path.join(root, name)
+
+
+# generates the derivatives of all stored recipe pictures in a process pool, returns the count per outcome
+def backfill_derivatives(upload_dir, widths, workers=None, force=False):
+    paths = list(stored_pictures(upload_dir))
+    results = {'created': 0, 'skipped': 0, 'failed': 0}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for result in executor.map(make_derivatives, paths, [widths] * len(paths), [force] * len(paths),
+                                   chunksize=16):
+            results[result] += 1
+    return results
+
+
+def derivative_paths(path):
+    stem, _ = os.path.splitext(path)
+    return [name for name in glob.glob(glob.escape(stem) + '.*w.*') if DERIVATIVE_RE.search(name)]
+
+
+def remove_picture(path):
+    for name in [path] + derivative_paths(path):
+        if os.path.exists(name):
+            os.remove(name)
+
+
+# moves a flat stored picture and its derivatives to their content addressed paths below folder_dir,
+# returns the new filename
+def move_to_content_path(path, folder_dir):
+    filename = content_path(file_digest(path), os.path.splitext(path)[1])
+    target = os.path.join(folder_dir, filename)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    derivatives = derivative_paths(path)
+    if os.path.exists(target):
+        remove_picture(path)
+    else:
+        os.replace(path, target)
+        stem, _ = os.path.splitext(target)
+        for name in derivatives:
+            os.replace(name, stem + name[len(os.path.splitext(path)[0]):])
+    return filename
+
+
+# rewrites the flat picture names of posts and users to content addressed ones, chunk by chunk of ids;
+# returns the number of moved files and of rewritten rows, missing files are left as they are
+def migrate_flat_uploads(upload_dir, chunk_size=500):
+    from . import db
+    from .models import Post, User
+    moved = {}
+    rows = 0
+    for column, folder in ((Post.post_image, 'recipes_pics'), (User.image_file, 'profile_pics')):
+        model = column.class_
+        last_id = 0
+        while True:
+            items = model.query.filter(model.id > last_id, column != 'default.jpg')\
+                .order_by(model.id).limit(chunk_size).all()
+            if not items:
+                break
+            last_id = items[-1].id
+            for item in items:
+                filename = getattr(item, column.key)
+                path = os.path.join(upload_dir, folder, filename)
+                if is_content_addressed(filename) or (path not in moved and not os.path.isfile(path)):
+                    continue
+                if path not in moved:
+                    moved[path] = move_to_content_path(path, os.path.join(upload_dir, folder))
+                setattr(item, column.key, moved[path])
+                rows += 1
+            db.session.commit()
+    return len(moved), rows
+
+
+# removes the content addressed pictures nobody has referenced for grace_seconds, together with their
+# derivatives and with processed files that never got a reference; returns the number of removed pictures
+def collect_garbage(upload_dir, grace_seconds=3600):
+    from . import db
+    from .models import StoredImage
+    images = StoredImage.__table__
+    cutoff = datetime.utcnow() - timedelta(seconds=grace_seconds)
+    removed = 0
+    unreferenced = db.session.execute(db.select([images.c.id, images.c.path])
+                                      .where(db.and_(images.c.refcount <= 0, images.c.updated_at < cutoff)))\
+        .fetchall()
+    for image_id, path in unreferenced:
+        # the row is deleted first, so a picture referenced again in the meantime is kept
+        result = db.session.execute(images.delete().where(db.and_(images.c.id == image_id,
+                                                                  images.c.refcount <= 0)))
+        db.session.commit()
+        if result.rowcount:
+            remove_picture(os.path.join(upload_dir, path))
+            removed += 1
+    known = {row[0] for row in db.session.execute(db.select([images.c.path]))}
+    for folder in ('recipes_pics', 'profile_pics'):
+        folder_dir = os.path.join(upload_dir, folder)
+        for path in stored_pictures(folder_dir):
+            filename = os.path.relpath(path, folder_dir).replace(os.sep, '/')
+            if is_content_addressed(filename) and folder + '/' + filename not in known \
+                    and datetime.utcfromtimestamp(os.path.getmtime(path)) < cutoff:
+                remove_picture(path)
+                removed += 1
+    return removed
+
+
+# srcset of the derivatives of a recipe picture at the widths recorded with it, empty until they exist;
+# nothing is looked up on disk while rendering
+def picture_srcset(filename, fmt='webp', widths=None):
+    if not widths:
+        return ''
+    return ', '.join(url_for('static', filename='uploads/recipes_pics/' + derivative_name(filename, width, fmt))
+                     + f' {width}w' for width in map(int, widths.split(',')))
+
+
+# records the widths of the derivatives on the posts whose pictures have all of them, chunk by chunk of ids;
+# returns the number of posts updated
+def record_derivative_widths(pictures_dir, widths, chunk_size=1000):
+    from . import db
+    from .models import Post
+    posts = Post.__table__
+    recorded = ','.join(map(str, widths))
+    updated = 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(db.select([posts.c.id, posts.c.post_image, posts.c.post_image_widths])
+                                  .where(posts.c.id > last_id).order_by(posts.c.id).limit(chunk_size)).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        ready = [post_id for post_id, filename, current in rows if current != recorded and widths and all(
+            os.path.exists(os.path.join(pictures_dir, derivative_name(filename, width, fmt)))
+            for width in widths for fmt in DERIVATIVE_FORMATS)]
+        if ready:
+            db.session.execute(posts.update().where(posts.c.id.in_(ready)).values(post_image_widths=recorded))
+        db.session.commit()
+        updated += len(ready)
+    return updated
+
+
+class ImageProcessor:
+    """Processes uploaded pictures on a bounded process pool, so requests only pay for saving the raw upload."""
+
+    def __init__(self, app=None):
+        self.workers = 2
+        self.queue_size = 32
+        self.queued = 0
+        self.processed = 0
+        self.inline = 0
+        self.failed = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.workers = app.config['MYRECBLOG_IMAGE_WORKERS']
+        self.queue_size = app.config['MYRECBLOG_IMAGE_QUEUE_SIZE']
+
+    # the pool is created lazily and again after a fork, worker processes are not shared between app processes
+    def _get_executor(self):
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            self._pid = os.getpid()
+        return self._executor
+
+    # saves the upload as is, without decoding it, returns the raw path and the sha256 of the upload;
+    # the copy stops as soon as the upload grows past MYRECBLOG_MAX_UPLOAD_BYTES
+    def save_raw(self, upload):
+        raw_dir = current_app.config['MYRECBLOG_RAW_UPLOADS_DIR']
+        max_bytes = current_app.config['MYRECBLOG_MAX_UPLOAD_BYTES']
+        os.makedirs(raw_dir, exist_ok=True)
+        raw_path = os.path.join(raw_dir, secrets.token_hex(16))
+        digest = hashlib.sha256()
+        size = 0
+        with open(raw_path, 'wb') as raw:
+            for chunk in iter(lambda: upload.stream.read(64 * 1024), b''):
+                size += len(chunk)
+                if size > max_bytes:
+                    break
+                digest.update(chunk)
+                raw.write(chunk)
+        if size > max_bytes:
+            os.remove(raw_path)
+            raise ValidationError(f'The picture is larger than {max_bytes / 1024 / 1024:g} MB.')
+        return raw_path, digest.hexdigest()
+
+    # processes raw_path into dest_path and its derivatives at the given widths, on_done() is called within
+    # an app context once the picture is ready; without workers or with a full queue it is processed right away,
+    # an already stored picture is not processed again
+    def submit(self, raw_path, dest_path, output_size, on_done, widths=()):
+        app = current_app._get_current_object()
+        if os.path.exists(dest_path):
+            os.remove(raw_path)
+            on_done()
+            return None
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        with self._lock:
+            queued = 0 < self.workers and self.queued < self.queue_size
+            if queued:
+                self.queued += 1
+        if not queued:
+            seconds = process_image(raw_path, dest_path, output_size, widths)
+            self._record(seconds, inline=True)
+            on_done()
+            return None
+        future = self._get_executor().submit(process_image, raw_path, dest_path, output_size, widths)
+        future.add_done_callback(lambda f: self._finished(app, f, on_done))
+        return future
+
+    def _finished(self, app, future, on_done):
+        with self._lock:
+            self.queued -= 1
+        with app.app_context():
+            try:
+                seconds = future.result()
+                on_done()
+            except Exception:
+                with self._lock:
+                    self.failed += 1
+                app.logger.exception('Image processing failed')
+                return
+        self._record(seconds)
+
+    def _record(self, seconds, inline=False):
+        with self._lock:
+            self.processed += 1
+            self.inline += inline
+            self.total_seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+
+    def stats(self):
+        with self._lock:
+            return {'workers': self.workers, 'queue_size': self.queue_size, 'queued': self.queued,
+                    'processed': self.processed, 'inline': self.inline, 'failed': self.failed,
+                    'avg_seconds': self.total_seconds / self.processed if self.processed else 0.0,
+                    'max_seconds': self.max_seconds}
@@ -0,0 +1,201 @@
+import re
+import time
+import threading
+import numpy as np
+
+
+# words dropped from ingredient lines: quantities, units and preparation notes
+UNITS = {'g', 'gr', 'gram', 'kg', 'kilogram', 'mg', 'ml', 'millilitre', 'milliliter', 'l', 'litre', 'liter', 'cl',
+         'dl', 'oz', 'ounce', 'lb', 'pound', 'cup', 'tbsp', 'tablespoon', 'tsp', 'teaspoon', 'pinch', 'dash',
+         'clove', 'can', 'tin', 'jar', 'slice', 'piece', 'handful', 'bunch', 'sprig', 'stick', 'package', 'pkg',
+         'packet', 'bag', 'head', 'drop', 'knob', 'x'}
+NOTES = {'of', 'a', 'an', 'the', 'and', 'or', 'to', 'for', 'some', 'few', 'about', 'approx', 'fresh', 'freshly',
+         'large', 'medium', 'small', 'big', 'chopped', 'finely', 'roughly', 'diced', 'sliced', 'minced', 'grated',
+         'ground', 'peeled', 'softened', 'melted', 'beaten', 'cold', 'warm', 'hot', 'room', 'temperature', 'taste',
+         'optional', 'heaped', 'level', 'whole', 'plus', 'extra', 'more'}
+_LIST_MARKER = re.compile(r'^\s*(?:[*+-]|\d+[.)])\s+')
+_PARENTHESES = re.compile(r'\([^)]*\)|\[[^\]]*\]')
+_WORD = re.compile(r"[a-z][a-z'-]*")
+
+
+def singular(word):
+    if len(word) > 4 and word.endswith('ies'):
+        return word[:-3] + 'y'
+    if len(word) > 4 and word.endswith(('oes', 'ches', 'shes', 'sses')):
+        return word[:-2]
+    if len(word) > 3 and word.endswith('s') and not word.endswith(('ss', 'us')):
+        return word[:-1]
+    return word
+
+
+# normalizes one ingredient line, e.g. '2 cups all-purpose Flour, sifted' -> 'all-purpose flour';
+# returns None for lines without an ingredient name
+def normalize_ingredient(line):
+    line = _PARENTHESES.sub(' ', _LIST_MARKER.sub('', line)).split(',')[0].lower()
+    words = [singular(word.strip("'-")) for word in _WORD.findall(line.replace('*', ' ').replace('_', ' '))]
+    words = [word for word in words if word and word not in UNITS and word not in NOTES]
+    return ' '.join(words[-3:]) or None
+
+
+# distinct normalized ingredients of a post, one per line of the markdown list;
+# a single line is taken as a comma separated list
+def parse_ingredients(text):
+    lines = [line for line in (text or '').splitlines() if line.strip()]
+    if len(lines) == 1:
+        lines = lines[0].split(',')
+    names = []
+    for line in lines:
+        name = normalize_ingredient(line)
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+class IngredientIndex:
+    """In-memory inverted index from ingredients to sorted arrays of post ids, answering
+    "what can I cook with these" queries. Posts changed by this process since the arrays were built
+    are kept in an overlay; the arrays are rebuilt from the database every MYRECBLOG_INGREDIENT_INDEX_TTL
+    seconds, which also picks up changes made by other processes."""
+
+    def __init__(self, app=None):
+        self.ttl = 300
+        self.max_overlay = 10000
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._postings = {}
+        self._sizes = np.zeros(0, dtype=np.int32)
+        self._names = {}
+        self._ids_by_name = {}
+        self._heads = {}
+        # post_id -> (sequence, frozenset of ingredient ids or None for deleted posts)
+        self._overlay = {}
+        self._sequence = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.ttl = app.config['MYRECBLOG_INGREDIENT_INDEX_TTL']
+
+    def _add_names(self, names):
+        for ingredient_id, name in names.items():
+            if ingredient_id not in self._names:
+                self._names[ingredient_id] = name
+                self._ids_by_name[name] = ingredient_id
+                self._heads.setdefault(name.rsplit(' ', 1)[-1], set()).add(ingredient_id)
+
+    # loads the posting lists with one ordered scan of post_ingredients
+    def rebuild(self):
+        from . import db
+        from .models import Ingredient, post_ingredients
+        with self._lock:
+            sequence = self._sequence
+        names = dict(db.session.query(Ingredient.id, Ingredient.name))
+        rows = db.session.execute(db.select([post_ingredients.c.ingredient_id, post_ingredients.c.post_id])
+                                  .order_by(post_ingredients.c.ingredient_id, post_ingredients.c.post_id)).fetchall()
+        postings, sizes = {}, np.zeros(0, dtype=np.int32)
+        if rows:
+            pairs = np.array(rows, dtype=np.int64)
+            post_ids = pairs[:, 1].astype(np.int32)
+            bounds = np.flatnonzero(np.diff(pairs[:, 0])) + 1
+            postings = dict(zip(pairs[np.concatenate(([0], bounds)), 0].tolist(), np.split(post_ids, bounds)))
+            sizes = np.bincount(post_ids).astype(np.int32)
+        with self._lock:
+            self._postings, self._sizes = postings, sizes
+            self._add_names(names)
+            # changes committed while the arrays were loaded stay in the overlay
+            self._overlay = {post_id: change for post_id, change in self._overlay.items() if change[0] > sequence}
+            self._loaded_at = time.monotonic()
+
+    def _ensure_loaded(self):
+        with self._lock:
+            stale = self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl \
+                or len(self._overlay) > self.max_overlay
+        if stale:
+            self.rebuild()
+
+    # records the new ingredients of a committed post, None for a deleted post
+    def apply(self, post_id, ingredient_ids, names=None):
+        with self._lock:
+            self._sequence += 1
+            self._add_names(names or {})
+            self._overlay[post_id] = (self._sequence, None if ingredient_ids is None else frozenset(ingredient_ids))
+
+    def clear(self):
+        with self._lock:
+            self._loaded_at = None
+            self._postings, self._sizes = {}, np.zeros(0, dtype=np.int32)
+            self._names, self._ids_by_name, self._heads = {}, {}, {}
+            self._overlay = {}
+
+    # ingredient ids a wanted ingredient stands for: the exact name, and every ingredient with that head noun,
+    # so 'flour' also covers 'rye flour'
+    def _expand(self, wanted):
+        ids = set()
+        for name in filter(None, map(normalize_ingredient, wanted)):
+            if name in self._ids_by_name:
+                ids.add(self._ids_by_name[name])
+            if ' ' not in name:
+                ids.update(self._heads.get(name, ()))
+        return ids
+
+    def covering_ids(self, wanted):
+        self._ensure_loaded()
+        with self._lock:
+            return self._expand(wanted)
+
+    # ranks the posts by the share of their ingredients covered by the wanted ones, then by the number of
+    # covered ingredients and newest first; returns [(post_id, coverage, covered, total)] and the number of posts
+    def rank(self, wanted, limit=20, offset=0):
+        self._ensure_loaded()
+        with self._lock:
+            wanted_ids = self._expand(wanted)
+            postings, sizes, overlay = self._postings, self._sizes, dict(self._overlay)
+        arrays = [postings[ingredient_id] for ingredient_id in wanted_ids if ingredient_id in postings]
+        if arrays:
+            post_ids, covered = np.unique(np.concatenate(arrays), return_counts=True)
+        else:
+            post_ids, covered = np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int64)
+        totals = sizes[post_ids] if len(post_ids) else np.zeros(0, dtype=np.int32)
+        if overlay:
+            keep = ~np.isin(post_ids, np.fromiter(overlay, dtype=np.int64, count=len(overlay)))
+            post_ids, covered, totals = post_ids[keep], covered[keep], totals[keep]
+            changed = [(post_id, len(ids & wanted_ids), len(ids)) for post_id, (_, ids) in overlay.items()
+                       if ids and ids & wanted_ids]
+            if changed:
+                extra = np.array(changed, dtype=np.int64)
+                post_ids = np.concatenate((post_ids, extra[:, 0]))
+                covered = np.concatenate((covered, extra[:, 1]))
+                totals = np.concatenate((totals, extra[:, 2]))
+        if not len(post_ids):
+            return [], 0
+        coverage = covered / totals
+        order = np.lexsort((-post_ids.astype(np.int64), -covered, -coverage))[offset:offset + limit]
+        return [(int(post_ids[i]), float(coverage[i]), int(covered[i]), int(totals[i])) for i in order], \
+            len(post_ids)
+
+
+# re-parses the ingredients of all posts into post_ingredients, chunk by chunk of ids; returns the number of posts
+def reindex_all(chunk_size=1000):
+    from . import db, ingredient_index
+    from .models import Post, Ingredient, post_ingredients
+    posts = Post.__table__
+    total = 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(db.select([posts.c.id, posts.c.ingredients]).where(posts.c.id > last_id)
+                                  .order_by(posts.c.id).limit(chunk_size)).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        parsed = [(post_id, [name[:64] for name in parse_ingredients(text)]) for post_id, text in rows]
+        connection = db.session.connection()
+        ids = {name: ingredient_id for ingredient_id, name in
+               Ingredient.ids_for(connection, sorted({name for _, names in parsed for name in names})).items()}
+        connection.execute(post_ingredients.delete().where(post_ingredients.c.post_id.in_([row[0] for row in rows])))
+        links = [{'post_id': post_id, 'ingredient_id': ids[name]} for post_id, names in parsed for name in names]
+        if links:
+            connection.execute(post_ingredients.insert(), links)
+        db.session.commit()
+        total += len(rows)
+    ingredient_index.clear()
+    return total
@@ -4,8 +4,12 @@ main = Blueprint('main', __name__)
 
 from . import routes
 from ..models import Permission
+from ..images import picture_srcset
 
 
 @main.app_context_processor
 def inject_permissions():
     return dict(Permission=Permission)
+
+
+main.add_app_template_global(picture_srcset)
@@ -1,8 +1,13 @@
-from flask_sqlalchemy import get_debug_queries
+from collections import namedtuple
+from functools import partial
+from flask_sqlalchemy import get_debug_queries, Pagination
 from flask import request, render_template, redirect, url_for, make_response, current_app, abort
 from flask_login import login_required, current_user
 from . import main
+from .. import home_cache
 from ..models import Post
+from ..search import search_posts
+from ..exceptions import ValidationError
 
 # @main.before_app_request
 # def sidebar_category():
@@ -35,27 +40,54 @@ def server_shutdown():
 
 
 
+# the post fields shown by the cached home page sections
+PostCard = namedtuple('PostCard', 'id title description post_image post_image_widths date_posted')
+
+
+def post_cards(query):
+    return [PostCard._make(row) for row in
+            query.with_entities(Post.id, Post.title, Post.description, Post.post_image, Post.post_image_widths,
+                                        Post.date_posted)]
+
+
+def carousel_section():
+    return post_cards(Post.query.order_by(Post.date_posted.desc(), Post.id.desc()).limit(3))
+
+
+def latest_section(page):
+    per_page = current_app.config['LATEST_PER_PAGE']
+    items = post_cards(Post.query.order_by(Post.date_posted.desc(), Post.id.desc())
+                       .offset((page - 1) * per_page).limit(per_page))
+    return Pagination(None, page, per_page, Post.query.count(), items)
+
+
+def pie_section():
+    return post_cards(Post.query.filter_by(type_category='pie').order_by(Post.date_posted.desc()).limit(12))
+
+
 @main.route('/')
 @main.route('/home')
 def home(latest_page=1):
-    # selects 3 latest posts from database for display in carousel
-    carousel_posts = Post.query.order_by(Post.date_posted.desc())[:3]
-    # latest posts section
-    latest_page = request.args.get('latest_page', 1, type=int)
-    latest_pagination = Post.query.order_by(Post.date_posted.desc()).paginate(latest_page, current_app.config['LATEST_PER_PAGE'], False)
-    # pies posts section
-    pie_posts = Post.query.filter_by(type_category='pie').order_by(Post.date_posted.desc())[:12]
+    # sections seen by every visitor come from the home page cache:
+    # 3 latest posts for the carousel, the latest posts and the pies posts
+    carousel_posts = home_cache.get('carousel', carousel_section)
+    latest_page = max(request.args.get('latest_page', 1, type=int), 1)
+    if latest_page <= current_app.config['MYRECBLOG_HOME_CACHED_PAGES']:
+        latest_pagination = home_cache.get(('latest', latest_page), partial(latest_section, latest_page))
+    else:
+        latest_pagination = latest_section(latest_page)
+    pie_posts = home_cache.get('pie', pie_section)
     # followed posts section
     show_followed = False
     if current_user.is_authenticated:
         show_followed = bool(request.cookies.get('show_followed', ''))
+        followed_page = request.args.get('page', 1, type=int )
+        # the followed posts are read from the timeline of the user
         if not show_followed:
-            followed_posts = current_user.followed_posts
+            followed_posts_page = current_user.timeline_page(followed_page, 4)
         if show_followed:
-             followed_posts = Post.query
-        followed_page = request.args.get('page', 1, type=int )
-        followed_posts_page = followed_posts.order_by(Post.date_posted.desc()).paginate(
-            followed_page, per_page=4, error_out=False)
+            followed_posts_page = Post.query.order_by(Post.date_posted.desc()).paginate(
+                followed_page, per_page=4, error_out=False)
     else:
         followed_posts_page = []
     # category_sidebar = sidebar_category()
@@ -79,6 +111,19 @@ def show_followed():
     return resp
 
 
+@main.route('/search')
+def search():
+    query = request.args.get('q', '')
+    results, next_cursor = [], None
+    if query.strip():
+        try:
+            results, next_cursor = search_posts(query, request.args.get('cursor'),
+                                                current_app.config['MYRECBLOG_POSTS_PER_PAGE'])
+        except ValidationError:
+            abort(400)
+    return render_template('search.html', title='Search', query=query, results=results, next_cursor=next_cursor)
+
+
 @main.route('/about')
 def about():
     return render_template("about.html", title='About')
@@ -1,21 +1,46 @@
 from datetime import datetime
+from sqlalchemy.orm import Session, object_session, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
 from flask import current_app, url_for, abort
 from flask_login import UserMixin, AnonymousUserMixin, current_user
 from flask_bcrypt import generate_password_hash, check_password_hash
-from markdown import markdown
-import bleach
-from . import db, login_manager
+from . import db, login_manager, md_renderer, ingredient_index, home_cache, last_seen_buffer, token_blocklist, \
+    identity_cache, follow_graph
+from .images import is_content_addressed
+from .ingredients import parse_ingredients
+from .quantities import parse_minutes, parse_count
 from recblog.exceptions import ValidationError
 from flask_admin.contrib.sqla import ModelView
+from flask_sqlalchemy import Pagination
+
+
+# callbacks run once the transaction of the session is committed, dropped when it is rolled back;
+# in-process indexes and caches use them so they never see uncommitted data
+def call_after_commit(session, callback):
+    session.info.setdefault('after_commit', []).append(callback)
+
+
+def run_after_commit(session):
+    for callback in session.info.pop('after_commit', []):
+        callback()
+
+
+def drop_after_commit(session):
+    session.info.pop('after_commit', None)
+
+
+db.event.listen(Session, 'after_commit', run_after_commit)
+db.event.listen(Session, 'after_rollback', drop_after_commit)
 
 
 class PaginatedAPIMixin(object):
     @staticmethod
     def to_collection_dict(query, page, per_page, endpoint, **kwargs):
         resources = query.paginate(page, per_page, False)
+        counts = User.load_counts([item.id for item in resources.items])
         data = {
-            'items': [item.convert_user_json() for item in resources.items],
+            'items': [item.convert_user_json(counts=counts[item.id]) for item in resources.items],
             '_meta': {
                 'page': page,
                 'per_page': per_page,
@@ -41,14 +66,38 @@ class BlacklistToken(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     token = db.Column(db.String(500), unique=True, nullable=False)
     blacklisted_on = db.Column(db.DateTime, nullable=False)
+    # UTC expiry of the token, the row is useless after it; NULL for tokens revoked before it was stored
+    expires_at = db.Column(db.DateTime, index=True)
 
-    def __init__(self, token):
+    def __init__(self, token, expires_at=None):
         self.token = token
         self.blacklisted_on = datetime.now()
+        self.expires_at = expires_at
 
     def __repr__(self):
         return '<id: token: {}'.format(self.token)
 
+    # the revocation reaches the in-process blocklist once it is committed
+    @staticmethod
+    def on_inserted_token(mapper, connection, target):
+        jti, expires_at = target.token, target.expires_at
+        call_after_commit(object_session(target), lambda: token_blocklist.add(jti, expires_at))
+
+    # deletes the rows of expired tokens; rows without an expiry are deleted once they are older than
+    # max_age, the longest lifetime of a token. Returns the number of deleted rows.
+    @staticmethod
+    def prune(max_age=None):
+        tokens = BlacklistToken.__table__
+        expired = tokens.c.expires_at < datetime.utcnow()
+        if max_age is not None:
+            # blacklisted_on is in local time
+            expired = db.or_(expired, db.and_(tokens.c.expires_at.is_(None),
+                                              tokens.c.blacklisted_on < datetime.now() - max_age))
+        deleted = db.session.execute(tokens.delete().where(expired)).rowcount
+        db.session.commit()
+        token_blocklist.reload()
+        return deleted
+
 
 class Permission:
     FOLLOW = 1
@@ -110,9 +159,16 @@ class Role(db.Model):
     def __repr__(self):
         return f"""Role {self.name}"""
 
+    # any committed change of the roles table is seen by the next permission check
+    @staticmethod
+    def on_changed_role(mapper, connection, target):
+        call_after_commit(object_session(target), identity_cache.reload_roles)
+
 
 class Follow(db.Model):
     __tablename__ = 'follows'
+    # the primary key serves lookups by follower_id, this index serves followers of a user
+    __table_args__ = (db.Index('ix_follows_followed_id_follower_id', 'followed_id', 'follower_id'),)
     follower_id = db.Column(db.Integer, db.ForeignKey('users.id'),
                             primary_key=True)
     followed_id = db.Column(db.Integer, db.ForeignKey('users.id'),
@@ -135,13 +191,101 @@ class Follow(db.Model):
         }
         return json_user
 
+    # the follow graph of the suggestions sees committed follows at once
+    @staticmethod
+    def on_inserted_follow(mapper, connection, target):
+        follower_id, followed_id = target.follower_id, target.followed_id
+        call_after_commit(object_session(target), lambda: follow_graph.apply(follower_id, followed_id, True))
+
+    @staticmethod
+    def on_deleted_follow(mapper, connection, target):
+        follower_id, followed_id = target.follower_id, target.followed_id
+        call_after_commit(object_session(target), lambda: follow_graph.apply(follower_id, followed_id, False))
+
+
+
+# followed posts of every user, written when a followed author publishes so reading them is a range scan of
+# ix_timeline_user_id_date_posted_post_id. Authors with MYRECBLOG_TIMELINE_FANOUT_LIMIT followers or more are
+# not fanned out, their posts are merged in when the timeline is read (users.timeline_pull).
+class TimelineEntry(db.Model):
+    __tablename__ = 'timeline'
+    __table_args__ = (db.Index('ix_timeline_user_id_date_posted_post_id', 'user_id', 'date_posted', 'post_id'),
+                      db.Index('ix_timeline_post_id', 'post_id'),
+                      db.Index('ix_timeline_author_id', 'author_id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), primary_key=True)
+    author_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    date_posted = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f"""TimelineEntry({self.user_id}, {self.post_id})"""
+
+    @staticmethod
+    def _insert(connection, select):
+        entries = TimelineEntry.__table__
+        connection.execute(entries.insert().from_select(['user_id', 'post_id', 'author_id', 'date_posted'], select))
+
+    # one INSERT ... SELECT over the followers of the author
+    @staticmethod
+    def fan_out(connection, post):
+        follows, users = Follow.__table__, User.__table__
+        TimelineEntry._insert(connection, db.select([follows.c.follower_id, db.literal(post.id),
+                                                     db.literal(post.user_id), db.literal(post.date_posted)])
+                              .select_from(follows.join(users, users.c.id == follows.c.followed_id))
+                              .where(follows.c.followed_id == post.user_id)
+                              .where(db.func.coalesce(users.c.timeline_pull, False) == False))
+
+    # a new follower gets the earlier posts of the author, unless the author has become too popular to fan out:
+    # the author is then pulled at read time and its entries are dropped from all timelines
+    @staticmethod
+    def on_inserted_follow(mapper, connection, target):
+        users, follows, entries = User.__table__, Follow.__table__, TimelineEntry.__table__
+        pulled = connection.execute(db.select([users.c.timeline_pull]).where(users.c.id == target.followed_id))\
+            .scalar()
+        if pulled:
+            return
+        limit = current_app.config['MYRECBLOG_TIMELINE_FANOUT_LIMIT']
+        followers = connection.execute(db.select([db.func.count()]).select_from(
+            db.select([follows.c.follower_id]).where(follows.c.followed_id == target.followed_id).limit(limit)
+            .subquery())).scalar()
+        if followers >= limit:
+            connection.execute(users.update().where(users.c.id == target.followed_id).values(timeline_pull=True))
+            connection.execute(entries.delete().where(entries.c.author_id == target.followed_id))
+            return
+        posts = Post.__table__
+        TimelineEntry._insert(connection, db.select([db.literal(target.follower_id), posts.c.id, posts.c.user_id,
+                                                     posts.c.date_posted]).where(posts.c.user_id == target.followed_id))
+
+    @staticmethod
+    def on_deleted_follow(mapper, connection, target):
+        entries = TimelineEntry.__table__
+        connection.execute(entries.delete().where(entries.c.user_id == target.follower_id)
+                           .where(entries.c.author_id == target.followed_id))
+
+    # fills all the timelines again from follows and posts, authors reaching the fan-out limit are pulled
+    @staticmethod
+    def rebuild():
+        limit = current_app.config['MYRECBLOG_TIMELINE_FANOUT_LIMIT']
+        entries, follows, posts, users = TimelineEntry.__table__, Follow.__table__, Post.__table__, User.__table__
+        popular = db.select([follows.c.followed_id]).group_by(follows.c.followed_id)\
+            .having(db.func.count() >= limit)
+        db.session.execute(entries.delete())
+        db.session.execute(users.update().values(timeline_pull=users.c.id.in_(popular)))
+        db.session.execute(entries.insert().from_select(
+            ['user_id', 'post_id', 'author_id', 'date_posted'],
+            db.select([follows.c.follower_id, posts.c.id, posts.c.user_id, posts.c.date_posted])
+            .select_from(follows.join(posts, posts.c.user_id == follows.c.followed_id)
+                         .join(users, users.c.id == follows.c.followed_id))
+            .where(db.func.coalesce(users.c.timeline_pull, False) == False)))
+        db.session.commit()
+        return db.session.query(db.func.count()).select_from(entries).scalar()
 
 class User(PaginatedAPIMixin, db.Model, UserMixin):
     __tablename__ = 'users'
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(20), unique=True, nullable=False, index=True)
     email = db.Column(db.String(120), unique=True, nullable=False)
-    image_file = db.Column(db.String(20), nullable=False, default='default.jpg')
+    image_file = db.Column(db.String(100), nullable=False, default='default.jpg')
     password = db.Column(db.String(60), nullable=False)
     posts = db.relationship('Post', backref='author', lazy='dynamic')
     confirmed = db.Column(db.Boolean, default=False)
@@ -149,6 +293,8 @@ class User(PaginatedAPIMixin, db.Model, UserMixin):
     location = db.Column(db.String())
     about_me = db.Column(db.Text)
     last_seen = db.Column(db.DateTime(), default=datetime.utcnow)
+    # the posts of the author are merged into the timelines of its followers when they are read
+    timeline_pull = db.Column(db.Boolean, default=False, index=True)
 
     # for the cascade behavior 'delete-orphan' was chosen as fo association table correct way to delete the entries
     # that point to a record that was deleted
@@ -163,13 +309,14 @@ class User(PaginatedAPIMixin, db.Model, UserMixin):
 
     favored_posts = db.relationship('FavoritePosts', backref='liker', lazy='dynamic')
 
+    # the role is looked up in the cached roles table
     def __init__(self, **kwargs):
         super(User, self).__init__(**kwargs)
-        if self.role is None:
+        if self.role is None and self.role_id is None:
             if self.email == current_app.config['MYRECBLOG_ADMIN']:
-                self.role = Role.query.filter_by(name='Administrator').first()
-            if self.role is None:
-                self.role = Role.query.filter_by(default=True).first()
+                self.role_id = identity_cache.role_id('Administrator')
+            if self.role_id is None:
+                self.role_id = identity_cache.role_id()
 
     def __repr__(self):
         return f"""User('{self.username}', '{self.email}', '{self.image_file}')"""
@@ -221,16 +368,41 @@ class User(PaginatedAPIMixin, db.Model, UserMixin):
         db.session.add(self)
         return True
 
+    # permissions come from the cached roles table, unless the role itself was set or loaded
     def can(self, perm):
+        if 'role' in db.inspect(self).unloaded:
+            permissions = identity_cache.role_permissions(self.role_id)
+            return permissions is not None and permissions & perm == perm
         return self.role is not None and self.role.has_permission(perm)
 
     def is_administrator(self):
         return self.can(Permission.ADMIN)
 
+    # the new time is seen at once without making the session dirty, the write is left to last_seen_buffer
     def ping(self):
-        self.last_seen = datetime.utcnow()
-        db.session.add(self)
-        db.session.commit()
+        seen = datetime.utcnow()
+        stored = self.last_seen
+        set_committed_value(self, 'last_seen', seen)
+        identity_cache.update_user(self.id, last_seen=seen)
+        last_seen_buffer.touch(self.id, seen, stored)
+
+    def snapshot(self):
+        return {attr.key: getattr(self, attr.key) for attr in User.__mapper__.column_attrs}
+
+    # a persistent user built from the values of snapshot() without a query, relationships load as usual
+    @staticmethod
+    def from_snapshot(values):
+        user = User.__mapper__.class_manager.new_instance()
+        for key, value in values.items():
+            set_committed_value(user, key, value)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+    # the cached snapshot is dropped once a change of the user is committed
+    @staticmethod
+    def on_changed_user(mapper, connection, target):
+        user_id = target.id
+        call_after_commit(object_session(target), lambda: identity_cache.forget_user(user_id))
 
     @staticmethod
     def verify_reset_token(token):
@@ -274,7 +446,60 @@ class User(PaginatedAPIMixin, db.Model, UserMixin):
     def followed_posts(self):
         return Post.query.join(Follow, Follow.followed_id == Post.user_id).filter(Follow.follower_id == self.id)
 
-    def convert_user_json(self, include_email=False):
+    # (date_posted, post_id) keys of the followed posts, newest first unless ascending; bound is the key the page
+    # starts after. Entries of the timeline and posts of followed authors pulled at read time are merged.
+    def timeline_keys(self, limit, offset=0, bound=None, ascending=False):
+        entries = TimelineEntry.__table__
+        own = db.select([entries.c.date_posted, entries.c.post_id]).where(entries.c.user_id == self.id)
+        pulled = db.select([Post.date_posted, Post.id])\
+            .select_from(Post.__table__.join(Follow.__table__, Follow.followed_id == Post.user_id)
+                         .join(User.__table__, User.id == Post.user_id))\
+            .where(Follow.follower_id == self.id).where(User.timeline_pull == True)
+        keys = set()
+        for select, date_column, id_column in ((own, entries.c.date_posted, entries.c.post_id),
+                                               (pulled, Post.date_posted, Post.id)):
+            if bound is not None:
+                key = db.tuple_(date_column, id_column)
+                select = select.where(key > db.tuple_(*bound) if ascending else key < db.tuple_(*bound))
+            order = (date_column.asc(), id_column.asc()) if ascending else (date_column.desc(), id_column.desc())
+            keys.update(tuple(row) for row in db.session.execute(select.order_by(*order).limit(offset + limit)))
+        return sorted(keys, reverse=not ascending)[offset:offset + limit]
+
+    def timeline(self, limit, offset=0, bound=None, ascending=False):
+        keys = self.timeline_keys(limit, offset, bound, ascending)
+        posts = {post.id: post for post in Post.query.filter(Post.id.in_([post_id for _, post_id in keys]))}
+        return [posts[post_id] for _, post_id in keys if post_id in posts]
+
+    def timeline_count(self):
+        pulled = db.session.query(db.func.count(Post.id)).join(Follow, Follow.followed_id == Post.user_id)\
+            .join(User, User.id == Post.user_id).filter(Follow.follower_id == self.id, User.timeline_pull == True)
+        return TimelineEntry.query.filter_by(user_id=self.id).count() + pulled.scalar()
+
+    def timeline_page(self, page, per_page):
+        page = max(page, 1)
+        return Pagination(None, page, per_page, self.timeline_count(),
+                          self.timeline(per_page, offset=(page - 1) * per_page))
+
+    # returns followers, followed, posts, comments and favorite posts numbers of every given user
+    # with one grouped query per relation, so the number of queries does not depend on the number of users
+    @staticmethod
+    def load_counts(user_ids):
+        relations = [('followers_number', Follow.followed_id), ('followed_number', Follow.follower_id),
+                     ('post_count', Post.user_id), ('comments_total', Comment.author_id),
+                     ('favorite_posts_total', FavoritePosts.liker_id)]
+        counts = {user_id: {key: 0 for key, _ in relations} for user_id in user_ids}
+        if not user_ids:
+            return counts
+        for key, column in relations:
+            for user_id, number in db.session.query(column, db.func.count()).filter(column.in_(user_ids))\
+                    .group_by(column):
+                counts[user_id][key] = number
+        return counts
+
+    # counts can be precomputed by User.load_counts for a whole page of users
+    def convert_user_json(self, include_email=False, counts=None):
+        if counts is None:
+            counts = User.load_counts([self.id])[self.id]
         json_user = {
             'url': url_for('api.get_user', user_id=self.id),
             'username': self.username,
@@ -285,11 +510,11 @@ class User(PaginatedAPIMixin, db.Model, UserMixin):
             'about_me': self.about_me,
             'last_seen': self.last_seen,
             'followed_posts_url': url_for('api.get_followed_posts', id=self.id),
-            'followers_number': self.followers.count(),
-            'followed_number': self.followed.count(),
-            'post_count': self.posts.count(),
-            'comments_total': self.comments.count(),
-            'favorite_posts_total': self.favored_posts.count()
+            'followers_number': counts['followers_number'],
+            'followed_number': counts['followed_number'],
+            'post_count': counts['post_count'],
+            'comments_total': counts['comments_total'],
+            'favorite_posts_total': counts['favorite_posts_total']
         }
         if include_email:
             json_user['email'] = self.email
@@ -361,20 +586,40 @@ class AnonymousUser(AnonymousUserMixin):
 login_manager.anonymous_user = AnonymousUser
 
 
+# the user of the session is built from its cached snapshot while there is a fresh one
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    user_id = int(user_id)
+    values = identity_cache.get_user(user_id)
+    if values is not None:
+        return User.from_snapshot(values)
+    user = User.query.get(user_id)
+    if user is not None:
+        identity_cache.store_user(user_id, user.snapshot())
+    return user
 
 # Model for Posts Recipes
 class Post(db.Model, UserMixin):
     __tablename__ = 'posts'
+    # indexes for the newest first listings: all posts (with id as the keyset tie-breaker),
+    # by category and by author
+    __table_args__ = (db.Index('ix_posts_date_posted_id', 'date_posted', 'id'),
+                      db.Index('ix_posts_type_category_date_posted', 'type_category', 'date_posted'),
+                      db.Index('ix_posts_user_id_date_posted', 'user_id', 'date_posted'),
+                      db.Index('ix_posts_total_minutes_id', 'total_minutes', 'id'),
+                      db.Index('ix_posts_cook_minutes', 'cook_minutes'),
+                      db.Index('ix_posts_portions_count', 'portions_count'))
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text(500))
     post_image = db.Column(db.String(200), nullable=False, default='default.jpg')
+    # widths of the WebP and JPEG derivatives of post_image, e.g. '320,640'; empty until they are written
+    post_image_widths = db.Column(db.String(64))
 
     # additional parameters of the post-recipe, right-side part of the post page
     date_posted = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # set again by every update of the row, the counters included; versions the API responses
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     portions = db.Column(db.String(20), nullable=False)
     recipe_yield = db.Column(db.String(40))
 
@@ -397,23 +642,147 @@ class Post(db.Model, UserMixin):
     # rating
     favored = db.relationship('FavoritePosts', backref='post_favorite', lazy='dynamic')
 
+    # denormalized counters, kept up to date by Comment and FavoritePosts insert/delete events
+    comments_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    favored_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    # durations in minutes and the number of portions parsed from the free form strings above by their set events,
+    # NULL where nothing could be parsed; total_minutes is the ready time or else the preparation plus cooking time
+    cook_minutes = db.Column(db.Integer)
+    prep_minutes = db.Column(db.Integer)
+    ready_minutes = db.Column(db.Integer)
+    total_minutes = db.Column(db.Integer)
+    portions_count = db.Column(db.Integer)
+
     def __repr__(self):
         return f"""User('{self.title}', '{self.date_posted}')"""
 
 
+    # the HTML is rendered only when the markdown source has really changed
     @staticmethod
     def on_changed_ingredients(target, new_value, old_value, initiator):
-        allowed_tags = ['a', 'abbr', 'acronym', 'b', 'blockquote', 'code', 'em', 'i', 'li', 'ol', 'pre', 'strong',
-                        'ul', 'h1', 'h2', 'h3', 'p']
-        target.ingredients_html = bleach.linkify(bleach.clean(markdown(new_value, output_format='html'),
-                                                             tags=allowed_tags, strip=True))
+        if new_value == old_value and target.ingredients_html:
+            return
+        target.ingredients_html = md_renderer.render(new_value, 'post')
 
     @staticmethod
     def on_changed_preparation(target, new_value, old_value, initiator):
-        allowed_tags = ['a', 'abbr', 'acronym', 'b', 'blockquote', 'code', 'em', 'i', 'li', 'ol', 'pre', 'strong',
-                        'ul', 'h1', 'h2', 'h3', 'p']
-        target.preparation_html = bleach.linkify(bleach.clean(markdown(new_value, output_format='html'),
-                                                              tags=allowed_tags, strip=True))
+        if new_value == old_value and target.preparation_html:
+            return
+        target.preparation_html = md_renderer.render(new_value, 'post')
+
+    @staticmethod
+    def total_time(cook_minutes, prep_minutes, ready_minutes):
+        if ready_minutes is not None:
+            return ready_minutes
+        if cook_minutes is None and prep_minutes is None:
+            return None
+        return (cook_minutes or 0) + (prep_minutes or 0)
+
+    @staticmethod
+    def on_changed_duration(column):
+        def on_changed(target, new_value, old_value, initiator):
+            setattr(target, column, parse_minutes(new_value))
+            target.total_minutes = Post.total_time(target.cook_minutes, target.prep_minutes, target.ready_minutes)
+        return on_changed
+
+    @staticmethod
+    def on_changed_portions(target, new_value, old_value, initiator):
+        target.portions_count = parse_count(new_value)
+
+    # another picture has no derivatives until it is processed or backfilled
+    @staticmethod
+    def on_changed_image(target, new_value, old_value, initiator):
+        if new_value != old_value:
+            target.post_image_widths = None
+
+    # parses the durations and portions of existing posts chunk by chunk of ids; returns the number of posts
+    @staticmethod
+    def backfill_quantities(chunk_size=1000):
+        posts = Post.__table__
+        total = 0
+        last_id = 0
+        while True:
+            rows = db.session.execute(
+                db.select([posts.c.id, posts.c.cook_time, posts.c.prep_time, posts.c.ready, posts.c.portions])
+                .where(posts.c.id > last_id).order_by(posts.c.id).limit(chunk_size)).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            values = []
+            for post_id, cook_time, prep_time, ready_time, portions in rows:
+                cook, prep, ready = parse_minutes(cook_time), parse_minutes(prep_time), parse_minutes(ready_time)
+                values.append({'post_id': post_id, 'cook': cook, 'prep': prep, 'ready_in': ready,
+                               'total': Post.total_time(cook, prep, ready), 'count': parse_count(portions)})
+            db.session.execute(posts.update().where(posts.c.id == db.bindparam('post_id'))
+                               .values(cook_minutes=db.bindparam('cook'), prep_minutes=db.bindparam('prep'),
+                                       ready_minutes=db.bindparam('ready_in'), total_minutes=db.bindparam('total'),
+                                       portions_count=db.bindparam('count')), values)
+            db.session.commit()
+            total += len(rows)
+        return total
+
+    # keeps post_ingredients and the in-memory ingredient index in step with the ingredients text;
+    # the cached home page sections are rebuilt once a post change is committed
+    @staticmethod
+    def on_inserted_post(mapper, connection, target):
+        Ingredient.store_post_ingredients(connection, target)
+        TimelineEntry.fan_out(connection, target)
+        call_after_commit(object_session(target), home_cache.invalidate)
+
+    @staticmethod
+    def on_updated_post(mapper, connection, target):
+        if db.inspect(target).attrs.ingredients.history.has_changes():
+            Ingredient.store_post_ingredients(connection, target)
+        if db.inspect(target).attrs.date_posted.history.has_changes():
+            entries = TimelineEntry.__table__
+            connection.execute(entries.update().where(entries.c.post_id == target.id)
+                               .values(date_posted=target.date_posted))
+        call_after_commit(object_session(target), home_cache.invalidate)
+
+    @staticmethod
+    def on_deleting_post(mapper, connection, target):
+        connection.execute(post_ingredients.delete().where(post_ingredients.c.post_id == target.id))
+        connection.execute(TimelineEntry.__table__.delete().where(TimelineEntry.__table__.c.post_id == target.id))
+        similar = PostSimilar.__table__
+        connection.execute(similar.delete().where(db.or_(similar.c.post_id == target.id,
+                                                         similar.c.similar_post_id == target.id)))
+        post_id = target.id
+        call_after_commit(object_session(target), lambda: ingredient_index.apply(post_id, None))
+        call_after_commit(object_session(target), home_cache.invalidate)
+
+    @staticmethod
+    def change_counter(connection, post_id, counter, delta):
+        posts = Post.__table__
+        connection.execute(posts.update().where(posts.c.id == post_id).values({counter: posts.c[counter] + delta}))
+
+    # compares the stored counters with the real number of comments and likes, chunk by chunk of posts ids,
+    # and returns the drifted rows as (post_id, comments_count, comments, favored_count, favored) tuples
+    @staticmethod
+    def reconcile_counters(fix=False, chunk_size=1000):
+        posts = Post.__table__
+        comments = db.select([db.func.count(Comment.id)]).where(Comment.post_id == posts.c.id).scalar_subquery()
+        favored = db.select([db.func.count(FavoritePosts.id)]).where(FavoritePosts.post_id == posts.c.id)\
+            .scalar_subquery()
+        drifted = []
+        last_id = 0
+        while True:
+            rows = db.session.execute(
+                db.select([posts.c.id, posts.c.comments_count, comments, posts.c.favored_count, favored])
+                .where(posts.c.id > last_id).order_by(posts.c.id).limit(chunk_size)).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            chunk_drifted = [tuple(row) for row in rows if row[1] != row[2] or row[3] != row[4]]
+            if fix and chunk_drifted:
+                db.session.execute(posts.update().where(posts.c.id == db.bindparam('post_id'))
+                                   .values(comments_count=db.bindparam('comments'),
+                                           favored_count=db.bindparam('favored')),
+                                   [{'post_id': row[0], 'comments': row[2], 'favored': row[4]}
+                                    for row in chunk_drifted])
+                db.session.commit()
+            drifted.extend(chunk_drifted)
+        return drifted
 
     def delete_post_from_favorites(self, user_id):
         favorite = self.favored.filter_by(liker_id=user_id).first()
@@ -442,6 +811,9 @@ class Post(db.Model, UserMixin):
             'cookTime': self.cook_time,
             'prepTime': self.prep_time,
             'ready': self.ready,
+            'cookMinutes': self.cook_minutes,
+            'prepMinutes': self.prep_minutes,
+            'totalMinutes': self.total_minutes,
             'recipeCategory': self.type_category,
             'main_ingredient': self.main_ingredient,
             'recipeIngredient': self.ingredients,
@@ -450,8 +822,8 @@ class Post(db.Model, UserMixin):
             'recipeInstructions_html': self.preparation_html,
             'user_url': url_for('api.get_user', user_id=self.user_id),
             'comments_url': url_for('api.get_post', post_id=self.id),
-            'comments_count': self.comments.count(),
-            'favored': self.favored.count()
+            'comments_count': self.comments_count,
+            'favored': self.favored_count
         }
         return json_post
 
@@ -491,11 +863,90 @@ class Post(db.Model, UserMixin):
 
 db.event.listen(Post.ingredients, 'set', Post.on_changed_ingredients)
 db.event.listen(Post.preparation, 'set', Post.on_changed_preparation)
+db.event.listen(Post.cook_time, 'set', Post.on_changed_duration('cook_minutes'))
+db.event.listen(Post.prep_time, 'set', Post.on_changed_duration('prep_minutes'))
+db.event.listen(Post.ready, 'set', Post.on_changed_duration('ready_minutes'))
+db.event.listen(Post.portions, 'set', Post.on_changed_portions)
+db.event.listen(Post.post_image, 'set', Post.on_changed_image)
+
+# normalized ingredient names, every post is linked to the ingredients parsed from its ingredients text
+class Ingredient(db.Model):
+    __tablename__ = 'ingredients'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(64), unique=True, nullable=False)
+
+    def __repr__(self):
+        return f"""Ingredient('{self.name}')"""
+
+    # get or create the ingredients of names, returns {id: name}
+    @staticmethod
+    def ids_for(connection, names):
+        ingredients = Ingredient.__table__
+        if not names:
+            return {}
+        found = dict(connection.execute(db.select([ingredients.c.name, ingredients.c.id])
+                                        .where(ingredients.c.name.in_(names))).fetchall())
+        missing = [name for name in names if name not in found]
+        if missing:
+            connection.execute(ingredients.insert(), [{'name': name} for name in missing])
+            found.update(connection.execute(db.select([ingredients.c.name, ingredients.c.id])
+                                            .where(ingredients.c.name.in_(missing))).fetchall())
+        return {ingredient_id: name for name, ingredient_id in found.items()}
+
+    @staticmethod
+    def store_post_ingredients(connection, post):
+        names = Ingredient.ids_for(connection, [name[:64] for name in parse_ingredients(post.ingredients)])
+        connection.execute(post_ingredients.delete().where(post_ingredients.c.post_id == post.id))
+        if names:
+            connection.execute(post_ingredients.insert(),
+                               [{'post_id': post.id, 'ingredient_id': ingredient_id} for ingredient_id in names])
+        post_id = post.id
+        call_after_commit(object_session(post), lambda: ingredient_index.apply(post_id, names, names))
+
+
+post_ingredients = db.Table('post_ingredients',
+                            db.Column('post_id', db.Integer, db.ForeignKey('posts.id'), primary_key=True),
+                            db.Column('ingredient_id', db.Integer, db.ForeignKey('ingredients.id'),
+                                      primary_key=True),
+                            db.Index('ix_post_ingredients_ingredient_id_post_id', 'ingredient_id', 'post_id'))
+
+db.event.listen(Post, 'after_insert', Post.on_inserted_post)
+db.event.listen(Post, 'after_update', Post.on_updated_post)
+db.event.listen(Post, 'before_delete', Post.on_deleting_post)
+
+
+# full-text index of the posts: an FTS5 table reading its content from posts, kept in sync by triggers
+# and ranking the title matches above description, ingredients and preparation ones
+POSTS_FTS_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5(title, description, ingredients, preparation, "
+    "content='posts', content_rowid='id', tokenize='porter unicode61 remove_diacritics 2')",
+    "INSERT INTO posts_fts(posts_fts, rank) VALUES('rank', 'bm25(10.0, 5.0, 2.0, 1.0)')",
+    "CREATE TRIGGER IF NOT EXISTS posts_fts_after_insert AFTER INSERT ON posts BEGIN "
+    "INSERT INTO posts_fts(rowid, title, description, ingredients, preparation) "
+    "VALUES (new.id, new.title, new.description, new.ingredients, new.preparation); END",
+    "CREATE TRIGGER IF NOT EXISTS posts_fts_after_delete AFTER DELETE ON posts BEGIN "
+    "INSERT INTO posts_fts(posts_fts, rowid, title, description, ingredients, preparation) "
+    "VALUES ('delete', old.id, old.title, old.description, old.ingredients, old.preparation); END",
+    "CREATE TRIGGER IF NOT EXISTS posts_fts_after_update AFTER UPDATE OF title, description, ingredients, "
+    "preparation ON posts BEGIN "
+    "INSERT INTO posts_fts(posts_fts, rowid, title, description, ingredients, preparation) "
+    "VALUES ('delete', old.id, old.title, old.description, old.ingredients, old.preparation); "
+    "INSERT INTO posts_fts(rowid, title, description, ingredients, preparation) "
+    "VALUES (new.id, new.title, new.description, new.ingredients, new.preparation); END",
+]
+
+for statement in POSTS_FTS_DDL:
+    db.event.listen(Post.__table__, 'after_create', db.DDL(statement).execute_if(dialect='sqlite'))
+db.event.listen(Post.__table__, 'before_drop', db.DDL('DROP TABLE IF EXISTS posts_fts').execute_if(dialect='sqlite'))
 
 
 # Model for Rating the Post-recipe
 class FavoritePosts(db.Model):
     __tablename__ = 'favorites'
+    # a user can like a post only once
+    __table_args__ = (db.Index('uq_favorites_post_id_liker_id', 'post_id', 'liker_id', unique=True),
+                      db.Index('ix_favorites_liker_id', 'liker_id'),
+                      db.Index('ix_favorites_date_liked', 'date_liked'))
     id = db.Column(db.Integer, primary_key=True)
     post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), nullable=False)
     liker_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -511,6 +962,14 @@ class FavoritePosts(db.Model):
     def __repr__(self):
         return f"""FavoritePosts {self.post_id} liked by user {self.liker_id} with {self.like_post}"""
 
+    @staticmethod
+    def on_inserted_favorite(mapper, connection, target):
+        Post.change_counter(connection, target.post_id, 'favored_count', 1)
+
+    @staticmethod
+    def on_deleted_favorite(mapper, connection, target):
+        Post.change_counter(connection, target.post_id, 'favored_count', -1)
+
     def convert_favorites_json(self):
         json_favorites = {
             'parentItem': url_for('api.get_post', post_id=self.post_id),
@@ -521,22 +980,53 @@ class FavoritePosts(db.Model):
         return json_favorites
 
 
+
+# posts liked by the same people, computed offline by 'flask build-similar-posts'; the top scored rows of a post
+# are read with its primary key prefix
+class PostSimilar(db.Model):
+    __tablename__ = 'post_similar'
+    __table_args__ = (db.Index('ix_post_similar_similar_post_id', 'similar_post_id'),)
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), primary_key=True)
+    similar_post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), primary_key=True)
+    # cosine similarity of the likers of both posts
+    score = db.Column(db.Float, nullable=False)
+
+    def __repr__(self):
+        return f"""PostSimilar({self.post_id}, {self.similar_post_id}, {self.score:.3f})"""
+
+    # [(post, score)] liked by the people who liked post_id, best first
+    @staticmethod
+    def similar_posts(post_id, limit=4):
+        return Post.query.join(PostSimilar, PostSimilar.similar_post_id == Post.id).add_columns(PostSimilar.score)\
+            .filter(PostSimilar.post_id == post_id).order_by(PostSimilar.score.desc(), Post.id).limit(limit).all()
+
+
 class Comment(db.Model):
     __tablename__ = 'comments'
+    __table_args__ = (db.Index('ix_comments_post_id_comment_date', 'post_id', 'comment_date'),
+                      db.Index('ix_comments_author_id', 'author_id'))
     id = db.Column(db.Integer, primary_key=True)
     body = db.Column(db.Text)
     body_html = db.Column(db.Text)
     comment_date = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     disabled = db.Column(db.Boolean)
     author_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), nullable=False)
 
     @staticmethod
     def on_changed_comment(target, new_value, old_value, initiator):
-        allowed_tags = ['a', 'abbr', 'acronym', 'b', 'blockquote', 'code', 'em', 'i', 'strong',
-                        'p']
-        target.body_html = bleach.linkify(bleach.clean(markdown(new_value, output_format='html'), tags=allowed_tags,
-                                                       strip=True))
+        if new_value == old_value and target.body_html:
+            return
+        target.body_html = md_renderer.render(new_value, 'comment')
+
+    @staticmethod
+    def on_inserted_comment(mapper, connection, target):
+        Post.change_counter(connection, target.post_id, 'comments_count', 1)
+
+    @staticmethod
+    def on_deleted_comment(mapper, connection, target):
+        Post.change_counter(connection, target.post_id, 'comments_count', -1)
 
     def convert_comment_to_json(self):
         json_comment = {
@@ -556,4 +1046,99 @@ class Comment(db.Model):
         
 
 
+# reference counts of the content addressed pictures, files nobody references are removed by 'flask gc-images'
+class StoredImage(db.Model):
+    __tablename__ = 'images'
+    id = db.Column(db.Integer, primary_key=True)
+    # path below the uploads directory, e.g. recipes_pics/ab/cd/<sha256>.jpg
+    path = db.Column(db.String(120), unique=True, nullable=False)
+    refcount = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"""StoredImage('{self.path}', {self.refcount})"""
+
+    @staticmethod
+    def change_refcount(connection, path, delta):
+        images = StoredImage.__table__
+        now = datetime.utcnow()
+        result = connection.execute(images.update().where(images.c.path == path)
+                                    .values(refcount=images.c.refcount + delta, updated_at=now))
+        if result.rowcount == 0:
+            connection.execute(images.insert().values(path=path, refcount=max(delta, 0), updated_at=now))
+
+    @staticmethod
+    def change_references(connection, folder, old_filename, new_filename):
+        if old_filename == new_filename:
+            return
+        for filename, delta in ((old_filename, -1), (new_filename, 1)):
+            if filename and is_content_addressed(filename):
+                StoredImage.change_refcount(connection, folder + '/' + filename, delta)
+
+    # keeps the reference counts in step with a picture column of a model; a replaced value that was never
+    # loaded is not released, which only delays the garbage collection of that file
+    @staticmethod
+    def track(column, folder):
+        def on_inserted(mapper, connection, target):
+            StoredImage.change_references(connection, folder, None, getattr(target, column.key))
+
+        def on_updated(mapper, connection, target):
+            history = db.inspect(target).attrs[column.key].history
+            if history.added:
+                StoredImage.change_references(connection, folder, history.deleted[0] if history.deleted else None,
+                                              history.added[0])
+
+        # before the delete, the value can still be loaded
+        def on_deleting(mapper, connection, target):
+            StoredImage.change_references(connection, folder, getattr(target, column.key), None)
+
+        db.event.listen(column.class_, 'after_insert', on_inserted)
+        db.event.listen(column.class_, 'after_update', on_updated)
+        db.event.listen(column.class_, 'before_delete', on_deleting)
+
+
+
+# activity per day rolled up from the raw tables by 'flask rollup-stats': the number of likes, comments and new
+# posts of a day in total, per post category and per post author. Admin statistics read these rows only.
+class DailyStat(db.Model):
+    __tablename__ = 'daily_stats'
+    __table_args__ = (db.Index('ix_daily_stats_metric_dimension_day', 'metric', 'dimension', 'day'),)
+    day = db.Column(db.Date, primary_key=True)
+    # 'likes', 'comments' or 'posts'
+    metric = db.Column(db.String(16), primary_key=True)
+    # 'all', 'category' or 'author', the value is the category, the id of the author or 'all'
+    dimension = db.Column(db.String(16), primary_key=True)
+    value = db.Column(db.String(64), primary_key=True)
+    total = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"""DailyStat({self.day}, '{self.metric}', '{self.dimension}', '{self.value}', {self.total})"""
+
+
+# the last day processed by a periodic job, per job name
+class RollupWatermark(db.Model):
+    __tablename__ = 'rollup_watermarks'
+    name = db.Column(db.String(64), primary_key=True)
+    rolled_up_to = db.Column(db.Date, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f"""RollupWatermark('{self.name}', {self.rolled_up_to})"""
+
+db.event.listen(BlacklistToken, 'after_insert', BlacklistToken.on_inserted_token)
+db.event.listen(Role, 'after_insert', Role.on_changed_role)
+db.event.listen(Role, 'after_update', Role.on_changed_role)
+db.event.listen(Role, 'after_delete', Role.on_changed_role)
+db.event.listen(User, 'after_update', User.on_changed_user)
+db.event.listen(Follow, 'after_insert', TimelineEntry.on_inserted_follow)
+db.event.listen(Follow, 'after_delete', TimelineEntry.on_deleted_follow)
+db.event.listen(Follow, 'after_insert', Follow.on_inserted_follow)
+db.event.listen(Follow, 'after_delete', Follow.on_deleted_follow)
+db.event.listen(User, 'after_delete', User.on_changed_user)
 db.event.listen(Comment.body, 'set', Comment.on_changed_comment)
+db.event.listen(Comment, 'after_insert', Comment.on_inserted_comment)
+db.event.listen(Comment, 'after_delete', Comment.on_deleted_comment)
+db.event.listen(FavoritePosts, 'after_insert', FavoritePosts.on_inserted_favorite)
+db.event.listen(FavoritePosts, 'after_delete', FavoritePosts.on_deleted_favorite)
+StoredImage.track(Post.post_image, 'recipes_pics')
+StoredImage.track(User.image_file, 'profile_pics')
@@ -3,12 +3,14 @@ from flask_wtf.file import FileField, FileAllowed
 from wtforms import StringField, SubmitField, TextAreaField, SelectField, IntegerField
 from wtforms.validators import DataRequired, Length
 from flask_pagedown.fields import PageDownField
+from ..images import PictureLimits
 
 
 class PostForm(FlaskForm):
     title = StringField('Recipe title', validators=[DataRequired(), Length(min=3, max=50)])
     description = TextAreaField('Short description or story', validators=[DataRequired()])
-    post_picture = FileField('Upload Recipe Picture', validators=[FileAllowed(['png', 'jpg', 'jpeg', 'gif'])])
+    post_picture = FileField('Upload Recipe Picture', validators=[FileAllowed(['png', 'jpg', 'jpeg', 'gif', 'webp']),
+                                                                  PictureLimits()])
     # form fields for additional parameters of the post-recipe, right-side part of the post page
     portions = SelectField('Select number of portions: ', choices=[('1','1'), ('2','2'), ('3', '3'), ('4', '4'),
                                                                    ('5', '5'), ('6', '6'), ('8', '8'), ('10', '10'),
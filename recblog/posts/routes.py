@@ -3,9 +3,11 @@ from flask import render_template, request, url_for, redirect, flash, abort, cur
 from flask_login import current_user, login_required
 from .. import db
 from . import posts
-from ..models import Permission, Post, Comment, FavoritePosts
+from ..models import Permission, Post, Comment, FavoritePosts, PostSimilar
+from ..similarity import similar_recipes
 from .forms import PostForm, CommentForm
-from .utils import save_picture
+from .utils import save_picture, PLACEHOLDER_IMAGE
+from ..exceptions import ValidationError
 
 
 @posts.route("/post/new", methods=['GET', 'POST'])
@@ -13,18 +15,18 @@ from .utils import save_picture
 def new_post():
     form = PostForm()
     if current_user.can(Permission.WRITE) and form.validate_on_submit():
-        if form.post_picture.data:
-            picture_file = save_picture(form.post_picture.data)
-            p_image = picture_file
-        elif not form.post_picture.data:
-            p_image = os.path.join(current_app.root_path, 'uploads/recipes_pics', 'default.jpg')
-        post = Post(title=form.title.data, description=form.description.data, post_image=p_image,
+        post = Post(title=form.title.data, description=form.description.data, post_image=PLACEHOLDER_IMAGE,
                     portions=form.portions.data, recipe_yield=form.recipe_yield.data, cook_time=form.cook_time.data,
                     prep_time=form.prep_time.data, ready=form.ready_in.data, type_category=form.type_category.data,
                     main_ingredient = form.main_ingredient.data, ingredients=form.ingredients.data,
                     preparation=form.preparation.data, author=current_user)
         db.session.add(post)
         db.session.commit()
+        if form.post_picture.data:
+            try:
+                save_picture(form.post_picture.data, post.id)
+            except ValidationError as e:
+                flash(str(e), 'danger')
         flash("Your post has been created!", 'success')
         return redirect(url_for('main.home'))
 
@@ -35,7 +37,6 @@ def new_post():
 @posts.route("/post/<int:post_id>", methods=["GET", "POST"])
 def post(post_id):
     post = Post.query.get_or_404(post_id)
-    post_image = url_for('static', filename='uploads/recipes_pics/' + post.post_image)
     comments_form = CommentForm()
     if comments_form.validate_on_submit():
         comment = Comment(body=comments_form.body.data, post=post, author=current_user._get_current_object())
@@ -45,12 +46,16 @@ def post(post_id):
         return redirect(url_for('posts.post', post_id=post.id, page=-1))
     page = request.args.get('page', 1, type=int)
     if page == -1:
-        page = (post.comments.count() - 1) // current_app.config['MYRECBLOG_COMMENTS_PER_PAGE'] + 1
+        page = (post.comments_count - 1) // current_app.config['MYRECBLOG_COMMENTS_PER_PAGE'] + 1
     pagination = post.comments.order_by(Comment.comment_date.asc()).paginate(
         page, per_page=current_app.config['MYRECBLOG_COMMENTS_PER_PAGE'], error_out=False)
     comments = pagination.items
-    return render_template('post.html', title=post.title, post=post, post_image=post_image, form=comments_form,
-                           comments=comments, pagination=pagination)
+    also_liked = PostSimilar.similar_posts(post.id, 4)
+    # posts without enough likes are completed with the recipes closest by their title and ingredients
+    similar = similar_recipes(post, 4 - len(also_liked), exclude={item.id for item, _ in also_liked}) \
+        if len(also_liked) < 4 else []
+    return render_template('post.html', title=post.title, post=post, form=comments_form,
+                           comments=comments, pagination=pagination, also_liked=also_liked, similar=similar)
 
 
 @posts.route("/add_post_to_favorite/<int:post_id>")
@@ -86,14 +91,8 @@ def update_post(post_id):
         abort(403)
     form = PostForm()
     if form.validate_on_submit():
-        if form.post_picture.data:
-            picture_file = save_picture(form.post_picture.data)
-            p_image = picture_file
-        elif not form.post_picture.data:
-            p_image = post.post_image
         post.title = form.title.data
         post.description = form.description.data
-        post.post_image = p_image
         post.portions = form.portions.data
         post.recipe_yield = form.recipe_yield.data
         post.cook_time = form.cook_time.data
@@ -104,6 +103,11 @@ def update_post(post_id):
         post.ingredients = form.ingredients.data
         post.preparation = form.preparation.data
         db.session.commit()
+        if form.post_picture.data:
+            try:
+                save_picture(form.post_picture.data, post.id)
+            except ValidationError as e:
+                flash(str(e), 'danger')
         flash('Your post has been updated!', 'success')
         return redirect(url_for('posts.post', post_id=post.id))
     elif request.method == 'GET':
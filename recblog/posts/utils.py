@@ -1,17 +1,32 @@
 import os
-import secrets
-from PIL import Image
 from flask import current_app
+from .. import db, image_processor
+from ..images import content_path
+from ..models import Post
 
-def save_picture(form_picture):
-    random_hex = secrets.token_hex(8)
+# placeholder shown until the uploaded picture of a new post is processed
+PLACEHOLDER_IMAGE = 'default.jpg'
+
+
+def set_post_image(post_id, picture_fn, widths=()):
+    post = Post.query.get(post_id)
+    if post is not None:
+        post.post_image = picture_fn
+        post.post_image_widths = ','.join(map(str, widths)) or None
+        db.session.commit()
+
+
+# saves the raw upload and processes it off the request, the post keeps its current picture until then;
+# pictures are stored under the hash of the upload, so uploading the same photo again reuses the stored file
+def save_picture(form_picture, post_id):
     _, f_ext = os.path.splitext(form_picture.filename)
-    picture_fn = random_hex + f_ext
-    picture_path = os.path.join(current_app.root_path, 'static/uploads/recipes_pics', picture_fn)
+    raw_path, digest = image_processor.save_raw(form_picture)
+    picture_fn = content_path(digest, f_ext)
+    picture_path = os.path.join(current_app.config['MYRECBLOG_UPLOADS_DIR'], 'recipes_pics', picture_fn)
 
     output_size = (1560, 1040)
-    i = Image.open(form_picture)
-    i.thumbnail(output_size)
-    i.save(picture_path)
+    widths = current_app.config['MYRECBLOG_IMAGE_WIDTHS']
+    image_processor.submit(raw_path, picture_path, output_size, lambda: set_post_image(post_id, picture_fn, widths),
+                           widths=widths)
 
     return picture_fn
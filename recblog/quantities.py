@@ -0,0 +1,80 @@
+import re
+import math
+from fractions import Fraction
+
+
+# minutes per duration unit, a number without a unit is taken as minutes like in the post form
+DURATION_UNITS = {'s': Fraction(1, 60), 'sec': Fraction(1, 60), 'second': Fraction(1, 60),
+                  'm': 1, 'min': 1, 'mins': 1, 'minute': 1, 'minutes': 1,
+                  'h': 60, 'hr': 60, 'hrs': 60, 'hour': 60, 'hours': 60,
+                  'd': 1440, 'day': 1440, 'days': 1440, 'w': 10080, 'week': 10080, 'weeks': 10080}
+VULGAR_FRACTIONS = {'¼': ' 1/4', '½': ' 1/2', '¾': ' 3/4', '⅓': ' 1/3', '⅔': ' 2/3'}
+_NUMBER = r'\d+/\d+|\d+(?:[.,]\d+)?(?:\s+\d+/\d+)?'
+_QUANTITY = re.compile(rf'({_NUMBER})(?:\s*(?:-|–|to)\s*({_NUMBER}))?\s*([a-z]+)?')
+# ISO 8601 durations used by schema.org recipes, e.g. PT1H20M
+_ISO_DURATION = re.compile(r'^p(?:(\d+)d)?(?:t(?:(\d+)h)?(?:(\d+)m)?(?:(\d+)s)?)?$')
+# '1:30' is hours and minutes
+_CLOCK_DURATION = re.compile(r'^(\d+):(\d{2})$')
+# larger durations in minutes and counts are typos, they are not stored
+MAX_QUANTITY = 10 ** 6
+
+
+def _normalize(text):
+    text = str(text).strip().lower()
+    for fraction, replacement in VULGAR_FRACTIONS.items():
+        text = text.replace(fraction, replacement)
+    return text
+
+
+# the value of a number like '2', '1.5', '1/2' or '2 1/2', None for a zero denominator
+def _number(text):
+    total = Fraction(0)
+    for part in text.replace(',', '.').split():
+        try:
+            total += Fraction(part)
+        except ZeroDivisionError:
+            return None
+    return total
+
+
+# rounds half up to a whole number, None outside 0..MAX_QUANTITY
+def _whole(value):
+    if value is None:
+        return None
+    value = math.floor(value + Fraction(1, 2))
+    return value if 0 <= value <= MAX_QUANTITY else None
+
+
+# parses a free form duration into whole minutes: '30', '1 h 20 min', '1.5 hours', '1 1/2 hrs', '1:30', 'PT1H20M',
+# 'after 24 hour in the fridge'; the upper bound of a range is taken. Returns None when there is no duration
+# or it cannot be a real one.
+def parse_minutes(text):
+    if text is None:
+        return None
+    text = _normalize(text)
+    iso = _ISO_DURATION.match(text)
+    if iso and any(iso.groups()):
+        days, hours, minutes, seconds = (int(value or 0) for value in iso.groups())
+        return _whole(days * 1440 + hours * 60 + minutes + Fraction(seconds, 60))
+    clock = _CLOCK_DURATION.match(text)
+    if clock:
+        return _whole(int(clock.group(1)) * 60 + int(clock.group(2)))
+    total = None
+    for low, high, unit in _QUANTITY.findall(text):
+        if unit and unit not in DURATION_UNITS:
+            unit = unit.rstrip('s')
+            if unit not in DURATION_UNITS:
+                continue
+        number = _number(high or low)
+        if number is None:
+            return None
+        total = (total or 0) + number * DURATION_UNITS.get(unit, 1)
+    return _whole(total)
+
+
+# parses a count like portions or servings: '4', '4-6', '6 servings'; the lower bound of a range is taken
+def parse_count(text):
+    if text is None:
+        return None
+    match = _QUANTITY.search(_normalize(text))
+    return _whole(_number(match.group(1))) if match else None
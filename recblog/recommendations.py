@@ -0,0 +1,106 @@
+from datetime import datetime, time
+import numpy as np
+import scipy.sparse as sp
+from . import db
+from .models import FavoritePosts, PostSimilar, RollupWatermark
+
+POST_SIMILAR = 'post_similar'
+
+
+# (liker_id, post_id) arrays of all the likes, read in primary key chunks
+def load_likes(chunk_size=100000):
+    favorites = FavoritePosts.__table__
+    chunks = []
+    last_id = 0
+    while True:
+        rows = db.session.execute(db.select([favorites.c.id, favorites.c.liker_id, favorites.c.post_id])
+                                  .where(favorites.c.id > last_id).order_by(favorites.c.id).limit(chunk_size))\
+            .fetchall()
+        if not rows:
+            break
+        chunks.append(np.array(rows, dtype=np.int64))
+        last_id = int(chunks[-1][-1, 0])
+    if not chunks:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    likes = np.concatenate(chunks)
+    return likes[:, 1], likes[:, 2]
+
+
+# binary users x posts matrix, with the user ids of its rows and the post ids of its columns
+def like_matrix(liker_ids, post_ids):
+    users, rows = np.unique(liker_ids, return_inverse=True)
+    posts, columns = np.unique(post_ids, return_inverse=True)
+    matrix = sp.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, columns)), shape=(len(users), len(posts)))
+    matrix.data[:] = 1
+    return matrix, users, posts
+
+
+# positions of the ids in a sorted array of ids, ids missing from it are left out
+def _positions(sorted_ids, ids):
+    positions = np.searchsorted(sorted_ids, ids)
+    if not len(sorted_ids):
+        return positions[:0]
+    found = (positions < len(sorted_ids)) & (sorted_ids[np.minimum(positions, len(sorted_ids) - 1)] == ids)
+    return positions[found]
+
+
+# top_k columns most similar to each of the given ones by the cosine of their likers, block_size columns at a
+# time so only their co-occurrence counts are in memory; yields a list of (column, similar columns, scores) per block
+def similar_columns(matrix, columns, top_k=10, min_common=1, block_size=1000):
+    by_post = matrix.T.tocsr()
+    norms = np.sqrt(np.asarray(by_post.sum(axis=1), dtype=np.float64).ravel())
+    for start in range(0, len(columns), block_size):
+        block = columns[start:start + block_size]
+        common = (by_post[block] @ matrix).tocsr()
+        results = []
+        for row, column in enumerate(block):
+            similar = common.indices[common.indptr[row]:common.indptr[row + 1]]
+            counts = common.data[common.indptr[row]:common.indptr[row + 1]]
+            keep = (similar != column) & (counts >= min_common)
+            similar, counts = similar[keep], counts[keep]
+            # rounded so that equal scores are ordered by post id
+            scores = np.round(counts / (norms[column] * norms[similar]), 6)
+            if len(scores) > top_k:
+                best = np.argpartition(-scores, top_k - 1)[:top_k]
+                similar, scores = similar[best], scores[best]
+            order = np.lexsort((similar, -scores))
+            results.append((column, similar[order], scores[order]))
+        yield results
+
+
+# fills post_similar from the likes, one transaction per block of posts. After the first run only the posts whose
+# scores may have changed since the day of the last run are computed again: the posts liked by the recent likers,
+# whose common likers changed, and every post sharing a liker with a recently liked post, since the number of
+# likers of that post divides their score; full recomputes all posts, which also takes removed likes into account.
+# Returns the number of posts computed.
+def build_similar_posts(top_k=10, min_common=1, full=False, block_size=1000):
+    started = datetime.utcnow()
+    watermark = RollupWatermark.query.get(POST_SIMILAR)
+    matrix, users, posts = like_matrix(*load_likes())
+    similar = PostSimilar.__table__
+    if full or watermark is None:
+        db.session.execute(similar.delete())
+        columns = np.arange(len(posts))
+    else:
+        recent = np.array(db.session.query(FavoritePosts.liker_id, FavoritePosts.post_id)
+                          .filter(FavoritePosts.date_liked >= datetime.combine(watermark.rolled_up_to, time.min))
+                          .all(), dtype=np.int64).reshape(-1, 2)
+        liked = _positions(posts, np.unique(recent[:, 1]))
+        # posts of the recent likers and posts sharing a liker with the recently liked posts
+        rows = np.union1d(_positions(users, np.unique(recent[:, 0])), matrix[:, liked].tocoo().row)
+        columns = np.unique(matrix[rows].indices)
+    for results in similar_columns(matrix, columns, top_k, min_common, block_size):
+        post_ids = [int(posts[column]) for column, _, _ in results]
+        db.session.execute(similar.delete().where(similar.c.post_id.in_(post_ids)))
+        values = [{'post_id': int(posts[column]), 'similar_post_id': int(posts[other]), 'score': float(score)}
+                  for column, others, scores in results for other, score in zip(others, scores)]
+        if values:
+            db.session.execute(similar.insert(), values)
+        db.session.commit()
+    if watermark is None:
+        watermark = RollupWatermark(name=POST_SIMILAR, rolled_up_to=started.date())
+        db.session.add(watermark)
+    else:
+        watermark.rolled_up_to = started.date()
+    db.session.commit()
+    return len(columns)
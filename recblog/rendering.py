@@ -0,0 +1,112 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from markdown import markdown
+from bleach.sanitizer import Cleaner
+from bleach.linkifier import Linker
+
+
+# HTML tags allowed in every kind of rendered markdown content
+ALLOWED_TAGS = {
+    'post': frozenset(['a', 'abbr', 'acronym', 'b', 'blockquote', 'code', 'em', 'i', 'li', 'ol', 'pre', 'strong',
+                       'ul', 'h1', 'h2', 'h3', 'p']),
+    'comment': frozenset(['a', 'abbr', 'acronym', 'b', 'blockquote', 'code', 'em', 'i', 'strong', 'p']),
+}
+
+# bleach Cleaner and Linker keep html parser state, so every thread builds its own instances once
+_local = threading.local()
+
+
+def _pipeline(profile):
+    pipelines = getattr(_local, 'pipelines', None)
+    if pipelines is None:
+        pipelines = _local.pipelines = {}
+    if profile not in pipelines:
+        pipelines[profile] = (Cleaner(tags=ALLOWED_TAGS[profile], strip=True), Linker())
+    return pipelines[profile]
+
+
+# renders markdown to sanitized and linkified HTML, no caching so it is safe to call from worker processes
+def render_html(text, profile):
+    cleaner, linker = _pipeline(profile)
+    return linker.linkify(cleaner.clean(markdown(text, output_format='html')))
+
+
+# renders a chunk of (id, text, ...) rows, returns (id, html, ...) rows
+def render_rows(rows, profile):
+    return [(row[0],) + tuple(render_html(text, profile) for text in row[1:]) for row in rows]
+
+
+class MarkdownRenderer:
+    """Renders markdown through the shared pipeline with a bounded LRU cache keyed by the content hash."""
+
+    def __init__(self, app=None):
+        self.maxsize = 1024
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.maxsize = app.config['MYRECBLOG_RENDER_CACHE_SIZE']
+
+    def render(self, text, profile):
+        key = (profile, hashlib.sha1(text.encode('utf-8')).digest())
+        with self._lock:
+            html = self._cache.get(key)
+            if html is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return html
+            self.misses += 1
+        html = render_html(text, profile)
+        with self._lock:
+            self._cache[key] = html
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        return html
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._cache), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses}
+
+
+# re-renders the stored HTML of all posts and comments in a process pool, chunk by chunk of ids;
+# returns the number of re-rendered rows
+def rerender_all(workers=None, chunk_size=500):
+    from . import db
+    from .models import Post, Comment
+    jobs = [(Post.__table__, ['ingredients', 'preparation'], 'post'),
+            (Comment.__table__, ['body'], 'comment')]
+    # rows fetched per round trip, enough to keep every worker busy with one chunk
+    batch_size = chunk_size * (workers or os.cpu_count() or 1)
+    total = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for table, fields, profile in jobs:
+            sources = [table.c[field] for field in fields]
+            update = table.update().where(table.c.id == db.bindparam('row_id'))\
+                .values({field + '_html': db.bindparam('rendered_' + field) for field in fields})
+            last_id = 0
+            while True:
+                rows = db.session.execute(db.select([table.c.id] + sources)
+                                          .where(db.and_(table.c.id > last_id, *[s.isnot(None) for s in sources]))
+                                          .order_by(table.c.id).limit(batch_size)).fetchall()
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                chunks = [[tuple(row) for row in rows[i:i + chunk_size]] for i in range(0, len(rows), chunk_size)]
+                for rendered in executor.map(render_rows, chunks, [profile] * len(chunks)):
+                    db.session.execute(update, [dict(row_id=row[0], **{'rendered_' + field: html for field, html
+                                                                       in zip(fields, row[1:])})
+                                                for row in rendered])
+                    total += len(rendered)
+                db.session.commit()
+    return total
@@ -0,0 +1,58 @@
+import re
+from markupsafe import Markup, escape
+from . import db
+from .models import Post
+from .exceptions import ValidationError
+from .api.utils import encode_cursor, decode_cursor
+
+# snippet() puts these around the matched terms, they become <mark> tags once the snippet text is escaped
+SNIPPET_OPEN, SNIPPET_CLOSE = '\x02', '\x03'
+
+
+# every word of the query has to match; words are quoted so FTS5 operators typed by users are taken literally
+def match_expression(text):
+    return ' '.join(f'"{term}"' for term in re.findall(r'\w+', text or ''))
+
+
+def highlight(snippet):
+    return Markup(str(escape(snippet)).replace(SNIPPET_OPEN, '<mark>').replace(SNIPPET_CLOSE, '</mark>'))
+
+
+# BM25 ranked search over the posts_fts index with keyset pagination on (rank, id);
+# returns [(post, snippet)] and the cursor of the next page
+def search_posts(text, cursor=None, per_page=12):
+    expression = match_expression(text)
+    if not expression:
+        raise ValidationError('Search query is empty.')
+    params = {'match': expression, 'limit': per_page + 1}
+    after = ''
+    if cursor:
+        rank, post_id, _ = decode_cursor(cursor)
+        if not isinstance(rank, (int, float)):
+            raise ValidationError('Invalid cursor.')
+        after = ' AND (rank, rowid) > (:rank, :post_id)'
+        params.update(rank=rank, post_id=post_id)
+    rows = db.session.execute(db.text('SELECT rowid, rank FROM posts_fts WHERE posts_fts MATCH :match' + after +
+                                      ' ORDER BY rank, rowid LIMIT :limit'), params).fetchall()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if not rows:
+        return [], None
+    ids = [row[0] for row in rows]
+    # snippets are built only for the rows of the page
+    snippets = dict(db.session.execute(
+        db.text("SELECT rowid, snippet(posts_fts, -1, :open, :close, '…', 16) FROM posts_fts "
+                "WHERE posts_fts MATCH :match AND rowid IN :ids").bindparams(db.bindparam('ids', expanding=True)),
+        {'match': expression, 'open': SNIPPET_OPEN, 'close': SNIPPET_CLOSE, 'ids': ids}).fetchall())
+    posts = {post.id: post for post in Post.query.filter(Post.id.in_(ids))}
+    results = [(posts[post_id], highlight(snippets.get(post_id, ''))) for post_id in ids if post_id in posts]
+    next_cursor = encode_cursor(rows[-1][1], rows[-1][0], 'next') if has_more else None
+    return results, next_cursor
+
+
+# rebuilds the whole index from the posts table and merges its segments
+def rebuild_index():
+    db.session.execute(db.text("INSERT INTO posts_fts(posts_fts) VALUES('rebuild')"))
+    db.session.execute(db.text("INSERT INTO posts_fts(posts_fts) VALUES('optimize')"))
+    db.session.commit()
+    return db.session.execute(db.text('SELECT COUNT(*) FROM posts')).scalar()
@@ -0,0 +1,123 @@
+import json
+import time
+import dataclasses
+from datetime import date, datetime, time as day_time, timedelta
+from decimal import Decimal
+from uuid import UUID
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from flask.json.provider import DefaultJSONProvider
+except ImportError:
+    # Flask before 2.2 has no JSON providers, the app json_encoder is set instead
+    DefaultJSONProvider = None
+
+JSON_BACKENDS = ('auto', 'orjson', 'stdlib')
+
+
+# datetimes are written as ISO 8601, naive ones are taken as UTC like all the stored dates and UTC is written
+# with a Z suffix; microseconds only appear when there are some, the same as orjson writes them
+def format_datetime(value):
+    if value.tzinfo is None or value.utcoffset() == timedelta(0):
+        return value.replace(tzinfo=None).isoformat() + 'Z'
+    return value.isoformat()
+
+
+# values JSON does not know, for both backends
+def to_json(value):
+    if isinstance(value, datetime):
+        return format_datetime(value)
+    if isinstance(value, (date, day_time)):
+        return value.isoformat()
+    if isinstance(value, (Decimal, UUID)):
+        return str(value)
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return dataclasses.asdict(value)
+    if hasattr(value, '__html__'):
+        return str(value.__html__())
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+class JSONEncoder(json.JSONEncoder):
+    def default(self, o):
+        return to_json(o)
+
+
+def orjson_options(sort_keys=False, indent=None):
+    options = orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+    if sort_keys:
+        options |= orjson.OPT_SORT_KEYS
+    if indent:
+        options |= orjson.OPT_INDENT_2
+    return options
+
+
+# serializes with orjson when it is wanted and installed; values orjson refuses, like integers above 64 bits,
+# are left to the stdlib encoder
+def dumps(obj, backend='auto', sort_keys=False, indent=None, **kwargs):
+    if backend != 'stdlib' and orjson is not None:
+        try:
+            return orjson.dumps(obj, default=to_json, option=orjson_options(sort_keys, indent)).decode('utf-8')
+        except orjson.JSONEncodeError:
+            pass
+    kwargs.setdefault('cls', JSONEncoder)
+    return json.dumps(obj, sort_keys=sort_keys, indent=indent, **kwargs)
+
+
+class OrjsonEncoder(JSONEncoder):
+    def encode(self, o):
+        return dumps(o, sort_keys=self.sort_keys, indent=self.indent, cls=JSONEncoder,
+                     ensure_ascii=self.ensure_ascii, separators=(self.item_separator, self.key_separator))
+
+
+if DefaultJSONProvider is not None:
+    class JSONProvider(DefaultJSONProvider):
+        backend = 'stdlib'
+        default = staticmethod(to_json)
+
+        def dumps(self, obj, **kwargs):
+            kwargs.setdefault('sort_keys', self.sort_keys)
+            kwargs.setdefault('ensure_ascii', self.ensure_ascii)
+            kwargs.setdefault('default', self.default)
+            return dumps(obj, backend=self.backend, **kwargs)
+
+        def loads(self, s, **kwargs):
+            if self.backend == 'orjson' and not kwargs:
+                return orjson.loads(s)
+            return super().loads(s, **kwargs)
+
+    class OrjsonProvider(JSONProvider):
+        backend = 'orjson'
+
+
+# picks the JSON backend of MYRECBLOG_JSON_BACKEND: 'orjson', 'stdlib' or 'auto' for orjson when it is installed
+def init_json(app):
+    backend = app.config['MYRECBLOG_JSON_BACKEND']
+    if backend not in JSON_BACKENDS:
+        raise ValueError(f"MYRECBLOG_JSON_BACKEND has to be one of {', '.join(JSON_BACKENDS)}, not {backend}.")
+    if backend == 'auto':
+        backend = 'orjson' if orjson is not None else 'stdlib'
+    elif backend == 'orjson' and orjson is None:
+        raise RuntimeError('MYRECBLOG_JSON_BACKEND is orjson but orjson is not installed.')
+    if DefaultJSONProvider is not None:
+        app.json = OrjsonProvider(app) if backend == 'orjson' else JSONProvider(app)
+    else:
+        app.json_encoder = OrjsonEncoder if backend == 'orjson' else JSONEncoder
+    app.extensions['myrecblog_json'] = backend
+    return backend
+
+
+# mean seconds to serialize payload with every installed backend
+def benchmark(payload, repeat=100):
+    results = {}
+    for backend in ('stdlib', 'orjson') if orjson is not None else ('stdlib',):
+        dumps(payload, backend=backend)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            dumps(payload, backend=backend)
+        results[backend] = (time.perf_counter() - start) / repeat
+    return results
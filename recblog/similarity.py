@@ -0,0 +1,321 @@
+import os
+import re
+import json
+import time
+import zlib
+import shutil
+import secrets
+import threading
+from datetime import datetime
+import numpy as np
+from .ingredients import NOTES, singular, normalize_ingredient, parse_ingredients
+
+MANIFEST = 'index.json'
+SEGMENT_ARRAYS = ('post_ids', 'indptr', 'indices', 'data')
+# the main ingredient counts as much as this many ingredient lines
+MAIN_INGREDIENT_WEIGHT = 2
+# features are only left out of the lookups once they are in this many posts, shorter inverted lists are cheap
+STOP_MIN_POSTS = 1000
+_TITLE_WORD = re.compile(r"[a-z][a-z'-]*")
+
+
+# terms of a recipe: the words of the title and of the ingredient names, and every ingredient name as a whole,
+# e.g. 'i:rye flour', so a shared ingredient weighs more than a shared word
+def recipe_terms(title, ingredients, main_ingredient=None):
+    terms = [singular(word.strip("'-")) for word in _TITLE_WORD.findall((title or '').lower())]
+    terms = [term for term in terms if term and term not in NOTES]
+    for name in parse_ingredients(ingredients):
+        terms.append('i:' + name)
+        terms.extend(name.split())
+    main = normalize_ingredient(main_ingredient or '')
+    if main:
+        terms.extend(['i:' + main] * MAIN_INGREDIENT_WEIGHT)
+    return terms
+
+
+# sorted feature ids of the terms, hashed with crc32 so every process agrees on them, and their counts
+def hash_terms(terms, dims):
+    if not terms:
+        return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32)
+    hashed = np.fromiter((zlib.crc32(term.encode()) for term in terms), dtype=np.int64, count=len(terms)) % dims
+    indices, counts = np.unique(hashed, return_counts=True)
+    return indices.astype(np.int32), counts.astype(np.float32)
+
+
+# sublinear tf-idf weights of the rows of a CSR matrix of counts, every row scaled to unit length
+def weigh(indptr, indices, counts, idf):
+    data = ((1 + np.log(counts)) * idf[indices]).astype(np.float32)
+    rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    norms = np.sqrt(np.bincount(rows, weights=data.astype(np.float64) ** 2, minlength=len(indptr) - 1))
+    data /= np.maximum(norms, 1e-12)[rows].astype(np.float32)
+    return data
+
+
+# hashed counts of the posts of a query as CSR arrays, read in primary key chunks
+def _hashed_posts(query, dims, chunk_size=1000):
+    from .models import Post
+    post_ids, lengths, indices, counts = [], [], [], []
+    last_id = 0
+    while True:
+        rows = query.with_entities(Post.id, Post.title, Post.ingredients, Post.main_ingredient)\
+            .filter(Post.id > last_id).order_by(Post.id).limit(chunk_size).all()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        for post_id, title, ingredients, main_ingredient in rows:
+            post_indices, post_counts = hash_terms(recipe_terms(title, ingredients, main_ingredient), dims)
+            post_ids.append(post_id)
+            lengths.append(len(post_indices))
+            indices.append(post_indices)
+            counts.append(post_counts)
+    indptr = np.zeros(len(post_ids) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=indptr[1:])
+    return (np.array(post_ids, dtype=np.int32), indptr,
+            np.concatenate(indices) if indices else np.zeros(0, dtype=np.int32),
+            np.concatenate(counts) if counts else np.zeros(0, dtype=np.float32))
+
+
+def _changed_rows(base, post_ids, indptr, indices, data):
+    rows = np.minimum(np.searchsorted(base['post_ids'], post_ids), max(len(base['post_ids']) - 1, 0))
+    keep = np.ones(len(post_ids), dtype=bool)
+    for position, row in enumerate(rows):
+        if len(base['post_ids']) and base['post_ids'][row] == post_ids[position]:
+            old = slice(base['indptr'][row], base['indptr'][row + 1])
+            new = slice(indptr[position], indptr[position + 1])
+            keep[position] = not (np.array_equal(base['indices'][old], indices[new])
+                                  and np.array_equal(base['data'][old], data[new]))
+    lengths = np.diff(indptr)[keep]
+    entries = np.repeat(keep, np.diff(indptr))
+    kept_indptr = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=kept_indptr[1:])
+    return post_ids[keep], kept_indptr, indices[entries], data[entries]
+
+
+def _write_segment(directory, prefix, arrays):
+    name = f'{prefix}-{datetime.utcnow():%Y%m%d%H%M%S}-{secrets.token_hex(3)}'
+    os.makedirs(os.path.join(directory, name))
+    for array_name, array in arrays.items():
+        np.save(os.path.join(directory, name, array_name + '.npy'), array)
+    return name
+
+
+# replaces the manifest; the segments it no longer names are kept for retire_seconds, workers that read the
+# previous manifest may still be about to map them, and removed afterwards
+def _write_manifest(directory, manifest, previous, retire_seconds):
+    now = time.time()
+    current = (manifest['base'], manifest['delta'])
+    retired = dict((previous or {}).get('retired', {}))
+    for name in ((previous or {}).get('base'), (previous or {}).get('delta')):
+        if name and name not in current:
+            retired.setdefault(name, now)
+    manifest['retired'] = {name: at for name, at in retired.items()
+                           if name not in current and now - at < retire_seconds}
+    path = os.path.join(directory, MANIFEST)
+    with open(path + '.tmp', 'w') as tmp:
+        json.dump(manifest, tmp)
+    os.replace(path + '.tmp', path)
+    # workers still reading a removed segment keep its mapped files until they reload
+    for name in os.listdir(directory):
+        if name.startswith(('base-', 'delta-')) and name not in current and name not in manifest['retired']:
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+
+# writes the content index of the posts. A full build hashes all posts, computes the idf of the features and
+# stores the vectors with their inverted lists; features in more than MYRECBLOG_CONTENT_MAX_DF of the posts are
+# left out of the lookups, they weigh little and would make every lookup walk most of the index. Later builds
+# only hash the posts added or changed since the full build into a small delta segment, with the same idf.
+# Returns the number of posts indexed.
+def build_content_index(full=False, chunk_size=1000):
+    from . import content_index
+    from .models import Post
+    if not content_index.directory:
+        raise RuntimeError('MYRECBLOG_CONTENT_INDEX_DIR is not set')
+    os.makedirs(content_index.directory, exist_ok=True)
+    started = datetime.utcnow()
+    manifest = content_index.read_manifest()
+    previous = dict(manifest) if manifest is not None else None
+    if full or manifest is None:
+        dims = content_index.dims
+        post_ids, indptr, indices, counts = _hashed_posts(Post.query, dims, chunk_size)
+        documents = np.bincount(indices, minlength=dims)
+        idf = (np.log((1 + len(post_ids)) / (1 + documents)) + 1).astype(np.float32)
+        data = weigh(indptr, indices, counts, idf)
+        stop = documents > max(content_index.max_df * len(post_ids), STOP_MIN_POSTS)
+        kept = ~stop[indices]
+        rows = np.repeat(np.arange(len(post_ids), dtype=np.int32), np.diff(indptr))[kept]
+        order = np.argsort(indices[kept], kind='stable')
+        term_indptr = np.zeros(dims + 1, dtype=np.int64)
+        np.cumsum(np.bincount(indices[kept], minlength=dims), out=term_indptr[1:])
+        base = _write_segment(content_index.directory, 'base', {
+            'post_ids': post_ids, 'indptr': indptr, 'indices': indices, 'data': data, 'idf': idf,
+            'stop': stop, 'term_indptr': term_indptr, 'term_rows': rows[order], 'term_data': data[kept][order]})
+        manifest = {'dims': dims, 'base': base, 'delta': None, 'built_at': started.isoformat(),
+                    'posts': len(post_ids)}
+    else:
+        built_at = datetime.fromisoformat(manifest['built_at'])
+        changed = Post.query.filter((Post.updated_at >= built_at) | (Post.date_posted >= built_at))
+        post_ids, indptr, indices, counts = _hashed_posts(changed, manifest['dims'], chunk_size)
+        base = {name: np.load(os.path.join(content_index.directory, manifest['base'], name + '.npy'), mmap_mode='r')
+                for name in SEGMENT_ARRAYS + ('idf',)}
+        data = weigh(indptr, indices, counts, base['idf'])
+        # the counters of the posts also set updated_at, posts with the same vector as in the base are left out
+        post_ids, indptr, indices, data = _changed_rows(base, post_ids, indptr, indices, data)
+        manifest['delta'] = _write_segment(content_index.directory, 'delta', {
+            'post_ids': post_ids, 'indptr': indptr, 'indices': indices, 'data': data})
+    manifest['updated_at'] = started.isoformat()
+    _write_manifest(content_index.directory, manifest, previous, max(content_index.check_interval, 60))
+    content_index.clear()
+    return len(post_ids)
+
+
+class ContentIndex:
+    """Hashed tf-idf vectors of the titles and ingredients of the posts, for "similar recipes" lookups that do
+    not need any likes. The vectors are sparse float32 rows kept on disk in MYRECBLOG_CONTENT_INDEX_DIR and
+    memory-mapped read-only, so all worker processes share one copy in the page cache; a full build writes a
+    base segment with inverted lists, later builds a delta segment of the new and changed posts. Workers look
+    for a new build at most every MYRECBLOG_CONTENT_INDEX_CHECK_INTERVAL seconds."""
+
+    def __init__(self, app=None):
+        self.directory = None
+        self.dims = 2 ** 18
+        self.max_df = 0.05
+        self.check_interval = 10
+        self._lock = threading.Lock()
+        self._checked_at = None
+        self._manifest = None
+        self._base = self._delta = None
+        # base rows of the posts the delta segment has newer vectors of
+        self._superseded = np.zeros(0, dtype=np.int64)
+        self.loads = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.directory = app.config['MYRECBLOG_CONTENT_INDEX_DIR']
+        self.dims = app.config['MYRECBLOG_CONTENT_FEATURES']
+        self.max_df = app.config['MYRECBLOG_CONTENT_MAX_DF']
+        self.check_interval = app.config['MYRECBLOG_CONTENT_INDEX_CHECK_INTERVAL']
+        self.clear()
+
+    def read_manifest(self):
+        if not self.directory:
+            return None
+        try:
+            with open(os.path.join(self.directory, MANIFEST)) as manifest:
+                return json.load(manifest)
+        except FileNotFoundError:
+            return None
+
+    def _load_segment(self, name, arrays):
+        return {array: np.load(os.path.join(self.directory, name, array + '.npy'), mmap_mode='r')
+                for array in arrays}
+
+    def _ensure_loaded(self):
+        with self._lock:
+            if self._checked_at is not None and time.monotonic() - self._checked_at < self.check_interval:
+                return
+            self._checked_at = time.monotonic()
+            loaded = self._manifest
+        # a build may retire the segments of the manifest just read, which is then read again
+        for attempt in range(3):
+            manifest = self.read_manifest()
+            if manifest == loaded:
+                return
+            try:
+                base, delta, superseded = self._load(manifest)
+                break
+            except FileNotFoundError:
+                continue
+        else:
+            # the loaded index is served until the next check
+            return
+        with self._lock:
+            self._manifest, self._base, self._delta, self._superseded = manifest, base, delta, superseded
+            self.loads += 1
+
+    def _load(self, manifest):
+        base = delta = None
+        superseded = np.zeros(0, dtype=np.int64)
+        if manifest is not None:
+            base = self._load_segment(manifest['base'], SEGMENT_ARRAYS + ('idf', 'stop', 'term_indptr',
+                                                                           'term_rows', 'term_data'))
+            if manifest['delta']:
+                delta = self._load_segment(manifest['delta'], SEGMENT_ARRAYS)
+                superseded = np.flatnonzero(np.isin(base['post_ids'], delta['post_ids']))
+        return base, delta, superseded
+
+    def clear(self):
+        with self._lock:
+            self._checked_at = None
+            self._manifest = None
+            self._base = self._delta = None
+            self._superseded = np.zeros(0, dtype=np.int64)
+            self.loads = 0
+
+    # unit tf-idf vector of a recipe with the idf of the loaded index, without the features left out of lookups
+    def _query(self, base, dims, title, ingredients, main_ingredient):
+        indices, counts = hash_terms(recipe_terms(title, ingredients, main_ingredient), dims)
+        values = weigh(np.array([0, len(indices)]), indices, counts, base['idf'])
+        kept = ~base['stop'][indices]
+        return indices[kept], values[kept]
+
+    # the limit posts closest to the post by the cosine of their vectors as [(post_id, score)]; the post is
+    # vectorized from its current title and ingredients, so new posts get similar recipes before they are indexed
+    def similar(self, post, limit=10):
+        self._ensure_loaded()
+        with self._lock:
+            manifest, base, delta, superseded = self._manifest, self._base, self._delta, self._superseded
+        if manifest is None or limit < 1:
+            return []
+        indices, values = self._query(base, manifest['dims'], post.title, post.ingredients, post.main_ingredient)
+        if not len(indices):
+            return []
+
+        # base segment: the inverted lists of the features of the post
+        starts, ends = base['term_indptr'][indices], base['term_indptr'][indices + 1]
+        rows = np.concatenate([base['term_rows'][start:end] for start, end in zip(starts, ends)])
+        weights = np.concatenate([base['term_data'][start:end] * value
+                                  for start, end, value in zip(starts, ends, values)])
+        scores = np.bincount(rows, weights=weights, minlength=len(base['post_ids']))
+        scores[superseded] = 0
+        candidates = np.flatnonzero(scores)
+        post_ids, scores = np.asarray(base['post_ids'][candidates], dtype=np.int64), scores[candidates]
+
+        # delta segment: a scan of its few rows
+        if delta is not None and len(delta['indices']):
+            entries = np.searchsorted(indices, delta['indices'])
+            matched = indices[np.minimum(entries, len(indices) - 1)] == delta['indices']
+            entry_rows = np.repeat(np.arange(len(delta['post_ids'])), np.diff(delta['indptr']))
+            delta_scores = np.bincount(entry_rows[matched], weights=delta['data'][matched] * values[entries[matched]],
+                                       minlength=len(delta['post_ids']))
+            found = np.flatnonzero(delta_scores)
+            post_ids = np.concatenate((post_ids, np.asarray(delta['post_ids'][found], dtype=np.int64)))
+            scores = np.concatenate((scores, delta_scores[found]))
+
+        keep = post_ids != post.id
+        post_ids, scores = post_ids[keep], np.round(scores[keep], 6)
+        if len(scores) > limit:
+            best = np.argpartition(-scores, limit - 1)[:limit]
+            post_ids, scores = post_ids[best], scores[best]
+        order = np.lexsort((post_ids, -scores))
+        return [(int(post_ids[i]), float(scores[i])) for i in order]
+
+    def stats(self):
+        self._ensure_loaded()
+        with self._lock:
+            if self._manifest is None:
+                return {'posts': 0, 'delta_posts': 0, 'loads': self.loads}
+            return {'posts': len(self._base['post_ids']), 'delta_posts': len(self._delta['post_ids'])
+                    if self._delta is not None else 0, 'built_at': self._manifest['built_at'],
+                    'updated_at': self._manifest['updated_at'], 'loads': self.loads}
+
+
+# posts similar to the post by their content as [(post, score)], loaded with one query; posts deleted since the
+# index was built are skipped
+def similar_recipes(post, limit=4, exclude=()):
+    from . import content_index
+    from .models import Post
+    similar = [item for item in content_index.similar(post, limit + len(exclude)) if item[0] not in exclude]
+    posts = {item.id: item for item in Post.query.filter(Post.id.in_([post_id for post_id, _ in similar]))} \
+        if similar else {}
+    return [(posts[post_id], score) for post_id, score in similar if post_id in posts][:limit]
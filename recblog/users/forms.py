@@ -4,6 +4,7 @@ from wtforms import StringField, PasswordField, SubmitField, BooleanField, TextA
 from wtforms.validators import DataRequired, Length, Email, EqualTo, ValidationError, Regexp
 from flask_login import current_user
 from ..models import User
+from ..images import PictureLimits
 
 
 class RegistrationForm(FlaskForm):
@@ -27,7 +28,8 @@ class RegistrationForm(FlaskForm):
 
 class UpdateUserForm(FlaskForm):
     username = StringField('Username', validators=[DataRequired(), Length(min=3, max=24)])
-    picture = FileField('Update Profile Picture', validators=[FileAllowed(['png', 'jpg', 'jpeg', 'gif'])])
+    picture = FileField('Update Profile Picture', validators=[FileAllowed(['png', 'jpg', 'jpeg', 'gif', 'webp']),
+                                                              PictureLimits()])
     location = StringField('Location', validators=[Length(min=2, max=24)])
     about_me = TextAreaField('About me')
     submit = SubmitField('Update Profile')
@@ -5,6 +5,8 @@ from .. import db, bcrypt
 from ..models import User, Post, Permission
 from .forms import RegistrationForm, LoginForm, UpdateUserForm, RequestResetForm, ResetPasswordForm, UpdateUserEmail
 from .utils import send_reset_email, send_confirmation_email, add_profile_pic
+from ..exceptions import ValidationError
+from ..graph import suggested_users
 from recblog.content_management.decorators import permission_required
 
 
@@ -69,7 +71,9 @@ def logout():
 def account():
     user = User.query.filter_by(username=current_user.username).first_or_404()
     image_file = url_for('static', filename='uploads/profile_pics/' + current_user.image_file )
-    return render_template('account.html', title="Account", user=user, image_file=image_file)
+    suggestions = suggested_users(user.id, 5)
+    return render_template('account.html', title="Account", user=user, image_file=image_file,
+                           suggestions=suggestions)
 
 
 @users.route('/user_account/<string:username>', methods=["GET"])
@@ -88,9 +92,10 @@ def update_account(user_id):
     form = UpdateUserForm()
     if form.validate_on_submit():
         if form.picture.data:
-            username = current_user.username
-            pic = add_profile_pic(form.picture.data, username)
-            current_user.image_file = pic
+            try:
+                add_profile_pic(form.picture.data, current_user)
+            except ValidationError as e:
+                flash(str(e), 'danger')
         current_user.username = form.username.data
         current_user.location = form.location.data
         current_user.about_me = form.about_me.data
@@ -1,10 +1,10 @@
 import os
 from flask import render_template, url_for, current_app
-from .. import mail
+from .. import db, mail, image_processor
+from ..images import content_path
+from ..models import User
 from flask_mail import Message
 from threading import Thread
-# pip install pillow
-from PIL import Image
 
 
 def send_async_email(app, msg):
@@ -32,21 +32,28 @@ If you did not make this request then simply ignore this email and no changes wi
 """
     mail.send(msg)
 
-def add_profile_pic(pic_upload, username):
+def set_profile_pic(user_id, storage_filename):
+    user = User.query.get(user_id)
+    if user is not None:
+        user.image_file = storage_filename
+        db.session.commit()
+
+
+# saves the raw upload and processes it off the request, the user keeps the current picture until then;
+# pictures are stored under the hash of the upload
+def add_profile_pic(pic_upload, user):
     filename = pic_upload.filename
     # Grab extension type .jpg or .png
     ext_type = filename.split('.')[-1]
-    storage_filename = str(username) + '.' + ext_type
+    raw_path, digest = image_processor.save_raw(pic_upload)
+    storage_filename = content_path(digest, '.' + ext_type)
 
-    filepath = os.path.join(current_app.root_path, 'static/uploads/profile_pics', storage_filename)
+    filepath = os.path.join(current_app.config['MYRECBLOG_UPLOADS_DIR'], 'profile_pics', storage_filename)
 
     # Play Around with this size.
     output_size = (200, 200)
 
-    # Open the picture and save it
-    pic = Image.open(pic_upload)
-    pic.thumbnail( output_size )
-    pic.save(filepath)
+    user_id = user.id
+    image_processor.submit(raw_path, filepath, output_size, lambda: set_profile_pic(user_id, storage_filename))
 
     return storage_filename
-
@@ -12,7 +12,8 @@ import sys
 import click
 from flask_migrate import Migrate
 from recblog import create_app, db
-from recblog.models import User, Follow, Role, Permission, Post, Comment, FavoritePosts
+from recblog.models import User, Follow, Role, Permission, Post, Comment, FavoritePosts, StoredImage, BlacklistToken, \
+    TimelineEntry
 
 app = create_app(os.getenv('FLASK_CONFIG') or 'default')
 migrate = Migrate(app, db, render_as_batch=True)
@@ -21,7 +22,7 @@ migrate = Migrate(app, db, render_as_batch=True)
 @app.shell_context_processor
 def make_shell_context():
     return dict(db=db, User=User, Follow=Follow, Role=Role, Permission=Permission,
-                Post=Post, Comment=Comment, FavoritePosts=FavoritePosts)
+                Post=Post, Comment=Comment, FavoritePosts=FavoritePosts, StoredImage=StoredImage)
 
 
 @app.cli.command()
@@ -62,6 +63,178 @@ def custom_run(length, profile_dir):
     app.run(debug=True)
 
 
+@app.cli.command()
+@click.option('--fix/--no-fix', default=False, help='Overwrite drifted counters with the real values.')
+def check_counters(fix):
+    """Reconcile the Post comments and favorites counters with the real numbers."""
+    drifted = Post.reconcile_counters(fix=fix)
+    for post_id, comments_count, comments, favored_count, favored in drifted:
+        print(f'Post {post_id}: comments_count {comments_count} (real {comments}), '
+              f'favored_count {favored_count} (real {favored})')
+    print(f'{len(drifted)} drifted posts' + (' fixed.' if fix else ' found.'))
+    if drifted and not fix:
+        sys.exit(1)
+
+
+@app.cli.command()
+@click.option('--workers', default=None, type=int, help='Number of worker processes, defaults to the CPU count.')
+@click.option('--chunk-size', default=500, help='Number of rows rendered by a worker at once.')
+def rerender(workers, chunk_size):
+    """Re-render the stored HTML of all posts and comments, e.g. after the allowed tags have changed."""
+    from recblog.rendering import rerender_all
+    total = rerender_all(workers=workers, chunk_size=chunk_size)
+    print(f'{total} rows re-rendered.')
+
+
+@app.cli.command()
+@click.option('--workers', default=None, type=int, help='Number of worker processes, defaults to the CPU count.')
+@click.option('--force/--no-force', default=False, help='Recreate derivatives that already exist.')
+def backfill_images(workers, force):
+    """Generate the responsive WebP and JPEG derivatives of all stored recipe pictures."""
+    from recblog.images import backfill_derivatives, record_derivative_widths
+    pictures_dir = os.path.join(app.config['MYRECBLOG_UPLOADS_DIR'], 'recipes_pics')
+    results = backfill_derivatives(pictures_dir, app.config['MYRECBLOG_IMAGE_WIDTHS'], workers=workers, force=force)
+    print(', '.join(f'{count} {result}' for result, count in results.items()) + '.')
+    # the srcsets of the posts are only rendered once their derivatives are recorded
+    print(f'{record_derivative_widths(pictures_dir, app.config["MYRECBLOG_IMAGE_WIDTHS"])} posts updated.')
+
+
+@app.cli.command()
+def rebuild_search_index():
+    """Rebuild the full-text search index of the posts from scratch."""
+    from recblog.search import rebuild_index
+    print(f'{rebuild_index()} posts indexed.')
+
+
+@app.cli.command()
+@click.option('--chunk-size', default=1000, help='Number of posts parsed at once.')
+def index_ingredients(chunk_size):
+    """Parse the ingredients of all posts into the ingredient index tables."""
+    from recblog.ingredients import reindex_all
+    print(f'{reindex_all(chunk_size=chunk_size)} posts indexed.')
+
+
+@app.cli.command()
+@click.option('--chunk-size', default=1000, help='Number of posts parsed at once.')
+def backfill_quantities(chunk_size):
+    """Parse the cooking times and portions of all posts into their integer columns."""
+    print(f'{Post.backfill_quantities(chunk_size=chunk_size)} posts parsed.')
+
+
+@app.cli.command()
+def prune_token_blocklist():
+    """Delete the revoked tokens that have expired, meant to be run periodically."""
+    from datetime import timedelta
+    # tokens revoked before their expiry was stored are deleted after the longest token lifetime
+    max_age = app.config.get('JWT_ACCESS_TOKEN_EXPIRES', timedelta(minutes=15))
+    if isinstance(max_age, int) and not isinstance(max_age, bool):
+        max_age = timedelta(seconds=max_age)
+    deleted = BlacklistToken.prune(max_age=max_age if isinstance(max_age, timedelta) else None)
+    print(f'{deleted} expired tokens deleted.')
+
+
+@app.cli.command()
+def migrate_images():
+    """Move flat stored pictures to content addressed paths and rewrite the posts and users referencing them."""
+    from recblog.images import migrate_flat_uploads
+    files, rows = migrate_flat_uploads(app.config['MYRECBLOG_UPLOADS_DIR'])
+    print(f'{files} pictures moved, {rows} rows rewritten.')
+
+
+@app.cli.command()
+@click.option('--grace', default=3600, help='Seconds a picture must stay unreferenced before it is removed.')
+def gc_images(grace):
+    """Remove stored pictures that are no longer referenced by any post or user."""
+    from recblog.images import collect_garbage
+    removed = collect_garbage(app.config['MYRECBLOG_UPLOADS_DIR'], grace_seconds=grace)
+    print(f'{removed} pictures removed.')
+
+
+@app.cli.command()
+def rebuild_timelines():
+    """Fill the followed posts timelines of all users again from the follows and posts tables."""
+    print(f'{TimelineEntry.rebuild()} timeline entries written.')
+
+
+@app.cli.command()
+@click.option('--since', default=None, type=click.DateTime(formats=['%Y-%m-%d']),
+              help='Roll the days from this one up again, defaults to the day after the last rolled up one.')
+@click.option('--until', default=None, type=click.DateTime(formats=['%Y-%m-%d']),
+              help='Last day to roll up, defaults to yesterday.')
+def rollup_stats(since, until):
+    """Roll the likes, comments and posts of the finished days up into daily_stats, meant to be run daily."""
+    from recblog.analytics import rollup_daily_stats, rolled_up_to
+    days = rollup_daily_stats(since=since.date() if since else None, until=until.date() if until else None)
+    print(f'{days} days rolled up, daily_stats are complete up to {rolled_up_to()}.')
+
+
+@app.cli.command()
+@click.option('--top-k', default=10, help='Number of similar posts kept per post.')
+@click.option('--min-common', default=1, help='Number of common likers two posts need to be similar.')
+@click.option('--full/--incremental', default=False, help='Recompute all posts instead of the recently liked ones.')
+def build_similar_posts(top_k, min_common, full):
+    """Compute the posts liked by the same people from the likes, meant to be run periodically."""
+    from recblog.recommendations import build_similar_posts
+    print(f'{build_similar_posts(top_k=top_k, min_common=min_common, full=full)} posts computed.')
+
+
+@app.cli.command()
+@click.option('--full/--incremental', default=False, help='Index all posts, not only the changed ones.')
+def build_content_index(full):
+    """Write the content vectors of the similar recipes, meant to be run periodically."""
+    from recblog.similarity import build_content_index
+    print(f'{build_content_index(full=full)} posts indexed.')
+
+
+@app.cli.command()
+@click.option('--posts', default=100, help='Number of posts serialized at once.')
+@click.option('--repeat', default=200, help='Number of timed serializations.')
+def benchmark_json(posts, repeat):
+    """Time the serialization of a page of posts with every installed JSON backend."""
+    from recblog import fake_data
+    from recblog.serialization import benchmark
+    bench_app = create_app('testing')
+    with bench_app.app_context(), bench_app.test_request_context():
+        db.create_all()
+        Role.insert_roles()
+        fake_data.users(5)
+        fake_data.posts(posts)
+        payload = {'posts': [post.convert_post_json() for post in Post.query.limit(posts)]}
+        db.session.remove()
+        db.drop_all()
+    results = benchmark(payload, repeat=repeat)
+    for backend, seconds in results.items():
+        print(f'{backend:>7}  {seconds * 1000 * 100 / posts:.3f} ms per 100 posts')
+    if len(results) > 1:
+        print(f"orjson is {results['stdlib'] / results['orjson']:.1f}x faster")
+
+
+@app.cli.command()
+@click.option('--users', default=20, help='Number of fake users to seed.')
+@click.option('--posts', default=200, help='Number of fake posts to seed.')
+def audit_indexes(users, posts):
+    """Run EXPLAIN QUERY PLAN for the hot queries on a seeded database, fail on full table scans."""
+    from recblog import fake_data
+    from recblog.db_audit import audit_hot_queries
+    audit_app = create_app('testing')
+    with audit_app.app_context():
+        db.create_all()
+        Role.insert_roles()
+        fake_data.users(users)
+        fake_data.posts(posts)
+        results = audit_hot_queries()
+        db.session.remove()
+        db.drop_all()
+    failed = False
+    for name, plan, scans in results:
+        print(f"{'FULL SCAN' if scans else 'ok':>9}  {name}")
+        for detail in plan:
+            print(f'           {detail}')
+        failed = failed or bool(scans)
+    if failed:
+        sys.exit(1)
+
+
 with app.app_context():
     if db.engine.url.drivername == 'sqlite':
         migrate.init_app(app, db, render_as_batch=True)
@@ -0,0 +1,105 @@
+import unittest
+from datetime import date, datetime, timedelta
+from recblog import create_app, db, bcrypt
+from recblog.models import Role, User, Post, Comment, FavoritePosts, DailyStat
+from recblog.analytics import rollup_daily_stats, rolled_up_to, rollup_series, rollup_top
+
+
+class DailyStatsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.authors = [User(username=name, email=f'{name.lower()}@example.com', confirmed=True,
+                             password=bcrypt.generate_password_hash('foam').decode('utf-8'))
+                        for name in ('Sue', 'John')]
+        db.session.add_all(self.authors)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def create_post(self, title, category, author, posted_on):
+        post = Post(title=title, description='Test description', post_image='default.jpg', portions='4',
+                    cook_time='30', type_category=category, ingredients='flour', preparation='bake it',
+                    author=author, date_posted=posted_on)
+        db.session.add(post)
+        db.session.commit()
+        return post
+
+    def like(self, user, post, liked_on):
+        favorite = FavoritePosts(user.id, post.id)
+        favorite.date_liked = liked_on
+        db.session.add(favorite)
+        db.session.commit()
+        return favorite
+
+    def test_rollup_since_the_watermark(self):
+        sue, john = self.authors
+        pie = self.create_post('Apple pie', 'pie', sue, datetime(2021, 1, 1, 9))
+        soup = self.create_post('Soup', 'soup', john, datetime(2021, 1, 2, 9))
+        self.like(john, pie, datetime(2021, 1, 2, 10))
+        self.like(sue, soup, datetime(2021, 1, 2, 11))
+        db.session.add(Comment(body='Tasty!', author=john, post=pie, comment_date=datetime(2021, 1, 3, 8)))
+        db.session.commit()
+
+        self.assertEqual(rollup_daily_stats(until=date(2021, 1, 2)), 2)
+        self.assertEqual(rolled_up_to(), date(2021, 1, 2))
+        self.assertEqual(DailyStat.query.get((date(2021, 1, 2), 'likes', 'all', 'all')).total, 2)
+        self.assertEqual(DailyStat.query.get((date(2021, 1, 2), 'likes', 'author', str(sue.id))).total, 1)
+        self.assertEqual(DailyStat.query.get((date(2021, 1, 1), 'posts', 'category', 'pie')).total, 1)
+        self.assertIsNone(DailyStat.query.filter_by(metric='comments').first())
+
+        # only the days after the watermark are rolled up, changes of older days need since
+        self.like(sue, pie, datetime(2021, 1, 2, 12))
+        self.assertEqual(rollup_daily_stats(until=date(2021, 1, 3)), 1)
+        self.assertEqual(DailyStat.query.get((date(2021, 1, 3), 'comments', 'category', 'pie')).total, 1)
+        self.assertEqual(DailyStat.query.get((date(2021, 1, 2), 'likes', 'all', 'all')).total, 2)
+        self.assertEqual(rollup_daily_stats(since=date(2021, 1, 2), until=date(2021, 1, 2)), 1)
+        self.assertEqual(DailyStat.query.get((date(2021, 1, 2), 'likes', 'all', 'all')).total, 3)
+        self.assertEqual(rolled_up_to(), date(2021, 1, 3))
+        self.assertEqual(rollup_daily_stats(until=date(2021, 1, 3)), 0)
+
+        starts, series = rollup_series('likes', 'category', date(2021, 1, 1), date(2021, 1, 4))
+        self.assertEqual(series, {'pie': [0, 2, 0, 0], 'soup': [0, 1, 0, 0]})
+        self.assertEqual(rollup_top('likes', 'author', date(2021, 1, 1), date(2021, 1, 31)),
+                         [(str(sue.id), 2), (str(john.id), 1)])
+
+    def test_rollup_since_after_the_watermark(self):
+        sue, john = self.authors
+        pie = self.create_post('Apple pie', 'pie', sue, datetime(2021, 1, 1, 9))
+        self.assertEqual(rollup_daily_stats(until=date(2021, 1, 1)), 1)
+        self.like(john, pie, datetime(2021, 1, 3, 10))
+        self.like(sue, pie, datetime(2021, 1, 5, 10))
+
+        # the 2nd to the 3rd are skipped, the watermark stays before them
+        self.assertEqual(rollup_daily_stats(since=date(2021, 1, 4), until=date(2021, 1, 5)), 2)
+        self.assertEqual(rolled_up_to(), date(2021, 1, 1))
+        self.assertEqual(DailyStat.query.get((date(2021, 1, 5), 'likes', 'all', 'all')).total, 1)
+        self.assertIsNone(DailyStat.query.get((date(2021, 1, 3), 'likes', 'all', 'all')))
+
+        # the next run fills the gap, chunks after it move the watermark on
+        self.assertEqual(rollup_daily_stats(until=date(2021, 1, 5), chunk_days=2), 4)
+        self.assertEqual(rolled_up_to(), date(2021, 1, 5))
+        self.assertEqual(DailyStat.query.get((date(2021, 1, 3), 'likes', 'all', 'all')).total, 1)
+
+    def test_rollup_since_without_watermark(self):
+        sue, john = self.authors
+        pie = self.create_post('Apple pie', 'pie', sue, datetime(2021, 1, 1, 9))
+        self.like(john, pie, datetime(2021, 1, 3, 10))
+        self.assertEqual(rollup_daily_stats(since=date(2021, 1, 3), until=date(2021, 1, 3)), 1)
+        self.assertIsNone(rolled_up_to())
+        self.assertEqual(rollup_daily_stats(until=date(2021, 1, 3)), 3)
+        self.assertEqual(rolled_up_to(), date(2021, 1, 3))
+
+    def test_unfinished_days_are_not_rolled_up(self):
+        today = datetime.utcnow()
+        self.create_post('Apple pie', 'pie', self.authors[0], today - timedelta(days=2))
+        self.create_post('Soup', 'soup', self.authors[0], today)
+        self.assertEqual(rollup_daily_stats(until=today.date()), 2)
+        self.assertEqual(rolled_up_to(), today.date() - timedelta(days=1))
+        self.assertIsNone(DailyStat.query.filter_by(day=today.date()).first())
@@ -1,10 +1,17 @@
 import re
 import json
+import shutil
+import tempfile
 from base64 import b64encode
 import unittest
+from datetime import date, datetime
 from flask_jwt_extended import create_access_token, get_jwt_identity, verify_jwt_in_request
-from recblog import create_app, db, bcrypt
-from recblog.models import Permission, Role, User, Comment, Post
+from sqlalchemy import event
+from recblog import create_app, db, bcrypt, ingredient_index, content_index
+from recblog.models import Permission, Role, User, Comment, Post, BlacklistToken, FavoritePosts
+from recblog.analytics import rollup_daily_stats
+from recblog.recommendations import build_similar_posts
+from recblog.similarity import build_content_index
 
 
 class APITestCase(unittest.TestCase):
@@ -79,6 +86,19 @@ class APITestCase(unittest.TestCase):
              headers=self.get_api_headers('sue@example.com', 'foam'),)
         self.assertEqual(response.status_code, 401)
 
+    def test_revoked_token(self):
+        u = User(username='Sue', email='sue@example.com', confirmed=True,
+                 password=bcrypt.generate_password_hash('foam').decode('utf-8'))
+        db.session.add(u)
+        db.session.commit()
+        response = self.client.post(f'/api/v1/login', headers=self.get_api_headers('sue@example.com', 'foam'),
+                                    data=json.dumps({'email': 'sue@example.com', 'password': 'foam'}))
+        access_headers = {'Authorization': 'Bearer {}'.format(response.get_json()['access_token'])}
+        self.assertEqual(self.client.get('/api/v1/posts/', headers=access_headers).status_code, 200)
+        self.assertEqual(self.client.delete('/api/v1/logout', headers=access_headers).status_code, 200)
+        self.assertIsNotNone(BlacklistToken.query.one().expires_at)
+        self.assertEqual(self.client.get('/api/v1/posts/', headers=access_headers).status_code, 401)
+
     # test login and authentication
     def test_login_and_authentication(self):
         # add new user
@@ -423,3 +443,395 @@ class APITestCase(unittest.TestCase):
                                     data=json.dumps({'body': 'Very nice post Sue. By ramie@example.com'}))
         self.assertEqual(response.status_code, 401)
 
+
+    # test that the users collection costs the same number of queries for any page size
+    def test_users_collection_query_count(self):
+        password = bcrypt.generate_password_hash('foam').decode('utf-8')
+        users = [User(username=f'user{i}', email=f'user{i}@example.com', password=password, confirmed=True)
+                 for i in range(12)]
+        db.session.add_all(users)
+        db.session.commit()
+        users[1].follow_user(users[0])
+        db.session.add(Post(title='Test recipe', description='Test description', post_image='default.jpg',
+                            portions=2, cook_time=10, type_category='pie', ingredients='flour',
+                            preparation='bake', author=users[0]))
+        db.session.commit()
+        response = self.client.post(f'/api/v1/login', headers=self.get_api_headers('user0@example.com', 'foam'),
+                                    data=json.dumps({'email': 'user0@example.com', 'password': 'foam'}))
+        access_headers = {'Authorization': 'Bearer {}'.format(response.get_json()['access_token'])}
+
+        statements = []
+        def count_statement(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', count_statement)
+        try:
+            response = self.client.get('/api/v1/users/?per_page=2', headers=access_headers)
+            self.assertEqual(response.status_code, 200)
+            small_page_queries = len(statements)
+            del statements[:]
+            response = self.client.get('/api/v1/users/?per_page=12', headers=access_headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(statements), small_page_queries)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count_statement)
+        json_response = json.loads(response.get_data(as_text=True))
+        self.assertEqual(len(json_response['items']), 12)
+        self.assertEqual(json_response['items'][0]['followers_number'], 1)
+        self.assertEqual(json_response['items'][0]['post_count'], 1)
+        self.assertEqual(json_response['items'][1]['followed_number'], 1)
+
+    # test walking the posts list forward and backward with the keyset cursors
+    def test_posts_cursor_pagination(self):
+        self.app.config['MYRECBLOG_POSTS_PER_PAGE'] = 2
+        u = User(username='Sue', email='sue@example.com', confirmed=True,
+                 password=bcrypt.generate_password_hash('foam').decode('utf-8'))
+        db.session.add(u)
+        # two posts share the same date to check the id tie-breaker
+        dates = [datetime(2021, 1, day) for day in (1, 2, 2, 3, 4)]
+        for i, date_posted in enumerate(dates):
+            db.session.add(Post(title=f'Test recipe #{i}', description='Test description', post_image='default.jpg',
+                                portions=2, cook_time=10, type_category='pie', ingredients='flour',
+                                preparation='bake', date_posted=date_posted, author=u))
+        db.session.commit()
+        expected = [post.id for post in Post.query.order_by(Post.date_posted.desc(), Post.id.desc())]
+        response = self.client.post(f'/api/v1/login', headers=self.get_api_headers('sue@example.com', 'foam'),
+                                    data=json.dumps({'email': 'sue@example.com', 'password': 'foam'}))
+        access_headers = {'Authorization': 'Bearer {}'.format(response.get_json()['access_token'])}
+
+        pages = []
+        url = '/api/v1/posts/?cursor='
+        while url:
+            json_response = self.client.get(url, headers=access_headers).get_json()
+            self.assertNotIn('count', json_response)
+            pages.append(json_response)
+            url = json_response['next_url']
+        self.assertEqual(len(pages), 3)
+        self.assertIsNone(pages[0]['prev_cursor'])
+        seen = [int(post['url'].rsplit('/', 1)[1]) for page in pages for post in page['posts']]
+        self.assertEqual(seen, expected)
+
+        # go back from the last page
+        json_response = self.client.get(pages[-1]['prev_url'], headers=access_headers).get_json()
+        self.assertEqual(json_response['posts'], pages[1]['posts'])
+        json_response = self.client.get(json_response['prev_url'], headers=access_headers).get_json()
+        self.assertEqual(json_response['posts'], pages[0]['posts'])
+        self.assertIsNone(json_response['prev_cursor'])
+
+        response = self.client.get('/api/v1/posts/?cursor=broken', headers=access_headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_search(self):
+        self.app.config['MYRECBLOG_POSTS_PER_PAGE'] = 1
+        u = User(username='Sue', email='sue@example.com', confirmed=True,
+                 password=bcrypt.generate_password_hash('foam').decode('utf-8'))
+        db.session.add(u)
+        for title in ('Apple pie', 'Apple crumble', 'Pancakes'):
+            db.session.add(Post(title=title, description='Test description', post_image='default.jpg', portions=2,
+                                cook_time=10, type_category='pie', ingredients='flour', preparation='bake',
+                                author=u))
+        db.session.commit()
+        response = self.client.post(f'/api/v1/login', headers=self.get_api_headers('sue@example.com', 'foam'),
+                                    data=json.dumps({'email': 'sue@example.com', 'password': 'foam'}))
+        access_headers = {'Authorization': 'Bearer {}'.format(response.get_json()['access_token'])}
+
+        json_response = self.client.get('/api/v1/search/?q=apple', headers=access_headers).get_json()
+        self.assertEqual(len(json_response['posts']), 1)
+        self.assertIn('<mark>Apple</mark>', json_response['posts'][0]['snippet'])
+        next_response = self.client.get(json_response['next_url'], headers=access_headers).get_json()
+        self.assertEqual(len(next_response['posts']), 1)
+        self.assertIsNone(next_response['next_url'])
+        self.assertEqual({json_response['posts'][0]['name'], next_response['posts'][0]['name']},
+                         {'Apple pie', 'Apple crumble'})
+        response = self.client.get('/api/v1/search/?q=', headers=access_headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_posts_by_ingredients(self):
+        ingredient_index.clear()
+        u = User(username='Sue', email='sue@example.com', confirmed=True,
+                 password=bcrypt.generate_password_hash('foam').decode('utf-8'))
+        db.session.add(u)
+        for title, ingredients in (('Pancakes', '* flour\n* eggs\n* milk'), ('Omelette', '* eggs\n* chives')):
+            db.session.add(Post(title=title, description='Test description', post_image='default.jpg', portions=2,
+                                cook_time=10, type_category='pie', ingredients=ingredients, preparation='bake',
+                                author=u))
+        db.session.commit()
+        response = self.client.post(f'/api/v1/login', headers=self.get_api_headers('sue@example.com', 'foam'),
+                                    data=json.dumps({'email': 'sue@example.com', 'password': 'foam'}))
+        access_headers = {'Authorization': 'Bearer {}'.format(response.get_json()['access_token'])}
+
+        json_response = self.client.get('/api/v1/recipes/by-ingredients/?have=eggs,milk,butter',
+                                        headers=access_headers).get_json()
+        self.assertEqual(json_response['count'], 2)
+        self.assertEqual([(post['name'], post['coverage'], post['missing']) for post in json_response['posts']],
+                         [('Pancakes', 0.6667, ['flour']), ('Omelette', 0.5, ['chive'])])
+        response = self.client.get('/api/v1/recipes/by-ingredients/', headers=access_headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_posts_time_filters(self):
+        self.app.config['MYRECBLOG_POSTS_PER_PAGE'] = 2
+        u = User(username='Sue', email='sue@example.com', confirmed=True,
+                 password=bcrypt.generate_password_hash('foam').decode('utf-8'))
+        db.session.add(u)
+        for title, cook_time, prep_time in (('Stew', '2 h', '20 min'), ('Salad', '5', '10'), ('Soup', '40 min', None),
+                                            ('Toast', '3', None), ('Bread', 'until golden', None)):
+            db.session.add(Post(title=title, description='Test description', post_image='default.jpg', portions='4',
+                                cook_time=cook_time, prep_time=prep_time, type_category='pie', ingredients='flour',
+                                preparation='bake', author=u))
+        db.session.commit()
+        response = self.client.post(f'/api/v1/login', headers=self.get_api_headers('sue@example.com', 'foam'),
+                                    data=json.dumps({'email': 'sue@example.com', 'password': 'foam'}))
+        access_headers = {'Authorization': 'Bearer {}'.format(response.get_json()['access_token'])}
+
+        names = []
+        url = '/api/v1/posts/?sort=total_time&max_total=60&cursor='
+        while url:
+            json_response = self.client.get(url, headers=access_headers).get_json()
+            names.extend(post['name'] for post in json_response['posts'])
+            url = json_response['next_url']
+        self.assertEqual(names, ['Toast', 'Salad', 'Soup'])
+        json_response = self.client.get('/api/v1/posts/?sort=total_time&page=2',
+                                        headers=access_headers).get_json()
+        self.assertEqual([(post['name'], post['totalMinutes']) for post in json_response['posts']],
+                         [('Soup', 40), ('Stew', 140)])
+        self.assertEqual(json_response['count'], 4)
+        json_response = self.client.get('/api/v1/posts/?min_total=30&max_cook=60',
+                                        headers=access_headers).get_json()
+        self.assertEqual([post['name'] for post in json_response['posts']], ['Soup'])
+        response = self.client.get('/api/v1/posts/?sort=random', headers=access_headers)
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/v1/posts/?max_total=soon', headers=access_headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_conditional_get(self):
+        u = User(username='Sue', email='sue@example.com', confirmed=True,
+                 password=bcrypt.generate_password_hash('foam').decode('utf-8'))
+        post = Post(title='Apple pie', description='Test description', post_image='default.jpg', portions=2,
+                    cook_time=10, type_category='pie', ingredients='flour', preparation='bake', author=u)
+        db.session.add_all([u, post])
+        db.session.commit()
+        response = self.client.post(f'/api/v1/login', headers=self.get_api_headers('sue@example.com', 'foam'),
+                                    data=json.dumps({'email': 'sue@example.com', 'password': 'foam'}))
+        access_headers = {'Authorization': 'Bearer {}'.format(response.get_json()['access_token'])}
+
+        for url in (f'/api/v1/post/{post.id}', '/api/v1/posts/', '/api/v1/posts/?cursor=',
+                    f'/api/v1/user_account/{u.id}', f'/api/v1/post/{post.id}/comments/'):
+            response = self.client.get(url, headers=access_headers)
+            self.assertEqual(response.status_code, 200)
+            etag = response.headers['ETag']
+            response = self.client.get(url, headers=dict(access_headers, **{'If-None-Match': etag}))
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.data, b'')
+            self.assertEqual(response.headers['ETag'], etag)
+
+        response = self.client.get(f'/api/v1/post/{post.id}', headers=access_headers)
+        etag, last_modified = response.headers['ETag'], response.headers['Last-Modified']
+        response = self.client.get(f'/api/v1/post/{post.id}',
+                                   headers=dict(access_headers, **{'If-Modified-Since': last_modified}))
+        self.assertEqual(response.status_code, 304)
+        # a new comment changes the comments counter of the post and so its tag
+        db.session.add(Comment(body='Tasty!', author=u, post=post))
+        db.session.commit()
+        response = self.client.get(f'/api/v1/post/{post.id}', headers=dict(access_headers, **{'If-None-Match': etag}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['comments_count'], 1)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+        comment = Comment.query.first()
+        response = self.client.get(f'/api/v1/comment/{comment.id}', headers=access_headers)
+        etag = response.headers['ETag']
+        comment.body = 'Very tasty!'
+        db.session.commit()
+        response = self.client.get(f'/api/v1/comment/{comment.id}',
+                                   headers=dict(access_headers, **{'If-None-Match': etag}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['body'], 'Very tasty!')
+        response = self.client.get('/api/v1/post/12345', headers=access_headers)
+        self.assertEqual(response.status_code, 404)
+
+    # the user of the token is looked up once per request, whatever the number of permission checks
+    def test_identity_resolved_once_per_request(self):
+        u = User(username='Sue', email='sue@example.com', confirmed=True,
+                 password=bcrypt.generate_password_hash('foam').decode('utf-8'))
+        post = Post(title='Apple pie', description='Test description', post_image='default.jpg', portions=2,
+                    cook_time=10, type_category='pie', ingredients='flour', preparation='bake', author=u)
+        db.session.add_all([u, post])
+        db.session.commit()
+        comment = Comment(body='Tasty!', author=u, post=post)
+        db.session.add(comment)
+        db.session.commit()
+        response = self.client.post(f'/api/v1/login', headers=self.get_api_headers('sue@example.com', 'foam'),
+                                    data=json.dumps({'email': 'sue@example.com', 'password': 'foam'}))
+        access_headers = {'Authorization': 'Bearer {}'.format(response.get_json()['access_token'])}
+
+        statements = []
+        def count_statement(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        requests = [('get', f'/api/v1/post/{post.id}', None),
+                    ('post', f'/api/v1/post/{post.id}/comments/', str({'body': 'Nice'})),
+                    ('put', f'/api/v1/comment/{comment.id}', str({'body': 'Very tasty!'})),
+                    ('put', f'/api/v1/post/{post.id}/like', None),
+                    ('delete', f'/api/v1/post/{post.id}/unlike', None),
+                    ('put', f'/api/v1/user_account/{u.id}', json.dumps({'about_me': 'Cook'})),
+                    ('delete', f'/api/v1/comment/{comment.id}', None)]
+        event.listen(db.engine, 'before_cursor_execute', count_statement)
+        try:
+            for method, url, data in requests:
+                del statements[:]
+                response = getattr(self.client, method)(url, headers=dict(access_headers, **{
+                    'Content-Type': 'application/json'}), data=data)
+                self.assertLess(response.status_code, 300, url)
+                identity_queries = [statement for statement in statements if 'users.email = ' in statement]
+                self.assertEqual(len(identity_queries), 1, f'{method} {url}')
+                self.assertIn('JOIN roles', identity_queries[0])
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count_statement)
+
+    def test_likes_analytics(self):
+        admin_role = Role.query.filter_by(name='Administrator').first()
+        admin = User(username='Sue', email='sue@example.com', confirmed=True, role=admin_role,
+                     password=bcrypt.generate_password_hash('foam').decode('utf-8'))
+        posts = [Post(title=title, description='Test description', post_image='default.jpg', portions=2,
+                      cook_time=10, type_category=category, ingredients='flour', preparation='bake', author=admin)
+                 for title, category in (('Apple pie', 'pie'), ('Soup', 'soup'))]
+        likers = [User(username=f'user{number}', email=f'user{number}@example.com', password='cat')
+                  for number in range(3)]
+        db.session.add_all([admin] + posts + likers)
+        db.session.commit()
+        # the 5th of two months, a day of the month counted for every month before
+        for liker, post, liked_on in ((likers[0], posts[0], datetime(2021, 1, 5, 10)),
+                                      (likers[1], posts[0], datetime(2021, 1, 5, 23, 59)),
+                                      (likers[2], posts[1], datetime(2021, 1, 7)),
+                                      (likers[0], posts[1], datetime(2021, 2, 5)),
+                                      (likers[1], posts[1], datetime(2021, 3, 1))):
+            favorite = FavoritePosts(liker.id, post.id)
+            favorite.date_liked = liked_on
+            db.session.add(favorite)
+        db.session.commit()
+        response = self.client.post(f'/api/v1/login', headers=self.get_api_headers('sue@example.com', 'foam'),
+                                    data=json.dumps({'email': 'sue@example.com', 'password': 'foam'}))
+        access_headers = {'Authorization': 'Bearer {}'.format(response.get_json()['access_token'])}
+
+        statements = []
+        def count_statement(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', count_statement)
+        try:
+            response = self.client.get('/api/v1/analytics/?date_from=2021-01-04&date_to=2021-01-08',
+                                       headers=access_headers)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count_statement)
+        self.assertEqual(response.status_code, 200)
+        json_response = response.get_json()
+        self.assertEqual(json_response['buckets'], ['2021-01-04', '2021-01-05', '2021-01-06', '2021-01-07',
+                                                    '2021-01-08'])
+        self.assertEqual(json_response['series'], {'total': [0, 2, 0, 1, 0]})
+        self.assertEqual(len([statement for statement in statements if 'favorites' in statement]), 1)
+
+        response = self.client.get('/api/v1/analytics/?date_from=2021-01-01&date_to=2021-12-31&interval=month'
+                                   '&group_by=category', headers=access_headers)
+        json_response = response.get_json()
+        self.assertEqual(len(json_response['buckets']), 12)
+        self.assertEqual(json_response['series']['pie'][:3], [2, 0, 0])
+        self.assertEqual(json_response['series']['soup'][:3], [1, 1, 1])
+        self.assertEqual(json_response['total'], 5)
+
+        response = self.client.get('/api/v1/analytics/?date_from=2021-01-01&date_to=2021-01-10&interval=week'
+                                   f'&group_by=post&limit=1', headers=access_headers)
+        json_response = response.get_json()
+        self.assertEqual(json_response['buckets'], ['2020-12-28', '2021-01-04'])
+        self.assertEqual(json_response['series'], {str(posts[0].id): [0, 2]})
+
+        # the range can still come as a JSON body
+        response = self.client.get('/api/v1/analytics/', headers=dict(access_headers, **{
+            'Content-Type': 'application/json'}), data=json.dumps({'date_from': '2021-02-05', 'date_to': '2021-02-05'}))
+        self.assertEqual(response.get_json()['series'], {'total': [1]})
+        for query in ('date_from=2021-01-01', 'date_from=2021-01-05&date_to=2021-01-01',
+                      'date_from=2021-01-01&date_to=2021-01-02&interval=year',
+                      'date_from=2021-01-01&date_to=2021-01-02&group_by=author',
+                      'date_from=9999-12-31&date_to=9999-12-31',
+                      'date_from=9999-12-01&date_to=9999-12-31&interval=month'):
+            response = self.client.get(f'/api/v1/analytics/?{query}', headers=access_headers)
+            self.assertEqual(response.status_code, 400, query)
+
+    def test_daily_stats(self):
+        admin_role = Role.query.filter_by(name='Administrator').first()
+        admin = User(username='Sue', email='sue@example.com', confirmed=True, role=admin_role,
+                     password=bcrypt.generate_password_hash('foam').decode('utf-8'))
+        post = Post(title='Apple pie', description='Test description', post_image='default.jpg', portions=2,
+                    cook_time=10, type_category='pie', ingredients='flour', preparation='bake', author=admin,
+                    date_posted=datetime(2021, 1, 4, 12))
+        db.session.add_all([admin, post])
+        db.session.commit()
+        rollup_daily_stats(until=date(2021, 1, 31))
+        response = self.client.post(f'/api/v1/login', headers=self.get_api_headers('sue@example.com', 'foam'),
+                                    data=json.dumps({'email': 'sue@example.com', 'password': 'foam'}))
+        access_headers = {'Authorization': 'Bearer {}'.format(response.get_json()['access_token'])}
+
+        response = self.client.get('/api/v1/stats/daily/?metric=posts&date_from=2021-01-01&date_to=2021-01-17'
+                                   '&interval=week', headers=access_headers)
+        self.assertEqual(response.status_code, 200)
+        json_response = response.get_json()
+        self.assertEqual(json_response['buckets'], ['2020-12-28', '2021-01-04', '2021-01-11'])
+        self.assertEqual(json_response['series'], {'all': [0, 1, 0]})
+        self.assertEqual(json_response['rolled_up_to'], '2021-01-31')
+        response = self.client.get('/api/v1/stats/top/?metric=posts&dimension=category&date_from=2021-01-01'
+                                   '&date_to=2021-01-31', headers=access_headers)
+        self.assertEqual(response.get_json()['top'], [{'value': 'pie', 'total': 1}])
+        response = self.client.get('/api/v1/stats/daily/?metric=views&date_from=2021-01-01&date_to=2021-01-31',
+                                   headers=access_headers)
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/v1/stats/daily/?metric=posts&date_from=9999-12-01&date_to=9999-12-31'
+                                   '&interval=month', headers=access_headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_suggestions(self):
+        users = [User(username=name, email=f'{name.lower()}@example.com', confirmed=True,
+                      password=bcrypt.generate_password_hash('foam').decode('utf-8')) for name in ('Sue', 'John', 'Ann')]
+        db.session.add_all(users)
+        db.session.commit()
+        users[0].follow_user(users[1])
+        users[1].follow_user(users[2])
+        db.session.commit()
+        response = self.client.post(f'/api/v1/login', headers=self.get_api_headers('sue@example.com', 'foam'),
+                                    data=json.dumps({'email': 'sue@example.com', 'password': 'foam'}))
+        access_headers = {'Authorization': 'Bearer {}'.format(response.get_json()['access_token'])}
+        response = self.client.get('/api/v1/suggestions/', headers=access_headers)
+        self.assertEqual(response.status_code, 200)
+        suggestions = response.get_json()['suggestions']
+        self.assertEqual([(item['username'], item['mutual_follows']) for item in suggestions], [('Ann', 1)])
+
+    def test_similar_posts(self):
+        users = [User(username=name, email=f'{name.lower()}@example.com', confirmed=True,
+                      password=bcrypt.generate_password_hash('foam').decode('utf-8')) for name in ('Sue', 'John')]
+        posts = [Post(title=title, description='Test description', post_image='default.jpg', portions=2,
+                      cook_time=10, type_category='pie', ingredients='flour', preparation='bake', author=users[0])
+                 for title in ('Apple pie', 'Cherry pie', 'Onion soup')]
+        db.session.add_all(users + posts)
+        db.session.commit()
+        db.session.add_all([FavoritePosts(users[0].id, posts[0].id), FavoritePosts(users[0].id, posts[1].id),
+                            FavoritePosts(users[1].id, posts[0].id)])
+        db.session.commit()
+        build_similar_posts()
+        response = self.client.post(f'/api/v1/login', headers=self.get_api_headers('sue@example.com', 'foam'),
+                                    data=json.dumps({'email': 'sue@example.com', 'password': 'foam'}))
+        access_headers = {'Authorization': 'Bearer {}'.format(response.get_json()['access_token'])}
+        response = self.client.get(f'/api/v1/post/{posts[1].id}/similar', headers=access_headers)
+        self.assertEqual(response.status_code, 200)
+        similar = response.get_json()['posts']
+        self.assertEqual([(post['name'], round(post['score'], 3), post['source']) for post in similar],
+                         [('Apple pie', 0.707, 'likes')])
+        response = self.client.get(f'/api/v1/post/{posts[2].id}/similar', headers=access_headers)
+        self.assertEqual(response.get_json()['posts'], [])
+
+        # completed with the content index
+        content_index.directory = tempfile.mkdtemp()
+        try:
+            build_content_index()
+            response = self.client.get(f'/api/v1/post/{posts[1].id}/similar?limit=2', headers=access_headers)
+            similar = response.get_json()['posts']
+            self.assertEqual([(post['name'], post['source']) for post in similar],
+                             [('Apple pie', 'likes'), ('Onion soup', 'content')])
+        finally:
+            shutil.rmtree(content_index.directory, ignore_errors=True)
+        response = self.client.get('/api/v1/post/1000/similar', headers=access_headers)
+        self.assertEqual(response.status_code, 404)
@@ -0,0 +1,222 @@
+import unittest
+from datetime import datetime, timedelta
+from sqlalchemy import event
+from recblog import create_app, db, bcrypt, home_cache, token_blocklist, identity_cache
+from recblog.models import Role, User, Post, BlacklistToken, Permission, load_user
+from recblog.main.routes import carousel_section, latest_section, pie_section
+
+
+class SectionCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.author = User(username='Sue', email='sue@example.com', confirmed=True,
+                           password=bcrypt.generate_password_hash('foam').decode('utf-8'))
+        db.session.add(self.author)
+        db.session.commit()
+
+    def tearDown(self):
+        home_cache.clear()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def create_post(self, title, type_category='pie'):
+        post = Post(title=title, description='Test description', post_image='default.jpg', portions='4',
+                    cook_time='30', type_category=type_category, ingredients='flour', preparation='bake it',
+                    author=self.author)
+        db.session.add(post)
+        db.session.commit()
+        return post
+
+    def test_stale_while_revalidate(self):
+        builds = []
+
+        def builder():
+            builds.append(len(builds))
+            return len(builds)
+
+        self.assertEqual(home_cache.get('section', builder), 1)
+        self.assertEqual(home_cache.get('section', builder), 1)
+        home_cache.invalidate()
+        # the outdated value is served while it is rebuilt in the background
+        self.assertEqual(home_cache.get('section', builder), 1)
+        home_cache.wait()
+        self.assertEqual(home_cache.get('section', builder), 2)
+        self.assertEqual(len(builds), 2)
+        stats = home_cache.stats()
+        self.assertEqual((stats['hits'], stats['stale_hits'], stats['misses']), (2, 1, 1))
+
+    def test_failed_rebuild_keeps_the_stale_value(self):
+        home_cache.get('section', lambda: 'old')
+        home_cache.invalidate()
+
+        def broken():
+            raise RuntimeError('database is gone')
+
+        self.assertEqual(home_cache.get('section', broken), 'old')
+        home_cache.wait()
+        self.assertEqual(home_cache.stats()['refresh_errors'], 1)
+        self.assertEqual(home_cache.get('section', lambda: 'new'), 'old')
+        home_cache.wait()
+        self.assertEqual(home_cache.get('section', lambda: 'newer'), 'new')
+
+    def test_post_changes_invalidate_after_commit(self):
+        generation = home_cache.stats()['generation']
+        post = self.create_post('Apple pie')
+        self.assertEqual(home_cache.stats()['generation'], generation + 1)
+        post.title = 'Cherry pie'
+        db.session.rollback()
+        self.assertEqual(home_cache.stats()['generation'], generation + 1)
+        post.title = 'Cherry pie'
+        db.session.commit()
+        self.assertEqual(home_cache.stats()['generation'], generation + 2)
+        db.session.delete(post)
+        db.session.commit()
+        self.assertEqual(home_cache.stats()['generation'], generation + 3)
+
+    def test_home_sections(self):
+        for title, category in (('Apple pie', 'pie'), ('Soup', 'soup'), ('Cherry pie', 'pie'),
+                                ('Salad', 'salad'), ('Pancakes', 'dessert')):
+            self.create_post(title, category)
+        self.assertEqual([post.title for post in carousel_section()], ['Pancakes', 'Salad', 'Cherry pie'])
+        self.assertEqual([post.title for post in pie_section()], ['Cherry pie', 'Apple pie'])
+        pagination = latest_section(2)
+        self.assertEqual([post.title for post in pagination.items], ['Apple pie'])
+        self.assertEqual((pagination.total, pagination.pages), (5, 2))
+        self.assertEqual(list(pagination.iter_pages()), [1, 2])
+
+
+class TokenBlocklistTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.statements = []
+        event.listen(db.engine, 'before_cursor_execute', self.count_statement)
+
+    def tearDown(self):
+        event.remove(db.engine, 'before_cursor_execute', self.count_statement)
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def count_statement(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def test_revoked_tokens_answered_from_memory(self):
+        token_blocklist.sync_interval = 3600
+        self.assertFalse(token_blocklist.is_revoked('first'))
+        db.session.add(BlacklistToken('first', expires_at=datetime.utcnow() + timedelta(minutes=15)))
+        db.session.commit()
+        del self.statements[:]
+        self.assertTrue(token_blocklist.is_revoked('first'))
+        self.assertFalse(token_blocklist.is_revoked('second'))
+        self.assertEqual(self.statements, [])
+
+    def test_tokens_revoked_by_other_workers(self):
+        token_blocklist.sync_interval = 3600
+        self.assertFalse(token_blocklist.is_revoked('remote'))
+        # a row written by another process does not go through the after commit hook of this one
+        db.session.execute(BlacklistToken.__table__.insert().values(token='remote', blacklisted_on=datetime.now(),
+                                                                    expires_at=datetime.utcnow() + timedelta(hours=1)))
+        db.session.commit()
+        self.assertFalse(token_blocklist.is_revoked('remote'))
+        token_blocklist.sync_interval = 0
+        self.assertTrue(token_blocklist.is_revoked('remote'))
+        self.assertEqual(token_blocklist.stats()['revoked'], 1)
+
+    def test_prune_expired_tokens(self):
+        db.session.add_all([BlacklistToken('expired', expires_at=datetime.utcnow() - timedelta(minutes=1)),
+                            BlacklistToken('valid', expires_at=datetime.utcnow() + timedelta(minutes=15)),
+                            BlacklistToken('legacy')])
+        db.session.commit()
+        db.session.execute(BlacklistToken.__table__.update().where(BlacklistToken.token == 'legacy')
+                           .values(blacklisted_on=datetime.now() - timedelta(days=1)))
+        db.session.commit()
+        self.assertEqual(BlacklistToken.prune(max_age=timedelta(minutes=15)), 2)
+        self.assertEqual([token.token for token in BlacklistToken.query], ['valid'])
+        token_blocklist.sync()
+        self.assertEqual(token_blocklist.stats()['revoked'], 1)
+
+
+class IdentityCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.user = User(username='Sue', email='sue@example.com', confirmed=True,
+                         password=bcrypt.generate_password_hash('foam').decode('utf-8'))
+        db.session.add(self.user)
+        db.session.commit()
+        self.user_id = self.user.id
+        self.statements = []
+        event.listen(db.engine, 'before_cursor_execute', self.count_statement)
+
+    def tearDown(self):
+        event.remove(db.engine, 'before_cursor_execute', self.count_statement)
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def count_statement(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    # every request starts with a new session
+    def load_in_new_session(self):
+        db.session.remove()
+        return load_user(str(self.user_id))
+
+    def test_session_user_and_permissions_from_memory(self):
+        self.load_in_new_session().can(Permission.WRITE)
+        del self.statements[:]
+        user = self.load_in_new_session()
+        self.assertEqual(user.username, 'Sue')
+        self.assertTrue(user.can(Permission.WRITE))
+        self.assertFalse(user.can(Permission.MODERATE))
+        self.assertFalse(user.is_administrator())
+        self.assertEqual(self.statements, [])
+        # the user is part of the session, its relationships still load
+        self.assertEqual(user.posts.count(), 0)
+        self.assertEqual(identity_cache.stats()['hits'], 1)
+
+    def test_committed_changes_are_seen(self):
+        user = self.load_in_new_session()
+        user.role_id = Role.query.filter_by(name='Moderator').first().id
+        db.session.commit()
+        user = self.load_in_new_session()
+        self.assertTrue(user.can(Permission.MODERATE))
+        role = Role.query.filter_by(name='User').first()
+        role.add_permission(Permission.MODERATE)
+        db.session.commit()
+        self.assertTrue(identity_cache.role_permissions(role.id) & Permission.MODERATE)
+        Role.insert_roles()
+        self.assertFalse(identity_cache.role_permissions(role.id) & Permission.MODERATE)
+        user = self.load_in_new_session()
+        user.about_me = 'Bakes bread'
+        db.session.rollback()
+        self.assertIsNone(self.load_in_new_session().about_me)
+
+    def test_new_users_take_the_role_from_memory(self):
+        identity_cache.roles()
+        del self.statements[:]
+        user = User(username='John', email='john@example.com', password='cat')
+        self.assertTrue(user.can(Permission.FOLLOW))
+        self.assertFalse(user.can(Permission.MODERATE))
+        self.assertEqual(self.statements, [])
+
+    def test_snapshots_are_bounded_and_expire(self):
+        identity_cache.size = 1
+        for number in range(2):
+            identity_cache.store_user(number, {'id': number})
+        self.assertIsNone(identity_cache.get_user(0))
+        self.assertEqual(identity_cache.get_user(1), {'id': 1})
+        identity_cache.ttl = 0
+        self.assertIsNone(identity_cache.get_user(1))
+        self.assertEqual(identity_cache.stats()['users'], 0)
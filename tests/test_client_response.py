@@ -1,7 +1,8 @@
 import re
 import unittest
+from jinja2 import ChoiceLoader, DictLoader
 from recblog import create_app, db
-from recblog.models import Permission, Role, User
+from recblog.models import Permission, Role, User, Post
 
 
 
@@ -24,6 +25,23 @@ class FlaskClientTestCase(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertTrue('Newest recipes' in response.get_data(as_text=True))
 
+    def test_home_page_srcset(self):
+        # the layout includes a sidebar template that is not part of the tree
+        self.app.jinja_env.loader = ChoiceLoader([self.app.jinja_env.loader, DictLoader({'_sidebar.html': ''})])
+        author = User(username='Sue', email='sue@example.com', password='cat')
+        posts = [Post(title=f'Pie {number}', description='Sweet', post_image=f'ab/cd/pie{number}.jpg', portions='4',
+                      cook_time='30', type_category='pie', ingredients='flour', preparation='bake it', author=author)
+                 for number in range(3)]
+        for post in posts:
+            post.post_image_widths = '320,640'
+        db.session.add_all([author] + posts)
+        db.session.commit()
+        response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        html = response.get_data(as_text=True)
+        self.assertIn('srcset="/static/uploads/recipes_pics/ab/cd/pie0.320w.webp 320w', html)
+        self.assertEqual(html.count('<picture>'), html.count('type="image/webp"'))
+
 
     def test_register_and_login(self):
         # test of the new account registration
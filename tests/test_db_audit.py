@@ -0,0 +1,29 @@
+import unittest
+from recblog import create_app, db, bcrypt
+from recblog.db_audit import audit_hot_queries
+from recblog.models import Role, User, Post
+
+
+class DBAuditTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_hot_queries_use_indexes(self):
+        u = User(username='Sue', email='sue@example.com', confirmed=True,
+                 password=bcrypt.generate_password_hash('foam').decode('utf-8'))
+        db.session.add(u)
+        db.session.add(Post(title='Test recipe', description='Test description', post_image='default.jpg',
+                            portions=2, cook_time=10, type_category='pie', ingredients='flour', preparation='bake',
+                            author=u))
+        db.session.commit()
+        for name, plan, scans in audit_hot_queries(user_id=u.id):
+            self.assertEqual(scans, [], f'{name} falls back to a full scan: {plan}')
@@ -0,0 +1,206 @@
+import io
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+from recblog import create_app, db, bcrypt, image_processor
+from recblog.models import Role, User, Post, StoredImage
+from recblog.posts.utils import save_picture
+from recblog.posts.forms import PostForm
+from recblog.exceptions import ValidationError
+from recblog.images import check_upload, derivative_name, backfill_derivatives, picture_srcset, is_content_addressed, \
+    collect_garbage, migrate_flat_uploads, record_derivative_widths
+
+
+class ImageProcessingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.upload_dir = tempfile.mkdtemp()
+        self.app.config['MYRECBLOG_UPLOADS_DIR'] = os.path.join(self.upload_dir, 'uploads')
+        self.app.config['MYRECBLOG_RAW_UPLOADS_DIR'] = os.path.join(self.upload_dir, 'raw')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.author = User(username='Sue', email='sue@example.com', confirmed=True,
+                           password=bcrypt.generate_password_hash('foam').decode('utf-8'))
+        db.session.add(self.author)
+        db.session.commit()
+
+    def tearDown(self):
+        image_processor.workers = 0
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.upload_dir)
+
+    def create_post(self, post_image='default.jpg'):
+        post = Post(title='Cake', description='Sweet', post_image=post_image, portions='4', cook_time='30',
+                    type_category='cake', main_ingredient='flour', ingredients='flour', preparation='bake it',
+                    author=self.author)
+        db.session.add(post)
+        db.session.commit()
+        return post
+
+    def upload(self, size=(3000, 2000), filename='cake.png', color='orange'):
+        data = io.BytesIO()
+        Image.new('RGB', size, color).save(data, 'PNG')
+        data.seek(0)
+        return FileStorage(stream=data, filename=filename)
+
+    def test_save_picture_inline(self):
+        post = self.create_post()
+        processed = image_processor.processed
+        picture_fn = save_picture(self.upload(), post.id)
+        self.assertTrue(is_content_addressed(picture_fn))
+        self.assertEqual(image_processor.processed, processed + 1)
+        self.assertEqual(Post.query.get(post.id).post_image, picture_fn)
+        with Image.open(os.path.join(self.app.config['MYRECBLOG_UPLOADS_DIR'], 'recipes_pics', picture_fn)) as image:
+            self.assertEqual(image.size, (1560, 1040))
+        self.assertEqual(os.listdir(self.app.config['MYRECBLOG_RAW_UPLOADS_DIR']), [])
+
+    def test_derivatives_and_srcset(self):
+        self.app.config['MYRECBLOG_IMAGE_WIDTHS'] = (320, 640)
+        post = self.create_post()
+        picture_fn = save_picture(self.upload(size=(800, 400)), post.id)
+        pictures_dir = os.path.join(self.app.config['MYRECBLOG_UPLOADS_DIR'], 'recipes_pics')
+        with Image.open(os.path.join(pictures_dir, derivative_name(picture_fn, 320, 'webp'))) as image:
+            self.assertEqual((image.format, image.size), ('WEBP', (320, 160)))
+        with Image.open(os.path.join(pictures_dir, derivative_name(picture_fn, 640, 'jpg'))) as image:
+            self.assertEqual(image.size, (640, 320))
+            self.assertTrue(image.info.get('progressive'))
+            self.assertNotIn('exif', image.info)
+        post = Post.query.get(post.id)
+        self.assertEqual(post.post_image_widths, '320,640')
+        with self.app.test_request_context():
+            self.assertEqual(picture_srcset(picture_fn, 'jpg', post.post_image_widths),
+                             f'/static/uploads/recipes_pics/{derivative_name(picture_fn, 320, "jpg")} 320w, '
+                             f'/static/uploads/recipes_pics/{derivative_name(picture_fn, 640, "jpg")} 640w')
+            self.assertEqual(picture_srcset('missing.jpg'), '')
+        # another picture has no derivatives yet
+        post.post_image = 'other.jpg'
+        self.assertIsNone(post.post_image_widths)
+        post.post_image = picture_fn
+        db.session.commit()
+
+        # pictures stored before derivatives existed are picked up by the backfill
+        stored = os.path.join(pictures_dir, picture_fn)
+        for name in os.listdir(os.path.dirname(stored)):
+            if name != os.path.basename(stored):
+                os.remove(os.path.join(os.path.dirname(stored), name))
+        self.assertEqual(backfill_derivatives(pictures_dir, (320, 640), workers=1),
+                         {'created': 1, 'skipped': 0, 'failed': 0})
+        self.assertEqual(backfill_derivatives(pictures_dir, (320, 640), workers=1),
+                         {'created': 0, 'skipped': 1, 'failed': 0})
+        self.assertEqual(record_derivative_widths(pictures_dir, (320, 640)), 1)
+        self.assertEqual(Post.query.get(post.id).post_image_widths, '320,640')
+        self.assertEqual(record_derivative_widths(pictures_dir, (320, 640)), 0)
+
+    def test_submit_to_worker_pool(self):
+        image_processor.workers = 1
+        done = threading.Event()
+        raw_path, _ = image_processor.save_raw(self.upload(size=(400, 400)))
+        dest_path = os.path.join(self.upload_dir, 'uploads', 'profile_pics', 'Sue.png')
+        future = image_processor.submit(raw_path, dest_path, (200, 200), done.set)
+        self.assertIsNotNone(future)
+        self.assertTrue(done.wait(30))
+        with Image.open(dest_path) as image:
+            self.assertEqual(image.size, (200, 200))
+        self.assertFalse(os.path.exists(raw_path))
+        self.assertEqual(image_processor.stats()['failed'], 0)
+
+    def test_identical_uploads_share_one_file(self):
+        post, other = self.create_post(), self.create_post()
+        picture_fn = save_picture(self.upload(), post.id)
+        processed = image_processor.processed
+        self.assertEqual(save_picture(self.upload(), other.id), picture_fn)
+        self.assertEqual(image_processor.processed, processed)
+        self.assertEqual(other.post_image, picture_fn)
+        self.assertEqual(StoredImage.query.one().refcount, 2)
+
+    def test_refcounts_and_garbage_collection(self):
+        upload_dir = self.app.config['MYRECBLOG_UPLOADS_DIR']
+        post = self.create_post()
+        first_fn = save_picture(self.upload(size=(800, 400)), post.id)
+        second_fn = save_picture(self.upload(size=(800, 400), color='green'), post.id)
+        self.assertEqual(post.post_image, second_fn)
+        refcounts = dict(db.session.query(StoredImage.path, StoredImage.refcount))
+        self.assertEqual(refcounts, {'recipes_pics/' + first_fn: 0, 'recipes_pics/' + second_fn: 1})
+        # within the grace period nothing is removed
+        self.assertEqual(collect_garbage(upload_dir), 0)
+        self.assertEqual(collect_garbage(upload_dir, grace_seconds=-1), 1)
+        # the picture goes together with its derivatives
+        first_path = os.path.join(upload_dir, 'recipes_pics', first_fn)
+        digest = os.path.basename(os.path.splitext(first_path)[0])
+        self.assertFalse([name for name in os.listdir(os.path.dirname(first_path)) if name.startswith(digest)])
+        db.session.delete(post)
+        db.session.commit()
+        self.assertEqual(StoredImage.query.filter_by(path='recipes_pics/' + second_fn).one().refcount, 0)
+        self.assertEqual(collect_garbage(upload_dir, grace_seconds=-1), 1)
+        self.assertEqual(StoredImage.query.count(), 0)
+
+    def test_migrate_flat_uploads(self):
+        upload_dir = self.app.config['MYRECBLOG_UPLOADS_DIR']
+        os.makedirs(os.path.join(upload_dir, 'recipes_pics'))
+        os.makedirs(os.path.join(upload_dir, 'profile_pics'))
+        Image.new('RGB', (64, 64), 'red').save(os.path.join(upload_dir, 'recipes_pics', '1a2b3c4d5e6f7a8b.jpg'))
+        Image.new('RGB', (64, 64), 'red').save(os.path.join(upload_dir, 'recipes_pics', '1a2b3c4d5e6f7a8b.320w.webp'))
+        Image.new('RGB', (64, 64), 'blue').save(os.path.join(upload_dir, 'profile_pics', 'Sue.png'))
+        posts = [self.create_post('1a2b3c4d5e6f7a8b.jpg'), self.create_post('1a2b3c4d5e6f7a8b.jpg'),
+                 self.create_post('missing.jpg'), self.create_post()]
+        self.author.image_file = 'Sue.png'
+        db.session.commit()
+        self.assertEqual(migrate_flat_uploads(upload_dir), (2, 3))
+        self.assertTrue(is_content_addressed(posts[0].post_image))
+        self.assertEqual(posts[1].post_image, posts[0].post_image)
+        self.assertEqual([posts[2].post_image, posts[3].post_image], ['missing.jpg', 'default.jpg'])
+        self.assertTrue(is_content_addressed(self.author.image_file))
+        stored = os.path.join(upload_dir, 'recipes_pics', posts[0].post_image)
+        self.assertTrue(os.path.isfile(stored))
+        self.assertTrue(os.path.isfile(derivative_name(stored, 320, 'webp')))
+        self.assertEqual(StoredImage.query.filter_by(path='recipes_pics/' + posts[0].post_image).one().refcount, 2)
+        # running it again is a no-op
+        self.assertEqual(migrate_flat_uploads(upload_dir), (0, 0))
+
+    def test_check_upload_limits(self):
+        check_upload(self.upload(size=(400, 300)).stream, 1024 * 1024, 400 * 300)
+        with self.assertRaises(ValidationError):
+            check_upload(self.upload(size=(400, 301)).stream, 1024 * 1024, 400 * 300)
+        with self.assertRaises(ValidationError):
+            check_upload(self.upload(size=(400, 300)).stream, 100, 400 * 300)
+        with self.assertRaises(ValidationError):
+            check_upload(io.BytesIO(b'GIF89a but not really'), 1024 * 1024, 400 * 300)
+        bmp = io.BytesIO()
+        Image.new('RGB', (10, 10)).save(bmp, 'BMP')
+        with self.assertRaisesRegex(ValidationError, 'JPEG, PNG'):
+            check_upload(bmp, 1024 * 1024, 400 * 300)
+
+    def test_oversized_upload_rejected_by_form(self):
+        self.app.config['MYRECBLOG_MAX_IMAGE_PIXELS'] = 1000 * 1000
+        data = {'title': 'Cake', 'description': 'Sweet', 'portions': '4', 'cook_time': '30', 'type_category': 'cake',
+                'main_ingredient': 'flour', 'ingredients': 'flour', 'preparation': 'bake it',
+                'post_picture': (self.upload(size=(2000, 1000)).stream, 'cake.png')}
+        with self.app.test_request_context('/post/new', method='POST', data=data,
+                                           content_type='multipart/form-data'):
+            form = PostForm()
+            self.assertFalse(form.validate_on_submit())
+            self.assertEqual(form.errors, {'post_picture': ['The picture has more than 1 megapixels.']})
+
+    def test_save_raw_stops_at_byte_limit(self):
+        self.app.config['MYRECBLOG_MAX_UPLOAD_BYTES'] = 1024
+        with self.assertRaises(ValidationError):
+            image_processor.save_raw(self.upload(size=(400, 400)))
+        self.assertEqual(os.listdir(self.app.config['MYRECBLOG_RAW_UPLOADS_DIR']), [])
+
+    def test_jpeg_decoded_in_draft_mode(self):
+        data = io.BytesIO()
+        Image.new('RGB', (4000, 3000), 'orange').save(data, 'JPEG')
+        data.seek(0)
+        raw_path, _ = image_processor.save_raw(FileStorage(stream=data, filename='cake.jpg'))
+        dest_path = os.path.join(self.upload_dir, 'cake.jpg')
+        image_processor.submit(raw_path, dest_path, (200, 200), lambda: None)
+        with Image.open(dest_path) as image:
+            self.assertEqual(image.size, (200, 150))
@@ -0,0 +1,89 @@
+import unittest
+from recblog import create_app, db, bcrypt, ingredient_index
+from recblog.models import Role, User, Post, Ingredient, post_ingredients
+from recblog.ingredients import normalize_ingredient, parse_ingredients, reindex_all
+
+
+class IngredientIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        ingredient_index.clear()
+        self.author = User(username='Sue', email='sue@example.com', confirmed=True,
+                           password=bcrypt.generate_password_hash('foam').decode('utf-8'))
+        db.session.add(self.author)
+        db.session.commit()
+
+    def tearDown(self):
+        ingredient_index.clear()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def create_post(self, title, ingredients):
+        post = Post(title=title, description='Test description', post_image='default.jpg', portions='4',
+                    cook_time='30', type_category='pie', main_ingredient='flour', ingredients=ingredients,
+                    preparation='bake it', author=self.author)
+        db.session.add(post)
+        db.session.commit()
+        return post
+
+    def test_normalize_ingredient(self):
+        self.assertEqual(normalize_ingredient('* 2 cups all-purpose Flour, sifted'), 'all-purpose flour')
+        self.assertEqual(normalize_ingredient('3 large eggs (room temperature)'), 'egg')
+        self.assertEqual(normalize_ingredient('1. 200 g of fresh Cherries'), 'cherry')
+        self.assertEqual(normalize_ingredient('- 2 tbsp **butter**, melted'), 'butter')
+        self.assertIsNone(normalize_ingredient('* 1/2 cup'))
+        self.assertEqual(parse_ingredients('flour, sugar, eggs, flour'), ['flour', 'sugar', 'egg'])
+        self.assertEqual(parse_ingredients('* 2 cups flour\n\n* 3 eggs, beaten\n* salt to taste'),
+                         ['flour', 'egg', 'salt'])
+
+    def test_rank_by_coverage(self):
+        pancakes = self.create_post('Pancakes', '* flour\n* eggs\n* milk')
+        bread = self.create_post('Rye bread', '* rye flour\n* water\n* salt\n* yeast')
+        omelette = self.create_post('Omelette', '* eggs\n* milk')
+        self.create_post('Salad', '* tomatoes\n* cucumbers')
+        ranked, total = ingredient_index.rank(['eggs', 'milk', 'flour'])
+        self.assertEqual(total, 3)
+        self.assertEqual([(post_id, coverage, covered) for post_id, coverage, covered, _ in ranked],
+                         [(pancakes.id, 1.0, 3), (omelette.id, 1.0, 2), (bread.id, 0.25, 1)])
+        # a qualified ingredient only covers itself
+        ranked, total = ingredient_index.rank(['rye flour'])
+        self.assertEqual([post_id for post_id, _, _, _ in ranked], [bread.id])
+        self.assertEqual(ingredient_index.rank(['chocolate']), ([], 0))
+
+    def test_incremental_updates(self):
+        pancakes = self.create_post('Pancakes', '* flour\n* eggs\n* milk')
+        self.assertEqual(ingredient_index.rank(['eggs'])[1], 1)
+        # changes after the index was loaded are served from the overlay
+        omelette = self.create_post('Omelette', '* eggs\n* chives')
+        ranked, _ = ingredient_index.rank(['eggs', 'chives'])
+        self.assertEqual([post_id for post_id, _, _, _ in ranked], [omelette.id, pancakes.id])
+        pancakes.ingredients = '* flour\n* water'
+        db.session.commit()
+        self.assertEqual([post_id for post_id, _, _, _ in ingredient_index.rank(['eggs'])[0]], [omelette.id])
+        db.session.delete(omelette)
+        db.session.commit()
+        self.assertEqual(ingredient_index.rank(['eggs']), ([], 0))
+        # rolled back changes never reach the index
+        pancakes.ingredients = '* eggs'
+        db.session.flush()
+        db.session.rollback()
+        self.assertEqual(ingredient_index.rank(['eggs']), ([], 0))
+        # and a rebuild agrees with the overlay
+        ingredient_index.rebuild()
+        self.assertEqual([post_id for post_id, _, _, _ in ingredient_index.rank(['flour'])[0]], [pancakes.id])
+        self.assertEqual(ingredient_index.rank(['eggs']), ([], 0))
+
+    def test_reindex_all(self):
+        post = self.create_post('Pancakes', '* flour\n* eggs')
+        db.session.execute(post_ingredients.delete())
+        db.session.commit()
+        ingredient_index.clear()
+        self.assertEqual(ingredient_index.rank(['eggs']), ([], 0))
+        self.assertEqual(reindex_all(chunk_size=1), 1)
+        self.assertEqual(ingredient_index.rank(['eggs'])[0], [(post.id, 0.5, 1, 2)])
+        self.assertEqual(Ingredient.query.count(), 2)
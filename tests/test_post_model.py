@@ -0,0 +1,140 @@
+import unittest
+from recblog import create_app, db, bcrypt, md_renderer
+from recblog.models import Role, User, Post, Comment, FavoritePosts
+from recblog.rendering import rerender_all
+from recblog.quantities import parse_minutes, parse_count
+
+
+class PostModelTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.author = User(username='Sue', email='sue@example.com', confirmed=True,
+                           password=bcrypt.generate_password_hash('foam').decode('utf-8'))
+        self.reader = User(username='Ramie', email='ramie@example.com', confirmed=True,
+                           password=bcrypt.generate_password_hash('dentas').decode('utf-8'))
+        db.session.add_all([self.author, self.reader])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def create_post(self, title='Test recipe', **kwargs):
+        fields = dict(title=title, description='Test description', post_image='default.jpg', portions='4',
+                      cook_time='30', type_category='pie', main_ingredient='flour', ingredients='flour',
+                      preparation='bake it', author=self.author)
+        fields.update(kwargs)
+        post = Post(**fields)
+        db.session.add(post)
+        db.session.commit()
+        return post
+
+    def test_counters_follow_comments_and_favorites(self):
+        post = self.create_post()
+        self.assertEqual(post.comments_count, 0)
+        self.assertEqual(post.favored_count, 0)
+        comment = Comment(body='Tasty!', author=self.reader, post=post)
+        db.session.add_all([comment, Comment(body='Indeed', author=self.author, post=post),
+                            FavoritePosts(self.reader.id, post.id)])
+        db.session.commit()
+        self.assertEqual(post.comments_count, 2)
+        self.assertEqual(post.favored_count, 1)
+        db.session.delete(comment)
+        post.delete_post_from_favorites(self.reader.id)
+        db.session.commit()
+        self.assertEqual(post.comments_count, 1)
+        self.assertEqual(post.favored_count, 0)
+
+    def test_reconcile_counters(self):
+        post = self.create_post()
+        db.session.add(Comment(body='Tasty!', author=self.reader, post=post))
+        db.session.commit()
+        db.session.execute(Post.__table__.update().values(comments_count=5, favored_count=3))
+        db.session.commit()
+        self.assertEqual(Post.reconcile_counters(), [(post.id, 5, 1, 3, 0)])
+        Post.reconcile_counters(fix=True)
+        self.assertEqual(Post.reconcile_counters(), [])
+        self.assertEqual(post.comments_count, 1)
+        self.assertEqual(post.favored_count, 0)
+
+    def test_markdown_rendered_only_on_change(self):
+        post = self.create_post(ingredients='* flour\n* eggs')
+        self.assertEqual(post.ingredients_html, '<ul>\n<li>flour</li>\n<li>eggs</li>\n</ul>')
+        misses = md_renderer.misses
+        post.ingredients = '* flour\n* eggs'
+        post.preparation = 'bake it'
+        self.assertEqual(md_renderer.misses, misses)
+        post.preparation = 'Visit http://example.com <script>x</script>'
+        self.assertEqual(post.preparation_html, '<p>Visit <a href="http://example.com" rel="nofollow">'
+                                                'http://example.com</a> x</p>')
+        # the same source rendered for another post comes from the cache
+        other = self.create_post(ingredients='* flour\n* eggs')
+        self.assertEqual(other.ingredients_html, post.ingredients_html)
+        self.assertEqual(md_renderer.misses, misses + 1)
+
+    def test_rerender_all(self):
+        post = self.create_post(ingredients='**flour**')
+        db.session.add(Comment(body='*Tasty*', author=self.reader, post=post))
+        db.session.commit()
+        db.session.execute(Post.__table__.update().values(ingredients_html='', preparation_html=''))
+        db.session.execute(Comment.__table__.update().values(body_html=''))
+        db.session.commit()
+        self.assertEqual(rerender_all(workers=1), 2)
+        self.assertEqual(post.ingredients_html, '<p><strong>flour</strong></p>')
+        self.assertEqual(post.preparation_html, '<p>bake it</p>')
+        self.assertEqual(Comment.query.first().body_html, '<p><em>Tasty</em></p>')
+
+    def test_parse_quantities(self):
+        self.assertEqual(parse_minutes('30'), 30)
+        self.assertEqual(parse_minutes('1 h 20 min'), 80)
+        self.assertEqual(parse_minutes('1h20'), 80)
+        self.assertEqual(parse_minutes('1 1/2 hours'), 90)
+        self.assertEqual(parse_minutes('½ hour'), 30)
+        self.assertEqual(parse_minutes('PT1H20M'), 80)
+        self.assertEqual(parse_minutes('1:30'), 90)
+        self.assertEqual(parse_minutes('0:45'), 45)
+        self.assertEqual(parse_minutes('20-30 min'), 30)
+        self.assertEqual(parse_minutes('after 24 hour in the fridge'), 1440)
+        self.assertIsNone(parse_minutes('After stops bubbling'))
+        self.assertIsNone(parse_minutes(''))
+        self.assertEqual(parse_count('4-6 servings'), 4)
+        self.assertIsNone(parse_count('some'))
+        # mixed numbers are summed before rounding half up
+        self.assertEqual(parse_minutes('2 1/2'), 3)
+        self.assertEqual(parse_count('2 1/2'), 3)
+        # zero denominators and values out of range
+        self.assertIsNone(parse_minutes('1/0 h'))
+        self.assertIsNone(parse_count('1/0'))
+        self.assertIsNone(parse_minutes('99999999999999999999 min'))
+        self.assertIsNone(parse_minutes('PT99999999999H'))
+        self.assertIsNone(parse_count('99999999999999999999'))
+
+    def test_quantities_parsed_on_save(self):
+        post = self.create_post(cook_time='1 h', prep_time='15 min', portions='6')
+        self.assertEqual((post.cook_minutes, post.prep_minutes, post.total_minutes, post.portions_count),
+                         (60, 15, 75, 6))
+        post.ready = '2 hours'
+        db.session.commit()
+        self.assertEqual(post.total_minutes, 120)
+        post.ready = ''
+        post.cook_time = 'a while'
+        db.session.commit()
+        self.assertEqual((post.cook_minutes, post.total_minutes), (None, 15))
+        post.cook_time = '1/0 h'
+        post.portions = '99999999999999999999'
+        db.session.commit()
+        self.assertEqual((post.cook_minutes, post.total_minutes, post.portions_count), (None, 15, None))
+
+    def test_backfill_quantities(self):
+        post = self.create_post(cook_time='45', prep_time='1 h')
+        db.session.execute(Post.__table__.update().values(cook_minutes=None, prep_minutes=None, total_minutes=None,
+                                                          portions_count=None))
+        db.session.commit()
+        self.assertEqual(Post.backfill_quantities(chunk_size=1), 1)
+        self.assertEqual((post.cook_minutes, post.prep_minutes, post.total_minutes, post.portions_count),
+                         (45, 60, 105, 4))
@@ -0,0 +1,91 @@
+import unittest
+from datetime import datetime, timedelta
+from recblog import create_app, db, bcrypt
+from recblog.models import Role, User, Post, FavoritePosts, PostSimilar, RollupWatermark
+from recblog.recommendations import POST_SIMILAR, like_matrix, load_likes, build_similar_posts
+
+
+class SimilarPostsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.users = [User(username=name, email=f'{name.lower()}@example.com', confirmed=True,
+                           password=bcrypt.generate_password_hash('foam').decode('utf-8'))
+                      for name in ('Sue', 'John', 'Ann', 'Bob')]
+        self.posts = [Post(title=title, description='Test description', post_image='default.jpg', portions='4',
+                           cook_time='30', type_category='pie', ingredients='flour', preparation='bake it',
+                           author=self.users[0])
+                      for title in ('Apple pie', 'Cherry pie', 'Onion soup', 'Leek soup')]
+        db.session.add_all(self.users + self.posts)
+        db.session.commit()
+        self.user_ids = [user.id for user in self.users]
+        self.post_ids = [post.id for post in self.posts]
+        sue, john, ann, bob = self.user_ids
+        apple, cherry, onion, leek = self.post_ids
+        self.like((sue, apple), (sue, cherry), (john, apple), (john, cherry), (john, onion), (ann, onion),
+                  (ann, leek))
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def like(self, *likes):
+        db.session.add_all([FavoritePosts(user_id, post_id) for user_id, post_id in likes])
+        db.session.commit()
+
+    def similar(self, post_id):
+        return [(similar.title, round(score, 3)) for similar, score in PostSimilar.similar_posts(post_id, 10)]
+
+    def test_like_matrix(self):
+        liker_ids, post_ids = load_likes(chunk_size=3)
+        self.assertEqual(len(liker_ids), 7)
+        matrix, users, posts = like_matrix(liker_ids, post_ids)
+        self.assertEqual(matrix.shape, (3, 4))
+        self.assertEqual(users.tolist(), self.user_ids[:3])
+        self.assertEqual(posts.tolist(), self.post_ids)
+        self.assertEqual(matrix.sum(), 7)
+
+    def test_build_similar_posts(self):
+        apple, cherry, onion, leek = self.post_ids
+        self.assertEqual(build_similar_posts(), 4)
+        # cosine of the likers: both likers of the apple pie liked the cherry pie, one of them the onion soup
+        self.assertEqual(self.similar(apple), [('Cherry pie', 1.0), ('Onion soup', 0.5)])
+        self.assertEqual(self.similar(onion), [('Leek soup', 0.707), ('Apple pie', 0.5), ('Cherry pie', 0.5)])
+        self.assertEqual(self.similar(leek), [('Onion soup', 0.707)])
+        self.assertIsNotNone(RollupWatermark.query.get(POST_SIMILAR))
+
+        # top_k and min_common
+        build_similar_posts(top_k=1, min_common=2, full=True)
+        self.assertEqual(self.similar(apple), [('Cherry pie', 1.0)])
+        self.assertEqual(self.similar(onion), [])
+
+    def test_incremental_refresh(self):
+        apple, cherry, onion, leek = self.post_ids
+        build_similar_posts()
+        # likes of the previous days
+        for favorite in FavoritePosts.query:
+            favorite.date_liked = datetime.utcnow() - timedelta(days=10)
+        RollupWatermark.query.get(POST_SIMILAR).rolled_up_to = (datetime.utcnow() - timedelta(days=5)).date()
+        db.session.commit()
+        # Bob likes the leek soup today: the onion soup was not liked by Bob but shares Ann with the leek soup,
+        # whose number of likers changed, so its neighbours are computed again
+        self.like((self.user_ids[3], leek))
+        self.assertEqual(build_similar_posts(), 2)
+        self.assertEqual(self.similar(leek), [('Onion soup', 0.5)])
+        self.assertEqual(self.similar(onion), [('Apple pie', 0.5), ('Cherry pie', 0.5), ('Leek soup', 0.5)])
+        # no liker in common with the leek soup
+        self.assertEqual(self.similar(apple), [('Cherry pie', 1.0), ('Onion soup', 0.5)])
+
+    def test_deleted_post(self):
+        apple, cherry, onion, leek = self.post_ids
+        build_similar_posts()
+        FavoritePosts.query.filter_by(post_id=cherry).delete()
+        db.session.delete(Post.query.get(cherry))
+        db.session.commit()
+        self.assertEqual(PostSimilar.query.filter((PostSimilar.post_id == cherry) |
+                                                  (PostSimilar.similar_post_id == cherry)).count(), 0)
+        self.assertEqual(self.similar(apple), [('Onion soup', 0.5)])
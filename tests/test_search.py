@@ -0,0 +1,77 @@
+import unittest
+from recblog import create_app, db, bcrypt
+from recblog.models import Role, User, Post
+from recblog.search import search_posts, rebuild_index, match_expression
+from recblog.exceptions import ValidationError
+
+
+class SearchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.author = User(username='Sue', email='sue@example.com', confirmed=True,
+                           password=bcrypt.generate_password_hash('foam').decode('utf-8'))
+        db.session.add(self.author)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def create_post(self, title, description='Test description', ingredients='flour', preparation='bake it'):
+        post = Post(title=title, description=description, post_image='default.jpg', portions='4', cook_time='30',
+                    type_category='pie', main_ingredient='flour', ingredients=ingredients, preparation=preparation,
+                    author=self.author)
+        db.session.add(post)
+        db.session.commit()
+        return post
+
+    def test_match_expression(self):
+        self.assertEqual(match_expression('apple pie'), '"apple" "pie"')
+        self.assertEqual(match_expression('apple OR "pie" NEAR(x'), '"apple" "OR" "pie" "NEAR" "x"')
+        with self.assertRaises(ValidationError):
+            search_posts(' -- ')
+
+    def test_ranking_and_snippets(self):
+        in_preparation = self.create_post('Crumble', preparation='Slice the apples, cover with <b>crumbs</b>')
+        in_title = self.create_post('Apple pie', ingredients='apples, flour, butter')
+        self.create_post('Pancakes')
+        results, next_cursor = search_posts('apples')
+        self.assertEqual([post for post, _ in results], [in_title, in_preparation])
+        self.assertIsNone(next_cursor)
+        # stemmed match, highlighted and escaped
+        self.assertEqual(str(results[1][1]), 'Slice the <mark>apples</mark>, cover with &lt;b&gt;crumbs&lt;/b&gt;')
+        self.assertEqual([post for post, _ in search_posts('apple butter')[0]], [in_title])
+
+    def test_index_follows_changes(self):
+        post = self.create_post('Apple pie')
+        post.title = 'Cherry pie'
+        db.session.commit()
+        self.assertEqual(search_posts('apple')[0], [])
+        self.assertEqual([post for post, _ in search_posts('cherry')[0]], [post])
+        db.session.delete(post)
+        db.session.commit()
+        self.assertEqual(search_posts('cherry')[0], [])
+
+    def test_cursor_pagination(self):
+        posts = [self.create_post(f'Soup {i}') for i in range(5)]
+        seen = []
+        cursor = None
+        while True:
+            results, cursor = search_posts('soup', cursor, per_page=2)
+            seen.extend(post for post, _ in results)
+            if cursor is None:
+                break
+        self.assertEqual(sorted(post.id for post in seen), [post.id for post in posts])
+
+    def test_rebuild_index(self):
+        self.create_post('Apple pie')
+        db.session.execute(db.text("INSERT INTO posts_fts(posts_fts) VALUES('delete-all')"))
+        db.session.commit()
+        self.assertEqual(search_posts('apple')[0], [])
+        self.assertEqual(rebuild_index(), 1)
+        self.assertEqual(len(search_posts('apple')[0]), 1)
@@ -0,0 +1,38 @@
+import json
+import unittest
+from datetime import datetime, timezone, timedelta
+from markupsafe import Markup
+from flask import jsonify
+from recblog import create_app
+from recblog.serialization import dumps, init_json, orjson
+
+
+class SerializationTestCase(unittest.TestCase):
+    def test_datetimes_are_iso_8601_utc(self):
+        value = {'naive': datetime(2021, 3, 4, 5, 6, 7), 'micro': datetime(2021, 3, 4, 5, 6, 7, 890),
+                 'utc': datetime(2021, 3, 4, 5, 6, 7, tzinfo=timezone.utc),
+                 'aware': datetime(2021, 3, 4, 7, 6, 7, tzinfo=timezone(timedelta(hours=2))),
+                 'html': Markup('<p>x</p>')}
+        expected = {'naive': '2021-03-04T05:06:07Z', 'micro': '2021-03-04T05:06:07.000890Z',
+                    'utc': '2021-03-04T05:06:07Z', 'aware': '2021-03-04T07:06:07+02:00', 'html': '<p>x</p>'}
+        self.assertEqual(json.loads(dumps(value, backend='stdlib')), expected)
+        self.assertEqual(json.loads(dumps(value)), expected)
+
+    def test_fallback_to_stdlib(self):
+        # orjson refuses integers above 64 bits
+        self.assertEqual(dumps({'big': 2 ** 70}), '{"big": 1180591620717411303424}')
+        with self.assertRaises(TypeError):
+            dumps({'set': {1}})
+
+    def test_app_backends(self):
+        for backend in ('stdlib', 'auto'):
+            app = create_app('testing')
+            app.config['MYRECBLOG_JSON_BACKEND'] = backend
+            used = init_json(app)
+            self.assertEqual(used, 'stdlib' if backend == 'stdlib' or orjson is None else 'orjson')
+            with app.test_request_context():
+                response = jsonify({'date_posted': datetime(2021, 1, 2, 3, 4, 5)})
+            self.assertEqual(response.get_json(), {'date_posted': '2021-01-02T03:04:05Z'})
+        app.config['MYRECBLOG_JSON_BACKEND'] = 'fastest'
+        with self.assertRaises(ValueError):
+            init_json(app)
@@ -0,0 +1,107 @@
+import os
+import shutil
+import tempfile
+import unittest
+from recblog import create_app, db, bcrypt, content_index
+from recblog.models import Role, User, Post, FavoritePosts
+from recblog.similarity import ContentIndex, recipe_terms, build_content_index, similar_recipes
+
+
+class ContentIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.index_dir = tempfile.mkdtemp()
+        content_index.directory = self.index_dir
+        self.user = User(username='Sue', email='sue@example.com', confirmed=True,
+                         password=bcrypt.generate_password_hash('foam').decode('utf-8'))
+        db.session.add(self.user)
+        self.posts = [self.create_post(*recipe) for recipe in (
+            ('Apple pie', '- 3 apples\n- 200 g flour\n- 100 g butter\n- sugar', 'apple'),
+            ('Apple crumble', '- 4 apples\n- 100 g flour\n- 100 g butter\n- cinnamon', 'apple'),
+            ('Cherry pie', '- 300 g cherries\n- 200 g flour\n- 100 g butter\n- sugar', 'cherry'),
+            ('Onion soup', '- 4 onions\n- 1 l beef stock\n- 50 g butter\n- thyme', 'onion'))]
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.index_dir, ignore_errors=True)
+
+    def create_post(self, title, ingredients, main_ingredient):
+        post = Post(title=title, description='Test description', post_image='default.jpg', portions='4',
+                    cook_time='30', type_category='dessert', ingredients=ingredients, preparation='cook it',
+                    main_ingredient=main_ingredient, author=self.user)
+        db.session.add(post)
+        db.session.commit()
+        return post
+
+    def similar(self, post, limit=10):
+        return [(similar.title, score) for similar, score in similar_recipes(post, limit)]
+
+    def test_recipe_terms(self):
+        self.assertEqual(recipe_terms('Apple pies', '- 3 apples\n- 200 g rye flour', 'Apples'),
+                         ['apple', 'pie', 'i:apple', 'apple', 'i:rye flour', 'rye', 'flour', 'i:apple', 'i:apple'])
+
+    def test_similar_recipes(self):
+        apple_pie, apple_crumble, cherry_pie, onion_soup = self.posts
+        self.assertEqual(self.similar(apple_pie), [])
+        self.assertEqual(build_content_index(), 4)
+        similar = self.similar(apple_pie)
+        self.assertEqual([title for title, _ in similar], ['Apple crumble', 'Cherry pie', 'Onion soup'])
+        self.assertTrue(1 > similar[0][1] > similar[1][1] > similar[2][1] > 0)
+        # the soup only shares the butter with the pies
+        self.assertLess(self.similar(onion_soup, 1)[0][1], 0.1)
+        self.assertEqual(content_index.stats()['posts'], 4)
+
+        # deleted posts are left out
+        db.session.delete(apple_crumble)
+        db.session.commit()
+        self.assertEqual([title for title, _ in self.similar(apple_pie)], ['Cherry pie', 'Onion soup'])
+
+    def test_incremental_build(self):
+        apple_pie = self.posts[0]
+        build_content_index()
+        # a new post is vectorized when it is looked up, it is a candidate once it is indexed
+        tart = self.create_post('Apple tart', '- 3 apples\n- 100 g butter\n- 200 g flour\n- sugar', 'apple')
+        self.assertEqual([title for title, _ in self.similar(tart, 1)], ['Apple pie'])
+        self.assertNotIn('Apple tart', [title for title, _ in self.similar(apple_pie)])
+
+        # posts whose counters only changed are not indexed again
+        db.session.add(FavoritePosts(self.user.id, apple_pie.id))
+        db.session.commit()
+        self.assertEqual(build_content_index(), 1)
+        self.assertEqual(content_index.stats()['delta_posts'], 1)
+        self.assertEqual([title for title, _ in self.similar(apple_pie, 1)], ['Apple tart'])
+
+        # a changed post is looked up with its new vector
+        apple_pie.ingredients = '- 4 onions\n- 1 l beef stock\n- 50 g butter\n- thyme'
+        apple_pie.main_ingredient = 'onion'
+        db.session.commit()
+        self.assertEqual(build_content_index(), 2)
+        self.assertEqual([title for title, _ in self.similar(self.posts[3], 1)], ['Apple pie'])
+
+        # a full build merges the delta into the base
+        self.assertEqual(build_content_index(full=True), 5)
+        self.assertEqual(content_index.stats()['delta_posts'], 0)
+
+    def test_replaced_segments(self):
+        apple_pie = self.posts[0]
+        build_content_index()
+        replaced = content_index.read_manifest()
+        build_content_index(full=True)
+        manifest = content_index.read_manifest()
+        # a worker that read the previous manifest can still map its segment
+        self.assertIn(replaced['base'], manifest['retired'])
+        self.assertTrue(os.path.isdir(os.path.join(self.index_dir, replaced['base'])))
+
+        # a manifest naming segments removed in the meantime is read again
+        worker = ContentIndex()
+        worker.directory, worker.check_interval = self.index_dir, 0
+        manifests = [dict(manifest, base='base-removed'), manifest]
+        worker.read_manifest = lambda: manifests.pop(0)
+        self.assertEqual(worker.similar(apple_pie, 1), content_index.similar(apple_pie, 1))
+        self.assertEqual(worker.loads, 1)
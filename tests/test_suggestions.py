@@ -0,0 +1,75 @@
+import unittest
+from sqlalchemy import event
+from recblog import create_app, db, bcrypt, follow_graph
+from recblog.models import Role, User, Post, FavoritePosts
+from recblog.graph import suggested_users
+
+
+class FollowGraphTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.users = [User(username=name, email=f'{name.lower()}@example.com', confirmed=True,
+                           password=bcrypt.generate_password_hash('foam').decode('utf-8'))
+                      for name in ('Sue', 'John', 'Ann', 'Bob', 'Eve', 'Dan')]
+        db.session.add_all(self.users)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def follow(self, follower, *followed):
+        for user in followed:
+            follower.follow_user(user)
+        db.session.commit()
+
+    def create_post(self, author):
+        post = Post(title='Apple pie', description='Test description', post_image='default.jpg', portions='4',
+                    cook_time='30', type_category='pie', ingredients='flour', preparation='bake it', author=author)
+        db.session.add(post)
+        db.session.commit()
+        return post
+
+    def test_friends_of_friends(self):
+        sue, john, ann, bob, eve, dan = self.users
+        self.follow(sue, john, ann)
+        self.follow(john, bob, eve, sue)
+        self.follow(ann, bob)
+        self.assertEqual(follow_graph.suggest(sue.id), [(bob.id, 2.0, 2, 0), (eve.id, 1.0, 1, 0)])
+        self.assertEqual(follow_graph.suggest(dan.id), [])
+
+        # committed follows are seen without a rebuild or any query
+        statements = []
+        def count_statement(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        self.follow(sue, bob)
+        sue.stop_follow_user(john)
+        db.session.commit()
+        self.follow(ann, dan)
+        sue_id, dan_id = sue.id, dan.id
+        event.listen(db.engine, 'before_cursor_execute', count_statement)
+        try:
+            self.assertEqual(follow_graph.suggest(sue_id), [(dan_id, 1.0, 1, 0)])
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count_statement)
+        self.assertEqual(statements, [])
+        self.assertEqual(follow_graph.stats()['rebuilds'], 1)
+        follow_graph.rebuild()
+        self.assertEqual(follow_graph.suggest(sue.id), [(dan.id, 1.0, 1, 0)])
+        self.assertEqual(follow_graph.stats()['overlay'], 0)
+
+    def test_co_liked_authors(self):
+        sue, john, ann, bob, eve, dan = self.users
+        bob_post, eve_post, dan_post = self.create_post(bob), self.create_post(eve), self.create_post(dan)
+        # sue and john both like bob, john also likes eve
+        db.session.add_all([FavoritePosts(sue.id, bob_post.id), FavoritePosts(john.id, bob_post.id),
+                            FavoritePosts(john.id, eve_post.id), FavoritePosts(ann.id, dan_post.id)])
+        db.session.commit()
+        self.follow(sue, bob)
+        self.assertEqual(follow_graph.suggest(sue.id), [(eve.id, 0.5, 0, 1)])
+        self.assertEqual([(user.username, item[1]) for user, item in suggested_users(sue.id)], [('Eve', 0.5)])
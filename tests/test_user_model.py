@@ -1,8 +1,8 @@
 import unittest
 import time
-from datetime import datetime
-from recblog import create_app, db, bcrypt
-from recblog.models import User, AnonymousUser, Role, Permission, Follow
+from datetime import datetime, timedelta
+from recblog import create_app, db, bcrypt, last_seen_buffer
+from recblog.models import User, AnonymousUser, Role, Permission, Follow, Post, TimelineEntry
 
 class UserModeltestCase(unittest.TestCase):
     def setUp(self):
@@ -174,6 +174,42 @@ class UserModeltestCase(unittest.TestCase):
         u.ping()
         self.assertTrue(u.last_seen > last_seen_before)
 
+    def test_ping_is_written_behind(self):
+        self.app.config['MYRECBLOG_LAST_SEEN_FLUSH_INTERVAL'] = 3600
+        self.app.config['MYRECBLOG_LAST_SEEN_FLUSH_SIZE'] = 2
+        last_seen_buffer.init_app(self.app)
+        long_ago = datetime.utcnow() - timedelta(hours=1)
+        users = [User(username=name, email=f'{name}@example.com', last_seen=long_ago,
+                      password=bcrypt.generate_password_hash('plant0').decode('utf-8')) for name in ('Ann', 'Bob')]
+        db.session.add_all(users)
+        db.session.commit()
+        users[0].ping()
+        self.assertFalse(db.session.dirty)
+        self.assertEqual(db.session.query(User.last_seen).filter_by(id=users[0].id).scalar(), long_ago)
+        # a user seen a moment ago is not buffered again
+        users[0].ping()
+        self.assertEqual(last_seen_buffer.stats()['pending'], 1)
+        # the second waiting user fills the batch
+        users[1].ping()
+        self.assertEqual(last_seen_buffer.stats()['pending'], 0)
+        db.session.expire_all()
+        for user in users:
+            self.assertTrue((datetime.utcnow() - user.last_seen).total_seconds() < 3)
+        self.assertEqual(last_seen_buffer.stats()['written'], 2)
+
+    def test_buffered_ping_never_goes_back(self):
+        self.app.config['MYRECBLOG_LAST_SEEN_FLUSH_INTERVAL'] = 3600
+        last_seen_buffer.init_app(self.app)
+        u = User(username='Elisa', email='elisa@example.com',
+                 password=bcrypt.generate_password_hash('plant0').decode('utf-8'))
+        db.session.add(u)
+        db.session.commit()
+        last_seen_buffer.touch(u.id, u.last_seen - timedelta(hours=1))
+        self.assertEqual(last_seen_buffer.flush(), 1)
+        last_seen = u.last_seen
+        db.session.expire_all()
+        self.assertEqual(u.last_seen, last_seen)
+
     def test_follows(self):
         u1 = User(username='Sam', email='sam@example.com', confirmed=True,
                  password=bcrypt.generate_password_hash('Lylah').decode('utf-8'))
@@ -218,6 +254,70 @@ class UserModeltestCase(unittest.TestCase):
         db.session.commit()
         self.assertTrue(Follow.query.count() == 1)
 
+    def create_post(self, title, author, posted_on):
+        post = Post(title=title, description='Test description', post_image='default.jpg', portions='4',
+                    cook_time='30', type_category='pie', ingredients='flour', preparation='bake it',
+                    author=author, date_posted=posted_on)
+        db.session.add(post)
+        db.session.commit()
+        return post
+
+    def test_timeline(self):
+        u1, u2, u3 = [User(username=name, email=f'{name.lower()}@example.com', confirmed=True,
+                           password=bcrypt.generate_password_hash('Lylah').decode('utf-8'))
+                      for name in ('Sam', 'Frank', 'Bonnie')]
+        db.session.add_all([u1, u2, u3])
+        db.session.commit()
+        old = self.create_post('Old pie', u2, datetime(2021, 1, 1))
+        # the earlier posts of an author are added on follow, new ones when they are published
+        u1.follow_user(u2)
+        u1.follow_user(u3)
+        db.session.commit()
+        new = self.create_post('New pie', u3, datetime(2021, 1, 3))
+        newer = self.create_post('Newer pie', u2, datetime(2021, 1, 4))
+        self.assertEqual(u1.timeline(10), [newer, new, old])
+        self.assertEqual(u1.timeline(10), u1.followed_posts.order_by(Post.date_posted.desc()).all())
+        self.assertEqual(u1.timeline(1, bound=(new.date_posted, new.id)), [old])
+        self.assertEqual(u1.timeline(2, bound=(old.date_posted, old.id), ascending=True), [new, newer])
+        page = u1.timeline_page(2, 2)
+        self.assertEqual((page.items, page.total, page.pages), ([old], 3, 2))
+        self.assertEqual(u2.timeline(10), [])
+        u1.stop_follow_user(u2)
+        db.session.commit()
+        self.assertEqual(u1.timeline(10), [new])
+        db.session.delete(new)
+        db.session.commit()
+        self.assertEqual(TimelineEntry.query.count(), 0)
+
+    def test_timeline_pulls_popular_authors(self):
+        self.app.config['MYRECBLOG_TIMELINE_FANOUT_LIMIT'] = 2
+        u1, u2, u3 = [User(username=name, email=f'{name.lower()}@example.com', confirmed=True,
+                           password=bcrypt.generate_password_hash('Lylah').decode('utf-8'))
+                      for name in ('Sam', 'Frank', 'Bonnie')]
+        db.session.add_all([u1, u2, u3])
+        db.session.commit()
+        first = self.create_post('First pie', u3, datetime(2021, 1, 1))
+        u1.follow_user(u3)
+        db.session.commit()
+        self.assertEqual(TimelineEntry.query.filter_by(author_id=u3.id).count(), 1)
+        # the second follower makes u3 popular, its posts are then read from posts and not copied
+        u2.follow_user(u3)
+        db.session.commit()
+        self.assertTrue(User.query.get(u3.id).timeline_pull)
+        self.assertEqual(TimelineEntry.query.filter_by(author_id=u3.id).count(), 0)
+        second = self.create_post('Second pie', u3, datetime(2021, 1, 2))
+        own = self.create_post('Own pie', u2, datetime(2021, 1, 3))
+        u1.follow_user(u2)
+        db.session.commit()
+        self.assertEqual(TimelineEntry.query.count(), 1)
+        self.assertEqual(u1.timeline(10), [own, second, first])
+        self.assertEqual(u1.timeline(1, offset=1), [second])
+        self.assertEqual(u1.timeline_count(), 3)
+        self.app.config['MYRECBLOG_TIMELINE_FANOUT_LIMIT'] = 5000
+        self.assertEqual(TimelineEntry.rebuild(), 5)
+        self.assertFalse(User.query.get(u3.id).timeline_pull)
+        self.assertEqual(u1.timeline(10), [own, second, first])
+
     def test_user_to_json(self):
         u = User(username='Sam', email='sam@example.com', confirmed=True,
                  password=bcrypt.generate_password_hash('Lylah').decode('utf-8' ))